@@ -1,62 +1,586 @@
-from psycopg import rows
-import psutil
 import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import psutil
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.find_N import _to_float, detect_time_columns
+from app.index_recommend import pretty_size
+
+logger = logging.getLogger(__name__)
+
+# --- Ресурсы сервера БД ---
+# задаются вручную, если сервер не даёт прочитать /proc (нет прав
+# pg_read_server_files) и приложение работает не на той же машине
+SERVER_RAM_GB = os.getenv("DB_SERVER_RAM_GB")
+SERVER_CPUS = os.getenv("DB_SERVER_CPUS")
+SERVER_STORAGE = os.getenv("DB_SERVER_STORAGE")  # "ssd" | "hdd"
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# --- Пороги правил ---
+SHARED_BUFFERS_RAM_SHARE = 0.25
+EFFECTIVE_CACHE_RAM_SHARE = 0.75
+CACHE_HIT_GOOD = 0.99  # при таком hit ratio рабочий набор уже в памяти
+WORK_MEM_RAM_SHARE = 0.25  # сколько памяти сверх shared_buffers отдаём под сортировки
+WORK_MEM_NODES_PER_QUERY = 2  # сортировок/хэшей в типичном плане
+WORK_MEM_MAX_MB = 1024
+MAINTENANCE_WORK_MEM_MAX_MB = 2048
+LONG_QUERY_MS = 100  # запрос дольше — аналитический, выигрывает от параллелизма
+ANALYTIC_SHARE = 0.3  # доля времени в долгих запросах для "аналитической" нагрузки
+# параллелизм: советуем, только если значение отличается от расчётного
+# больше чем во столько раз — формула грубая, настроенный сервер не трогаем
+PARALLEL_TOLERANCE = 2
+REQUESTED_CHECKPOINTS_MAX_SHARE = 0.1  # чекпойнтов по max_wal_size, не по таймеру
+SSD_RANDOM_PAGE_COST = 1.1
+SSD_IO_CONCURRENCY = 200
+
+SETTINGS = (
+    "max_connections",
+    "shared_buffers",
+    "effective_cache_size",
+    "work_mem",
+    "maintenance_work_mem",
+    "autovacuum_max_workers",
+    "random_page_cost",
+    "seq_page_cost",
+    "effective_io_concurrency",
+    "max_worker_processes",
+    "max_parallel_workers",
+    "max_parallel_workers_per_gather",
+    "max_parallel_maintenance_workers",
+    "max_wal_size",
+    "min_wal_size",
+    "checkpoint_timeout",
+    "checkpoint_completion_target",
+)
+
+# единица pg_settings.unit -> байт / миллисекунд
+_UNITS = {
+    "B": 1,
+    "kB": 1024,
+    "8kB": 8192,
+    "16kB": 16384,
+    "MB": 1024**2,
+    "16MB": 16 * 1024**2,
+    "ms": 1,
+    "s": 1000,
+    "min": 60_000,
+}
+
+
+# --- Чтение настроек и ресурсов ---
+def load_settings(cur) -> Dict[str, dict]:
+    """Все нужные параметры одним запросом к pg_settings."""
+    cur.execute(
+        """
+        SELECT name, setting, unit, context, source
+        FROM pg_settings
+        WHERE name = ANY(%s)
+        """,
+        (list(SETTINGS),),
+    )
+    return {r["name"]: dict(r) for r in cur.fetchall()}
+
+
+def setting_value(settings: Dict[str, dict], name: str) -> float:
+    """Значение в базовых единицах: байты для памяти, мс для времени."""
+    row = settings[name]
+    return float(row["setting"]) * _UNITS.get(row["unit"] or "", 1)
+
+
+def _pretty_ms(ms: float) -> str:
+    if ms % 60_000 == 0:
+        return f"{int(ms // 60_000)}min"
+    return f"{int(ms // 1000)}s"
+
+
+def _mb(n_bytes: float) -> str:
+    return f"{int(n_bytes // 1024**2)}MB"
+
+
+def _read_server_file(conn, path: str) -> Optional[str]:
+    # pg_read_file требует суперпользователя или pg_read_server_files
+    try:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_read_file(%s)", (path,))
+                return cur.fetchone()[0]
+    except Exception as e:
+        logger.debug(f"pg_read_file({path}) недоступен: {e}")
+        return None
+
+
+def _parse_meminfo(text: str) -> Optional[int]:
+    for line in text.splitlines():
+        if line.startswith("MemTotal:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def _parse_cgroup_memory(text: Optional[str]) -> Optional[int]:
+    value = (text or "").strip()
+    return int(value) if value.isdigit() else None
+
+
+def _parse_cgroup_cpus(text: Optional[str]) -> Optional[int]:
+    # cpu.max: "<quota> <period>" или "max <period>"
+    parts = (text or "").split()
+    if len(parts) == 2 and parts[0].isdigit():
+        return max(1, round(int(parts[0]) / int(parts[1])))
+    return None
 
-PARAMS = ["shared_buffers", "effective_cache_size", "work_mem", "maintenance_work_mem"]
 
+def detect_server_resources(conn, ram_gb=None, cpus=None) -> dict:
+    """
+    RAM и CPU сервера БД, по приоритету:
+    1. явно переданные значения или DB_SERVER_RAM_GB / DB_SERVER_CPUS;
+    2. /proc и cgroup сервера через pg_read_file;
+    3. ресурсы этой машины, если БД на localhost / unix-сокете.
+    Иначе — None: правила, зависящие от памяти, пропускаются.
+    """
+    ram = float(ram_gb or SERVER_RAM_GB or 0) * 1024**3 or None
+    cpu = int(cpus or SERVER_CPUS or 0) or None
+    source = "override" if ram or cpu else None
 
-def recommend_postgres_settings(ram_gb: int, max_connections: int):
-    ram_mb = ram_gb * 1024
+    caps = get_capabilities(conn)
+    can_read_files = caps["superuser"] or caps["read_server_files"]
+    if (ram is None or cpu is None) and can_read_files:
+        meminfo = _read_server_file(conn, "/proc/meminfo")
+        if meminfo:
+            source = source or "server"
+            if ram is None:
+                ram = _parse_meminfo(meminfo)
+                limit = _parse_cgroup_memory(
+                    _read_server_file(conn, "/sys/fs/cgroup/memory.max")
+                )
+                if ram and limit:
+                    ram = min(ram, limit)
+            if cpu is None:
+                cpuinfo = _read_server_file(conn, "/proc/cpuinfo") or ""
+                cpu = sum(1 for l in cpuinfo.splitlines() if l.startswith("processor"))
+                quota = _parse_cgroup_cpus(
+                    _read_server_file(conn, "/sys/fs/cgroup/cpu.max")
+                )
+                cpu = min(cpu, quota) if cpu and quota else cpu or quota
 
-    shared_buffers = int(ram_mb * 0.25)  # 25% от RAM
-    effective_cache_size = int(ram_mb * 0.75)  # 75% от RAM
-    work_mem = int(ram_mb * 0.25 / max_connections)  # на соединение
-    maintenance_work_mem = min(int(ram_mb * 0.05), 1024)  # до 1 GB
+    host = conn.info.host or ""
+    if (ram is None or cpu is None) and (host.startswith("/") or host in LOCAL_HOSTS):
+        source = source or "local"
+        ram = ram or psutil.virtual_memory().total
+        cpu = cpu or os.cpu_count()
 
     return {
-        "shared_buffers": f"{shared_buffers}MB",
-        "effective_cache_size": f"{effective_cache_size}MB",
-        "work_mem": f"{work_mem}MB",
-        "maintenance_work_mem": f"{maintenance_work_mem}MB",
+        "ram_bytes": int(ram) if ram else None,
+        "ram": pretty_size(ram) if ram else None,
+        "cpus": cpu,
+        "storage": (SERVER_STORAGE or "").lower() or None,
+        "source": source,
     }
 
 
-def get_postgres_recommendations(conn):
-    cur = conn.cursor(row_factory=rows.dict_row)
+def observe_workload(conn, settings: Dict[str, dict]) -> dict:
+    """
+    Наблюдаемая нагрузка с момента сброса статистики: временные файлы,
+    попадание в кэш, доля долгих запросов, объём WAL и причины чекпойнтов.
+    """
+    caps = get_capabilities(conn)
+    version = caps["server_version_num"]
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        cur.execute(
+            """
+            SELECT temp_files, temp_bytes, blks_hit, blks_read,
+                   extract(epoch FROM now() - coalesce(stats_reset,
+                           pg_postmaster_start_time())) AS stats_age_s
+            FROM pg_stat_database WHERE datname = current_database()
+            """
+        )
+        workload = dict(cur.fetchone())
+        hit, read = int(workload["blks_hit"] or 0), int(workload["blks_read"] or 0)
+        workload["cache_hit_ratio"] = (
+            round(hit / (hit + read), 4) if hit + read else None
+        )
 
-    # Получаем max_connections
-    cur.execute("SHOW max_connections;")
-    max_connections_row = cur.fetchone()
+        if version >= 170000:
+            cur.execute(
+                "SELECT num_timed AS timed, num_requested AS requested "
+                "FROM pg_stat_checkpointer"
+            )
+        else:
+            cur.execute(
+                "SELECT checkpoints_timed AS timed, checkpoints_req AS requested "
+                "FROM pg_stat_bgwriter"
+            )
+        checkpoints = cur.fetchone()
+        workload["checkpoints_timed"] = int(checkpoints["timed"] or 0)
+        workload["checkpoints_requested"] = int(checkpoints["requested"] or 0)
 
-    if max_connections_row is None:
-        print("Ошибка: не удалось получить значение max_connections.")
-        return
+        workload["wal_bytes"] = None
+        if version >= 140000:
+            cur.execute(
+                "SELECT wal_bytes, extract(epoch FROM now() - stats_reset) AS age_s "
+                "FROM pg_stat_wal"
+            )
+            wal = cur.fetchone()
+            if wal and wal["age_s"]:
+                workload["wal_bytes"] = int(wal["wal_bytes"])
+                workload["wal_bytes_per_hour"] = int(
+                    float(wal["wal_bytes"]) / float(wal["age_s"]) * 3600
+                )
 
-    max_connections = int(max_connections_row["max_connections"])
+    # pg_stat_statements может быть не установлен — тогда правила по
+    # длительности запросов просто не срабатывают
+    workload["long_query_time_share"] = None
+    if not caps["stat_time_columns"]:
+        return workload
+    try:
+        with conn.transaction():
+            with conn.cursor(row_factory=rows.dict_row) as cur:
+                total_col, mean_col = detect_time_columns(cur)
+                cur.execute(
+                    f"""
+                    SELECT sum({total_col}) AS total_ms,
+                           sum({total_col}) FILTER (WHERE {mean_col} >= %s) AS long_ms
+                    FROM pg_stat_statements
+                    """,
+                    (LONG_QUERY_MS,),
+                )
+                row = cur.fetchone()
+        total = _to_float(row["total_ms"])
+        if total:
+            workload["long_query_time_share"] = round(
+                _to_float(row["long_ms"]) / total, 3
+            )
+    except Exception as e:
+        logger.info(f"pg_stat_statements недоступен для советов по настройке: {e}")
+    return workload
 
-    # Получаем объем RAM на сервере
-    total_ram_gb = round(psutil.virtual_memory().total / (1024**3))
 
-    # Рекомендуемые настройки
-    recommended = recommend_postgres_settings(total_ram_gb, max_connections)
+# --- Правила ---
+def _current(settings, name) -> str:
+    unit = settings[name]["unit"] or ""
+    if unit in ("ms", "s", "min"):
+        return _pretty_ms(setting_value(settings, name))
+    if unit:
+        return _mb(setting_value(settings, name))
+    return settings[name]["setting"]
 
-    # Получаем текущие настройки в PostgreSQL
-    current = {}
-    for param in PARAMS:
-        cur.execute(f"SHOW {param};")
-        row = cur.fetchone()
-        if row is not None and param in row:
-            current[param] = row[param]
 
-    print("PostgreSQL settings (current vs recommended):")
-    result = {}
-    for param in PARAMS:
-        result[param] = {
-            "current": current.get(param),
-            "recommended": recommended.get(param),
-        }
+def _rec(settings, name, recommended, reason, impact) -> dict:
+    return {
+        "parameter": name,
+        "current": _current(settings, name),
+        "recommended": recommended,
+        "reason": reason,
+        "impact": impact,
+        "requires_restart": settings[name]["context"] == "postmaster",
+    }
+
+
+def _memory_rules(settings, server, workload) -> List[dict]:
+    recs = []
+    ram = server["ram_bytes"]
+    if not ram:
+        return recs
+    shared_buffers = setting_value(settings, "shared_buffers")
+    hit_ratio = workload["cache_hit_ratio"]
+
+    target_sb = ram * SHARED_BUFFERS_RAM_SHARE
+    if shared_buffers < target_sb * 0.5 and (
+        hit_ratio is None or hit_ratio < CACHE_HIT_GOOD
+    ):
+        recs.append(
+            _rec(
+                settings,
+                "shared_buffers",
+                _mb(target_sb),
+                f"hit ratio {hit_ratio} при shared_buffers {pretty_size(shared_buffers)} "
+                f"из {server['ram']} RAM",
+                "меньше чтений с диска для горячих таблиц и индексов",
+            )
+        )
+        shared_buffers = target_sb
+
+    target_ecs = ram * EFFECTIVE_CACHE_RAM_SHARE
+    ecs = setting_value(settings, "effective_cache_size")
+    if abs(ecs - target_ecs) > target_ecs * 0.25:
+        recs.append(
+            _rec(
+                settings,
+                "effective_cache_size",
+                _mb(target_ecs),
+                f"оценка кэша ОС + shared_buffers для {server['ram']} RAM",
+                "планировщик точнее выбирает между индексным и последовательным чтением",
+            )
+        )
+
+    # work_mem — от реальных сбросов во временные файлы, в пределах бюджета памяти
+    max_connections = int(settings["max_connections"]["setting"])
+    budget = (
+        (ram - shared_buffers)
+        * WORK_MEM_RAM_SHARE
+        / (max_connections * WORK_MEM_NODES_PER_QUERY)
+    )
+    work_mem = setting_value(settings, "work_mem")
+    temp_files = int(workload["temp_files"] or 0)
+    if temp_files:
+        avg_spill = int(workload["temp_bytes"] or 0) / temp_files
+        # сортировка в памяти занимает больше, чем её файл на диске
+        wanted = min(
+            max(avg_spill * 2, work_mem * 2), budget, WORK_MEM_MAX_MB * 1024**2
+        )
+        if wanted > work_mem * 1.25:
+            recs.append(
+                _rec(
+                    settings,
+                    "work_mem",
+                    _mb(wanted),
+                    f"{temp_files} временных файлов, в среднем {pretty_size(avg_spill)} "
+                    f"на сброс; бюджет {pretty_size(budget)} на операцию при "
+                    f"max_connections={max_connections}",
+                    "сортировки и хэши перестают уходить на диск (temp_files в "
+                    "pg_stat_database должны расти медленнее)",
+                )
+            )
+    elif work_mem > budget:
+        recs.append(
+            _rec(
+                settings,
+                "work_mem",
+                _mb(max(budget, 4 * 1024**2)),
+                f"сбросов на диск нет, а {pretty_size(work_mem)} x {max_connections} "
+                f"соединений может превысить RAM",
+                "защита от OOM при пике соединений",
+            )
+        )
+
+    maintenance = setting_value(settings, "maintenance_work_mem")
+    workers = int(settings["autovacuum_max_workers"]["setting"])
+    target_mwm = min(ram * 0.05, MAINTENANCE_WORK_MEM_MAX_MB * 1024**2)
+    # выделяется каждому воркеру autovacuum одновременно
+    if maintenance < target_mwm * 0.5 and target_mwm * workers < ram * 0.25:
+        recs.append(
+            _rec(
+                settings,
+                "maintenance_work_mem",
+                _mb(target_mwm),
+                f"{server['ram']} RAM, {workers} воркеров autovacuum",
+                "быстрее VACUUM и CREATE INDEX (меньше проходов по индексам)",
+            )
+        )
+    return recs
+
+
+def _io_rules(settings, server, workload) -> List[dict]:
+    recs = []
+    storage = server["storage"]
+    hit_ratio = workload["cache_hit_ratio"]
+    rpc = float(settings["random_page_cost"]["setting"])
+    if rpc > 2 and (storage == "ssd" or (hit_ratio or 0) >= CACHE_HIT_GOOD):
+        why = (
+            "хранилище — SSD"
+            if storage == "ssd"
+            else f"hit ratio {hit_ratio}: случайное чтение почти всегда из памяти"
+        )
+        recs.append(
+            _rec(
+                settings,
+                "random_page_cost",
+                str(SSD_RANDOM_PAGE_COST),
+                why,
+                "планировщик перестаёт недооценивать индексные сканы",
+            )
+        )
+    eic = int(settings["effective_io_concurrency"]["setting"])
+    if storage == "ssd" and eic < SSD_IO_CONCURRENCY:
+        recs.append(
+            _rec(
+                settings,
+                "effective_io_concurrency",
+                str(SSD_IO_CONCURRENCY),
+                "SSD обрабатывает много параллельных запросов чтения",
+                "быстрее Bitmap Heap Scan за счёт предвыборки страниц",
+            )
+        )
+    return recs
+
+
+def _parallel_rules(settings, server, workload) -> List[dict]:
+    recs = []
+    cpus = server["cpus"]
+    if not cpus:
+        return recs
+    share = workload["long_query_time_share"]
+    analytic = share is not None and share >= ANALYTIC_SHARE
+    # короткие OLTP-запросы от параллелизма только теряют (запуск воркеров)
+    per_gather = max(1, min(cpus // 2, 8)) if analytic else min(2, max(cpus // 4, 1))
+    workers = cpus
 
-    print(json.dumps(result, indent=4))
+    current = int(settings["max_parallel_workers_per_gather"]["setting"])
+    # аналитике вредна нехватка воркеров, коротким запросам — избыток
+    if (
+        current * PARALLEL_TOLERANCE < per_gather
+        if analytic
+        else current > per_gather * PARALLEL_TOLERANCE
+    ):
+        reason = (
+            f"{share:.0%} времени — запросы дольше {LONG_QUERY_MS} мс"
+            if analytic
+            else "нагрузка из коротких запросов"
+            if share is not None
+            else "по числу CPU (pg_stat_statements недоступен)"
+        )
+        recs.append(
+            _rec(
+                settings,
+                "max_parallel_workers_per_gather",
+                str(per_gather),
+                f"{reason}, CPU: {cpus}",
+                "долгие сканы и агрегаты делятся между ядрами"
+                if per_gather > current
+                else "меньше конкуренции за CPU между параллельными воркерами",
+            )
+        )
+    current = int(settings["max_parallel_workers"]["setting"])
+    if current > workers * PARALLEL_TOLERANCE or current * PARALLEL_TOLERANCE < workers:
+        recs.append(
+            _rec(
+                settings,
+                "max_parallel_workers",
+                str(workers),
+                f"CPU сервера: {cpus}",
+                "параллельные воркеры не превышают число ядер"
+                if current > workers
+                else "параллельные планы используют все ядра",
+            )
+        )
+    if int(settings["max_worker_processes"]["setting"]) < workers:
+        recs.append(
+            _rec(
+                settings,
+                "max_worker_processes",
+                str(workers),
+                "должно быть не меньше max_parallel_workers",
+                "иначе параллельные планы не получат воркеров",
+            )
+        )
+    maint = min(4, max(cpus // 2, 1))
+    if int(settings["max_parallel_maintenance_workers"]["setting"]) < maint:
+        recs.append(
+            _rec(
+                settings,
+                "max_parallel_maintenance_workers",
+                str(maint),
+                f"CPU сервера: {cpus}",
+                "быстрее CREATE INDEX и VACUUM индексов",
+            )
+        )
+    return recs
 
+
+def _wal_rules(settings, server, workload) -> List[dict]:
+    recs = []
+    timed = workload["checkpoints_timed"]
+    requested = workload["checkpoints_requested"]
+    total = timed + requested
+    max_wal = setting_value(settings, "max_wal_size")
+    timeout_ms = setting_value(settings, "checkpoint_timeout")
+
+    if total and requested / total > REQUESTED_CHECKPOINTS_MAX_SHARE:
+        per_hour = workload.get("wal_bytes_per_hour")
+        if per_hour:
+            # WAL за checkpoint_timeout с запасом: чекпойнт должен идти по таймеру
+            wanted = per_hour * timeout_ms / 3_600_000 * 2
+        else:
+            wanted = max_wal * 2
+        wanted_gb = max(int(-(-wanted // 1024**3)), 1)
+        if wanted_gb * 1024**3 > max_wal:
+            recs.append(
+                _rec(
+                    settings,
+                    "max_wal_size",
+                    f"{wanted_gb}GB",
+                    f"{requested} из {total} чекпойнтов запущены по объёму WAL"
+                    + (f", WAL ~{pretty_size(per_hour)}/ч" if per_hour else ""),
+                    "реже чекпойнты и меньше full-page writes после каждого",
+                )
+            )
+    if float(settings["checkpoint_completion_target"]["setting"]) < 0.9:
+        recs.append(
+            _rec(
+                settings,
+                "checkpoint_completion_target",
+                "0.9",
+                "запись чекпойнта растягивается на 90% интервала",
+                "сглаживает пики ввода-вывода во время чекпойнта",
+            )
+        )
+    if (
+        workload.get("wal_bytes_per_hour")
+        and timeout_ms < 15 * 60_000
+        and workload["wal_bytes_per_hour"] > max_wal
+    ):
+        recs.append(
+            _rec(
+                settings,
+                "checkpoint_timeout",
+                _pretty_ms(15 * 60_000),
+                f"WAL ~{pretty_size(workload['wal_bytes_per_hour'])}/ч при "
+                f"checkpoint_timeout {_pretty_ms(timeout_ms)}",
+                "меньше полных образов страниц в WAL (ценой более долгого восстановления)",
+            )
+        )
+    return recs
+
+
+RULES = (_memory_rules, _io_rules, _parallel_rules, _wal_rules)
+
+
+def get_postgres_recommendations(conn, ram_gb=None, cpus=None):
+    """
+    Советы по postgresql.conf для сервера БД: ресурсы берутся с самого
+    сервера (или из переопределения), значения — из наблюдаемой нагрузки.
+    У каждого совета есть причина (reason) и ожидаемый эффект (impact).
+    """
+    cur = conn.cursor(row_factory=rows.dict_row)
+    settings = load_settings(cur)
     cur.close()
-    return result
\ No newline at end of file
+    conn.rollback()
+
+    server = detect_server_resources(conn, ram_gb, cpus)
+    workload = observe_workload(conn, settings)
+    conn.rollback()
+
+    notes = []
+    if not server["ram_bytes"]:
+        notes.append(
+            "⚠️ RAM сервера БД неизвестна (нет доступа к /proc через pg_read_file) — "
+            "правила по памяти пропущены. Укажите DB_SERVER_RAM_GB или ram_gb."
+        )
+    if not server["cpus"]:
+        notes.append(
+            "⚠️ Число CPU сервера неизвестно — правила параллелизма пропущены. "
+            "Укажите DB_SERVER_CPUS или cpus."
+        )
+    if not server["storage"]:
+        notes.append(
+            "ℹ️ Тип дисков неизвестен: effective_io_concurrency не настраивается. "
+            "Укажите DB_SERVER_STORAGE=ssd|hdd."
+        )
+
+    recommendations = []
+    for rule in RULES:
+        recommendations.extend(rule(settings, server, workload))
+
+    result = {
+        "server": server,
+        "workload": workload,
+        "recommendations": recommendations,
+        "notes": notes,
+    }
+    print("PostgreSQL settings (current vs recommended):")
+    print(json.dumps(result, indent=4, ensure_ascii=False, default=str))
+    return result
@@ -0,0 +1,334 @@
+# activity_sampler.py
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.fingerprint import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры сэмплирования ---
+ACTIVITY_SAMPLE_SECONDS = 10.0  # окно по умолчанию
+ACTIVITY_SAMPLE_MAX_SECONDS = 60.0
+ACTIVITY_INTERVAL_MS = 10.0  # опрос pg_stat_activity ~100 раз в секунду
+ACTIVITY_MIN_INTERVAL_MS = 5.0  # чаще — сэмплер сам нагружает наблюдаемую базу
+BURST_GAP_MS = 100.0  # вне транзакции: пауза больше — новая "пачка" запросов
+BURST_MIN_EXECUTIONS = 5  # столько одинаковых запросов подряд — уже N+1
+TOP_BURSTS = 20
+PROGRESS_INTERVAL_S = 1.0  # как часто сообщать о ходе сэмплирования
+
+HIDDEN_QUERY = "<insufficient privilege>"
+# служебные команды транзакций не бывают ни всплеском, ни родителем
+_TRANSACTION_COMMANDS = (
+    "begin",
+    "start",
+    "commit",
+    "end",
+    "rollback",
+    "savepoint",
+    "release",
+)
+
+_ACTIVITY_SQL = """
+SELECT pid, backend_start, xact_start, query_start, state,
+       {query_id} AS query_id, query
+FROM pg_stat_activity
+WHERE backend_type = 'client backend'
+  AND pid <> pg_backend_pid()
+  AND datname = current_database()
+  AND query_start IS NOT NULL
+"""
+
+BackendKey = Tuple[int, object]  # (pid, backend_start): pid может переиспользоваться
+
+
+def _execution_key(row: dict) -> str:
+    # query_id (PG14+, compute_query_id) совпадает с queryid pg_stat_statements
+    if row["query_id"] is not None:
+        return str(row["query_id"])
+    return fingerprint(row["query"] or "")
+
+
+def _is_transaction_command(query: str) -> bool:
+    words = (query or "").split(None, 1)
+    return bool(words) and words[0].rstrip(";").lower() in _TRANSACTION_COMMANDS
+
+
+def sample_activity(
+    conn,
+    duration_s: float = ACTIVITY_SAMPLE_SECONDS,
+    interval_ms: float = ACTIVITY_INTERVAL_MS,
+    progress=None,
+    cancelled=None,
+) -> dict:
+    """
+    Опрашивает pg_stat_activity duration_s секунд. Выполнение запроса
+    узнаётся по (pid, backend_start, query_start): пока бэкенд не начал
+    следующий запрос, он показывает предыдущий (в т.ч. в состоянии idle),
+    поэтому быстрые запросы видны, если опрос успел между ними.
+    cancelled() -> True останавливает опрос (клиент ушёл).
+    """
+    caps = get_capabilities(conn)
+    query_id = "query_id" if caps["server_version_num"] >= 140000 else "NULL::bigint"
+    sql = _ACTIVITY_SQL.format(query_id=query_id)
+    executions: Dict[BackendKey, Dict[object, dict]] = {}
+    hidden = samples = 0
+
+    # в транзакции pg_stat_activity — снимок на момент первого обращения
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    started = time.monotonic()
+    deadline = started + duration_s
+    reported = started
+    try:
+        with conn.cursor(row_factory=rows.dict_row) as cur:
+            while time.monotonic() < deadline:
+                if cancelled is not None and cancelled():
+                    break
+                tick = time.monotonic()
+                cur.execute(sql)
+                samples += 1
+                for row in cur.fetchall():
+                    if row["query"] == HIDDEN_QUERY:
+                        hidden += 1
+                        continue
+                    if _is_transaction_command(row["query"]):
+                        continue
+                    backend = executions.setdefault(
+                        (row["pid"], row["backend_start"]), {}
+                    )
+                    if row["query_start"] not in backend:
+                        backend[row["query_start"]] = {
+                            "key": _execution_key(row),
+                            "query": row["query"],
+                            "query_start": row["query_start"],
+                            "xact_start": row["xact_start"],
+                        }
+                if progress and tick - reported >= PROGRESS_INTERVAL_S:
+                    reported = tick
+                    progress(
+                        "progress",
+                        {
+                            "stage": "sampling",
+                            "elapsed_s": round(tick - started, 1),
+                            "duration_s": duration_s,
+                            "samples": samples,
+                            "executions": sum(len(b) for b in executions.values()),
+                        },
+                    )
+                time.sleep(max(0.0, interval_ms / 1000 - (time.monotonic() - tick)))
+    finally:
+        conn.autocommit = autocommit
+
+    elapsed = time.monotonic() - started
+    return {
+        "duration_s": round(elapsed, 2),
+        "samples": samples,
+        "interval_ms": round(elapsed * 1000 / samples, 2) if samples else None,
+        "hidden_rows": hidden,
+        "executions": {
+            backend: sorted(found.values(), key=lambda e: e["query_start"])
+            for backend, found in executions.items()
+        },
+    }
+
+
+def _explicit_transaction(e: dict) -> bool:
+    # у одиночного запроса вне BEGIN xact_start = query_start (или NULL в idle)
+    return e["xact_start"] is not None and e["xact_start"] < e["query_start"]
+
+
+def _groups(execs: List[dict], gap_ms: float) -> List[List[dict]]:
+    """Делит выполнения одного бэкенда на транзакции / плотные серии."""
+    groups: List[List[dict]] = []
+    for e in execs:
+        if groups:
+            prev = groups[-1][-1]
+            if _explicit_transaction(e) and _explicit_transaction(prev):
+                # граница транзакций надёжнее любых пауз
+                same = e["xact_start"] == prev["xact_start"]
+            else:
+                gap = (e["query_start"] - prev["query_start"]).total_seconds() * 1000
+                same = gap <= gap_ms
+            if same:
+                groups[-1].append(e)
+                continue
+        groups.append([e])
+    return groups
+
+
+def find_bursts(
+    executions: Dict[BackendKey, List[dict]],
+    gap_ms: float = BURST_GAP_MS,
+    min_executions: int = BURST_MIN_EXECUTIONS,
+) -> List[dict]:
+    """
+    Всплески одного запроса внутри транзакции или плотной серии на одном
+    бэкенде. Родитель — последний неповторяющийся запрос перед первым
+    выполнением всплеска (обычно он вернул список, по которому идёт цикл).
+    """
+    bursts = []
+    for (pid, _), execs in executions.items():
+        for group in _groups(execs, gap_ms):
+            counts = Counter(e["key"] for e in group)
+            repeated = {k for k, n in counts.items() if n >= min_executions}
+            for key in repeated:
+                fanout = counts[key]
+                first = next(i for i, e in enumerate(group) if e["key"] == key)
+                # соседние запросы того же цикла (тоже повторяются) — не родитель
+                parent = next(
+                    (e for e in reversed(group[:first]) if e["key"] not in repeated),
+                    None,
+                )
+                bursts.append(
+                    {
+                        "key": key,
+                        "query": group[first]["query"],
+                        "pid": pid,
+                        "fanout": fanout,
+                        "in_transaction": _explicit_transaction(group[first]),
+                        "span_ms": round(
+                            (
+                                group[-1]["query_start"] - group[first]["query_start"]
+                            ).total_seconds()
+                            * 1000,
+                            2,
+                        ),
+                        "parent_key": parent["key"] if parent else None,
+                        "parent_query": parent["query"] if parent else None,
+                    }
+                )
+    return bursts
+
+
+def summarize_bursts(bursts: List[dict], top: int = TOP_BURSTS) -> List[dict]:
+    """Сводка по запросам: сколько всплесков, их размер и типичный родитель."""
+    by_key: Dict[str, dict] = {}
+    for b in bursts:
+        s = by_key.setdefault(
+            b["key"],
+            {
+                "key": b["key"],
+                "query_snippet": (b["query"] or "").replace("\n", " ")[:300],
+                "bursts": 0,
+                "executions": 0,
+                "max_fanout": 0,
+                "backends": set(),
+                "in_transaction": 0,
+                "parents": Counter(),
+                "_parent_text": {},
+            },
+        )
+        s["bursts"] += 1
+        s["executions"] += b["fanout"]
+        s["max_fanout"] = max(s["max_fanout"], b["fanout"])
+        s["backends"].add(b["pid"])
+        s["in_transaction"] += b["in_transaction"]
+        if b["parent_key"]:
+            s["parents"][b["parent_key"]] += 1
+            s["_parent_text"][b["parent_key"]] = b["parent_query"]
+
+    result = []
+    for s in by_key.values():
+        parents = [
+            {
+                "key": key,
+                "query_snippet": (s["_parent_text"][key] or "").replace("\n", " ")[
+                    :300
+                ],
+                "bursts": count,
+            }
+            for key, count in s["parents"].most_common(3)
+        ]
+        result.append(
+            {
+                "key": s["key"],
+                "query_snippet": s["query_snippet"],
+                "bursts": s["bursts"],
+                "executions": s["executions"],
+                "avg_fanout": round(s["executions"] / s["bursts"], 1),
+                "max_fanout": s["max_fanout"],
+                "backends": len(s["backends"]),
+                "in_transaction": s["in_transaction"],
+                "likely_parents": parents,
+                "suggestion": (
+                    "Запрос выполняется в цикле по результату родительского — "
+                    "замените цикл одним запросом с JOIN или WHERE ... = ANY($1)."
+                ),
+            }
+        )
+    result.sort(key=lambda s: (-s["executions"], -s["max_fanout"]))
+    return result[:top]
+
+
+def sample_n_plus_one(
+    conn,
+    duration_s: float = ACTIVITY_SAMPLE_SECONDS,
+    interval_ms: float = ACTIVITY_INTERVAL_MS,
+    progress=None,
+    cancelled=None,
+):
+    """
+    N+1 по реальным выполнениям: серии одинаковых запросов от одного
+    бэкенда в одной транзакции или коротком промежутке времени.
+    progress(event, data) — для потоковой выдачи: ход опроса и всплески.
+    cancelled() — для обычного ответа: клиент ушёл, опрос пора прервать.
+    """
+    duration_s = min(max(duration_s, 0.1), ACTIVITY_SAMPLE_MAX_SECONDS)
+    interval_ms = max(interval_ms, ACTIVITY_MIN_INTERVAL_MS)
+    print(f"\nСэмплирование pg_stat_activity: {duration_s} с")
+    sampled = sample_activity(conn, duration_s, interval_ms, progress, cancelled)
+    executions = sampled.pop("executions")
+    summary = summarize_bursts(find_bursts(executions))
+    if progress:
+        for s in summary:
+            progress("burst", s)
+
+    notes = [
+        "Быстрые запросы видны только если опрос попал между ними — "
+        "размер всплеска (fanout) — нижняя оценка.",
+    ]
+    if sampled["hidden_rows"]:
+        notes.append(
+            "⚠️ Часть сессий скрыта (<insufficient privilege>): для чужих запросов "
+            "нужна роль pg_read_all_stats."
+        )
+    caps = get_capabilities(conn)
+    if caps["server_version_num"] >= 140000 and caps["compute_query_id"] == "off":
+        notes.append(
+            "ℹ️ compute_query_id = off: выполнения группируются по отпечатку текста, "
+            "а не по query_id."
+        )
+    limit = caps["track_activity_query_size"]
+    if any(
+        len((e["query"] or "").encode()) >= limit - 1
+        for execs in executions.values()
+        for e in execs
+    ):
+        notes.append(
+            f"⚠️ Текст запросов обрезан до track_activity_query_size = {limit} байт: "
+            "разные запросы с общим началом могут слиться в один."
+        )
+    result = {
+        **sampled,
+        "backends": len(executions),
+        "executions_observed": sum(len(e) for e in executions.values()),
+        "bursts": summary,
+        "notes": notes,
+    }
+
+    if not summary:
+        print("Всплесков одинаковых запросов не найдено.")
+    for i, s in enumerate(summary, 1):
+        print(
+            f"\n[{i}] {s['bursts']} всплесков, fanout до {s['max_fanout']} "
+            f"(в среднем {s['avg_fanout']}), бэкендов: {s['backends']}"
+        )
+        print("snippet:", s["query_snippet"])
+        if s["likely_parents"]:
+            print("parent:", s["likely_parents"][0]["query_snippet"])
+    return result
@@ -0,0 +1,214 @@
+# analysis_cache.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Tuple
+
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.observability import register_cache
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))  # записей
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "600"))  # сек
+RESULT_CACHE_SIZE = 256  # результатов анализаторов по всем целям
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "60"))  # сек
+
+MISS = object()  # отличает "нет в кэше" от закэшированного None
+
+
+class AnalysisCache:
+    """
+    Ограниченный LRU-кэш с временем жизни записей.
+    При переполнении вытесняется давно не использованная запись,
+    устаревшие (старше ttl) записи считаются промахом и удаляются.
+    """
+
+    def __init__(
+        self, maxsize: int = ANALYSIS_CACHE_SIZE, ttl: float = ANALYSIS_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Значение по ключу или MISS."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISS
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None) -> None:
+        """Удаляет все записи (или только те, чей ключ удовлетворяет predicate)."""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+# Кэш результатов статического анализа запросов (рекомендации по индексам
+# и по тексту запроса). Ключ — (цель подключения, fingerprint запроса).
+static_cache = AnalysisCache()
+
+
+# --- Кэш результатов анализаторов по каталогу ---
+# Всё, что читают анализаторы статистики, обнуляется при рестарте сервера и
+# сбросе статистики; пороги зависят от настроек. Токен меняется вместе с ними.
+_TOKEN_SQL = """
+SELECT pg_postmaster_start_time() AS started,
+       {statements_reset} AS statements_reset,
+       (SELECT stats_reset FROM pg_stat_database
+        WHERE datname = current_database()) AS database_reset,
+       (SELECT md5(string_agg(name || '=' || setting, ',' ORDER BY name))
+        FROM pg_settings WHERE name = ANY(%s)) AS settings
+"""
+
+
+def invalidation_token(conn, settings: Iterable[str] = ()) -> tuple:
+    """
+    Версия данных цели: рестарт, сброс pg_stat_statements и статистики базы,
+    значения settings из pg_settings. Один лёгкий запрос.
+    """
+    statements_reset = (
+        "(SELECT stats_reset FROM pg_stat_statements_info)"
+        if get_capabilities(conn)["has_stat_statements_info"]
+        else "NULL::timestamptz"
+    )
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        cur.execute(
+            _TOKEN_SQL.format(statements_reset=statements_reset), (list(settings),)
+        )
+        row = cur.fetchone()
+    return (
+        row["started"],
+        row["statements_reset"],
+        row["database_reset"],
+        row["settings"],
+    )
+
+
+class ResultCache(AnalysisCache):
+    """
+    Кэш результатов дорогих анализаторов с объединением запросов:
+    - запись живёт ttl секунд и пока не изменился токен цели (invalidation_token);
+    - одинаковые запросы, пришедшие во время вычисления, ждут его же
+      (single-flight), а не запускают свои сканирования;
+    - общее вычисление не отменяется, если ушёл клиент, который его начал.
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self._inflight: Dict[Hashable, Tuple[Any, asyncio.Future]] = {}
+        self.coalesced = 0
+        self.token_changes = 0
+
+    def put(self, key: Hashable, value: Any, token: Any = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value, token)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def _fresh(self, key: Hashable, token: Any):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[2] != token or now - entry[0] > self.ttl:
+                if entry[2] != token:
+                    self.token_changes += 1
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1], now - entry[0]
+
+    async def get_or_compute(
+        self, key: Hashable, token: Any, compute: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, dict]:
+        """
+        (результат, сведения о кэше): hit — взят из кэша, shared — дождались
+        чужого вычисления, age_seconds — возраст данных.
+        """
+        cached = self._fresh(key, token)
+        if cached is not None:
+            value, age = cached
+            return value, {"hit": True, "shared": False, "age_seconds": round(age, 1)}
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            shared = pending is not None and pending[0] == token
+            if shared:
+                task = pending[1]
+                self.coalesced += 1
+            else:
+                task = asyncio.ensure_future(self._compute(key, token, compute))
+                self._inflight[key] = (token, task)
+                self.misses += 1
+        value, created = await asyncio.shield(task)
+        age = time.monotonic() - created
+        return value, {"hit": False, "shared": shared, "age_seconds": round(age, 1)}
+
+    async def _compute(self, key, token, compute):
+        try:
+            created = time.monotonic()
+            value = await compute()
+            self.put(key, value, token)
+            return value, created
+        finally:
+            with self._lock:
+                if self._inflight.get(key, (None, None))[1] is asyncio.current_task():
+                    del self._inflight[key]
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats["in_flight"] = len(self._inflight)
+        stats["coalesced"] = self.coalesced
+        stats["token_changes"] = self.token_changes
+        return stats
+
+
+# Кэш результатов анализаторов статистики (analyze_stats, тюнинг, N+1).
+# Ключ — (анализатор, цель подключения, параметры запроса).
+result_cache = ResultCache()
+register_cache("static_analysis", static_cache.stats)
+register_cache("analysis_results", result_cache.stats)
@@ -0,0 +1,204 @@
+# batch_analysis.py
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from psycopg import rows
+
+from app.analysis_cache import MISS, static_cache
+from app.find_N import _to_float, detect_time_columns
+from app.fingerprint import fingerprint
+from app.index_recommend import recommend_indexes
+from app.query_recommend import analyze_sql
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры пакетного анализа ---
+BATCH_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # процессов под разбор SQL
+BATCH_CHUNK_SIZE = 200  # запросов в одной задаче процесса
+BATCH_MAX_STATEMENTS = 50_000  # потолок выборки из pg_stat_statements
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn, а не fork: в основном процессе уже живут потоки пулов
+        # соединений и сэмплеров, форкать их небезопасно
+        _process_pool = ProcessPoolExecutor(
+            max_workers=BATCH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+# --- Сбор нагрузки ---
+def fetch_statements(conn, limit: int = BATCH_MAX_STATEMENTS) -> List[dict]:
+    """Все запросы из pg_stat_statements, самые "дорогие" по суммарному времени — первыми."""
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        total_col, _ = detect_time_columns(cur)
+        cur.execute(
+            f"""
+            SELECT queryid, query, calls, {total_col} AS total_time_ms
+            FROM pg_stat_statements
+            WHERE query IS NOT NULL AND query <> ''
+            ORDER BY {total_col} DESC
+            LIMIT %s
+            """,
+            (limit,),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+
+def build_workload(
+    queries: List[str], stat_rows: List[dict], fingerprints: List[str]
+) -> List[dict]:
+    """
+    Сводит запросы к уникальным по fingerprint. fingerprints идут в том же
+    порядке, что stat_rows, а затем queries. Отпечаток различает форму
+    шаблона LIKE ('%x' и 'x%'), поэтому такие варианты анализируются
+    отдельно, а не по тексту первого из них. Вес записи — суммарное время
+    из pg_stat_statements; для запросов из списка без статистики весом
+    служит число повторов.
+    """
+    items: Dict[str, dict] = {}
+    fps = iter(fingerprints)
+
+    def add(query: str, calls: int, total_ms: float, queryid=None):
+        fp = next(fps)
+        item = items.get(fp)
+        if item is None:
+            item = {
+                "fingerprint": fp,
+                "query": query,
+                "queryids": [],
+                "variants": 0,
+                "calls": 0,
+                "total_time_ms": 0.0,
+            }
+            items[fp] = item
+        item["variants"] += 1
+        item["calls"] += calls
+        item["total_time_ms"] += total_ms
+        if queryid is not None:
+            item["queryids"].append(queryid)
+
+    for r in stat_rows:
+        add(
+            r.get("query") or "",
+            int(r.get("calls") or 0),
+            _to_float(r.get("total_time_ms")),
+            r.get("queryid"),
+        )
+    for q in queries:
+        add(q, 1, 0.0)
+
+    workload = list(items.values())
+    total_time = sum(i["total_time_ms"] for i in workload)
+    for item in workload:
+        item["weight"] = (
+            round(item["total_time_ms"] / total_time, 4) if total_time else 0.0
+        )
+    workload.sort(key=lambda i: (-i["total_time_ms"], -i["variants"]))
+    return workload
+
+
+async def prepare_workload(queries: List[str], stat_rows: List[dict]) -> List[dict]:
+    """Считает отпечатки в пуле процессов и сводит нагрузку (build_workload)."""
+    queries = [q for q in queries if q and q.strip()]
+    texts = [r.get("query") or "" for r in stat_rows] + queries
+    fingerprints = []
+    for future in _submit_chunks(_fingerprint_chunk, texts):
+        fingerprints.extend(await future)
+    return build_workload(queries, stat_rows, fingerprints)
+
+
+# --- Работа дочерних процессов ---
+def _submit_chunks(func, texts: List[str], chunk_size: int = BATCH_CHUNK_SIZE):
+    """Раздаёт func(пачка текстов) в пул процессов, возвращает futures по порядку."""
+    loop = asyncio.get_running_loop()
+    chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    # мелкий пакет дешевле разобрать в потоке, чем поднимать процессы
+    pool = None if len(chunks) <= 1 else _get_process_pool()
+    return [loop.run_in_executor(pool, func, chunk) for chunk in chunks]
+
+
+def _fingerprint_chunk(texts: List[str]) -> List[str]:
+    return [fingerprint(t) for t in texts]
+
+
+def analyze_one(query: str) -> dict:
+    return {
+        "query_recommendations": analyze_sql(query),
+        "index_recommendations": recommend_indexes(query),
+    }
+
+
+def _analyze_chunk(queries: List[str]) -> List[dict]:
+    result = []
+    for q in queries:
+        try:
+            result.append(analyze_one(q))
+        except Exception as e:  # один кривой запрос не должен ронять весь пакет
+            result.append({"error": f"❌ Ошибка разбора: {e}"})
+    return result
+
+
+def _cache_key(fp: str) -> tuple:
+    # статический разбор не зависит от цели подключения
+    return ("analyze_batch", fp)
+
+
+async def iter_batch_results(workload: List[dict], chunk_size: int = BATCH_CHUNK_SIZE):
+    """
+    Асинхронно отдаёт результаты в порядке веса (порядке workload).
+    Незакэшированные запросы сразу раздаются пачками в пул процессов,
+    результат каждой записи выдаётся, как только готова её пачка.
+    """
+    cached_results: Dict[int, dict] = {}
+    pending: List[int] = []
+    for n, item in enumerate(workload):
+        cached = static_cache.get(_cache_key(item["fingerprint"]))
+        if cached is MISS:
+            pending.append(n)
+        else:
+            cached_results[n] = cached
+
+    chunks = [pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    futures = _submit_chunks(
+        _analyze_chunk, [workload[n]["query"] for n in pending], chunk_size
+    )
+    # номер записи -> (номер пачки, позиция в пачке)
+    placement = {
+        n: (c, j) for c, chunk in enumerate(chunks) for j, n in enumerate(chunk)
+    }
+    logger.info(
+        f"Пакетный анализ: {len(workload)} уникальных запросов, "
+        f"из кэша {len(cached_results)}, пачек {len(chunks)}"
+    )
+
+    try:
+        for n, item in enumerate(workload):
+            if n in cached_results:
+                yield {**item, **cached_results[n], "cached": True}
+                continue
+            c, j = placement[n]
+            analysis = (await futures[c])[j]
+            if "error" not in analysis:
+                static_cache.put(_cache_key(item["fingerprint"]), analysis)
+            yield {**item, **analysis, "cached": False}
+    finally:
+        # клиент ушёл посреди потока — не держим процессы зря
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,110 @@
+# capabilities.py
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from psycopg import rows
+from psycopg.pq import TransactionStatus
+
+logger = logging.getLogger(__name__)
+
+CapabilityKey = Tuple[
+    str, int, str, str
+]  # как db_pool.target_key: host, port, db, user
+
+_PROFILE_SQL = """
+SELECT current_setting('server_version_num')::int AS server_version_num,
+       current_setting('server_version') AS server_version,
+       pg_is_in_recovery() AS in_recovery,
+       current_setting('default_transaction_read_only') = 'on' AS default_read_only,
+       current_setting('track_io_timing') = 'on' AS track_io_timing,
+       (SELECT setting::int FROM pg_settings
+        WHERE name = 'track_activity_query_size') AS track_activity_query_size,  -- байт
+       current_setting('compute_query_id', true) AS compute_query_id,
+       current_setting('max_connections')::int AS max_connections,
+       coalesce((SELECT rolsuper FROM pg_roles WHERE rolname = current_user), false)
+         AS superuser,
+       pg_has_role(current_user, 'pg_read_all_stats', 'MEMBER') AS read_all_stats,
+       pg_has_role(current_user, 'pg_read_server_files', 'MEMBER') AS read_server_files,
+       ARRAY(SELECT extname::text FROM pg_extension ORDER BY 1) AS extensions,
+       to_regclass('pg_stat_statements_info') IS NOT NULL AS has_stat_statements_info
+"""
+
+_STAT_COLUMNS_SQL = """
+SELECT attname::text AS name
+FROM pg_attribute
+WHERE attrelid = to_regclass('pg_stat_statements') AND attnum > 0 AND NOT attisdropped
+"""
+
+# пары колонок времени в pg_stat_statements: PG13+ и более ранние
+_TIME_COLUMNS = (
+    ("total_exec_time", "mean_exec_time"),
+    ("total_time", "mean_time"),
+)
+
+_profiles: Dict[CapabilityKey, dict] = {}
+_lock = threading.Lock()
+
+
+def connection_key(conn) -> CapabilityKey:
+    info = conn.info
+    return (str(info.host), int(info.port), str(info.dbname), str(info.user))
+
+
+def load_capabilities(conn) -> dict:
+    """Профиль сервера: версия, расширения, колонки pg_stat_statements, права."""
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        cur.execute(_PROFILE_SQL)
+        profile = dict(cur.fetchone())
+        # само представление, а не запись в pg_extension: его видно через search_path
+        cur.execute(_STAT_COLUMNS_SQL)
+        columns = sorted(r["name"] for r in cur.fetchall())
+
+    profile["read_only"] = profile["in_recovery"] or profile["default_read_only"]
+    profile["stat_statements_columns"] = columns
+    profile["stat_time_columns"] = next(
+        (list(pair) for pair in _TIME_COLUMNS if set(pair) <= set(columns)), None
+    )
+    return profile
+
+
+def get_capabilities(conn, refresh: bool = False) -> dict:
+    """
+    Профиль цели соединения: строится при первом обращении и кэшируется
+    до переподключения (см. invalidate_capabilities в db_pool).
+    Открытую для чтения профиля транзакцию закрывает, если до вызова
+    соединение было свободно.
+    """
+    key = connection_key(conn)
+    if not refresh:
+        with _lock:
+            profile = _profiles.get(key)
+        if profile is not None:
+            return profile
+
+    was_idle = conn.info.transaction_status == TransactionStatus.IDLE
+    try:
+        profile = load_capabilities(conn)
+    finally:
+        if was_idle and not conn.autocommit:
+            conn.rollback()
+    with _lock:
+        _profiles[key] = profile
+    logger.info(
+        f"Профиль сервера {key[0]}:{key[1]}/{key[2]}: PG {profile['server_version']}, "
+        f"расширения: {', '.join(profile['extensions']) or 'нет'}"
+    )
+    return profile
+
+
+def has_extension(conn, name: str) -> bool:
+    return name in get_capabilities(conn)["extensions"]
+
+
+def invalidate_capabilities(key: Optional[CapabilityKey] = None) -> None:
+    """Сбрасывает профиль цели (или все) — при переподключении."""
+    with _lock:
+        if key is None:
+            _profiles.clear()
+        else:
+            _profiles.pop(key, None)
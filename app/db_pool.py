@@ -0,0 +1,154 @@
+# db_pool.py
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from psycopg.pq import TransactionStatus
+from psycopg_pool import ConnectionPool
+
+from app.capabilities import invalidate_capabilities
+from app.observability import TimedCursor
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры пула (на одну цель подключения) ---
+POOL_MIN_SIZE = 1  # сколько "тёплых" соединений держим всегда
+POOL_MAX_SIZE = 10  # потолок соединений к одной базе
+POOL_MAX_IDLE = 300.0  # сек: лишние простаивающие соединения закрываются
+POOL_MAX_LIFETIME = 3600.0  # сек: соединения периодически пересоздаются
+POOL_MAX_WAITING = 20  # сколько запросов может ждать свободное соединение
+POOL_TIMEOUT = 10.0  # сек: сколько запрос ждёт соединение из пула
+
+TargetKey = Tuple[str, int, str, str]
+PoolKey = Tuple[str, int, str, str, str]  # TargetKey + отпечаток пароля
+
+_pools: Dict[PoolKey, ConnectionPool] = {}
+_checked_out: Dict[int, ConnectionPool] = {}  # id(conn) -> пул, из которого он взят
+_lock = threading.Lock()
+
+
+def target_key(params: dict) -> TargetKey:
+    """Ключ цели подключения: host, port, dbname, user."""
+    return (
+        str(params["host"]),
+        int(params["port"]),
+        str(params["dbname"]),
+        str(params["user"]),
+    )
+
+
+def pool_key(params: dict) -> PoolKey:
+    """
+    Ключ пула: target_key и отпечаток пароля. Цель с теми же host, port,
+    dbname и user, но другим паролем не получит чужие уже
+    аутентифицированные соединения — ей откроется свой пул (или отказ).
+    """
+    password = str(params.get("password") or "").encode()
+    return target_key(params) + (hashlib.sha256(password).hexdigest(),)
+
+
+def get_pool(key: PoolKey) -> Optional[ConnectionPool]:
+    with _lock:
+        return _pools.get(key)
+
+
+def create_pool(params: dict, connect_timeout: int = 3) -> ConnectionPool:
+    """
+    Создаёт (или возвращает уже открытый) пул для цели.
+    Вызывается после того, как тестовое подключение прошло успешно.
+    """
+    key = pool_key(params)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+
+        host, port, dbname, user = key[:4]
+        pool = ConnectionPool(
+            kwargs={
+                "host": host,
+                "port": port,
+                "dbname": dbname,
+                "user": user,
+                "password": params.get("password"),
+                "connect_timeout": connect_timeout,
+                "cursor_factory": TimedCursor,  # запросы и время в /metrics
+            },
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            max_waiting=POOL_MAX_WAITING,
+            timeout=POOL_TIMEOUT,
+            check=ConnectionPool.check_connection,  # health-check при выдаче
+            name=f"{host}:{port}/{dbname}",
+            open=False,
+        )
+        # новый пул — новое подключение: профиль сервера мог устареть
+        invalidate_capabilities(key[:4])
+        # Не ждём заполнения min_size: первое соединение пул откроет в фоне
+        pool.open(wait=False)
+        _pools[key] = pool
+        logger.info(f"Создан пул соединений для {host}:{port}/{dbname}")
+        return pool
+
+
+def acquire(pool: ConnectionPool):
+    """Берёт соединение из пула (с проверкой живости) и запоминает его владельца."""
+    conn = pool.getconn()
+    with _lock:
+        _checked_out[id(conn)] = pool
+    return conn
+
+
+def release(conn) -> None:
+    """Возвращает соединение в его пул, предварительно откатив открытую транзакцию."""
+    if conn is None:
+        return
+    with _lock:
+        pool = _checked_out.pop(id(conn), None)
+    if pool is None:
+        # соединение не из пула (или уже возвращено) — просто закрываем
+        try:
+            conn.close()
+        except Exception:
+            pass
+        return
+    try:
+        # анализаторы читают без commit — закрываем их транзакцию сами,
+        # чтобы пул не ругался на "rolling back returned connection"
+        if conn.info.transaction_status in (
+            TransactionStatus.INTRANS,
+            TransactionStatus.INERROR,
+        ):
+            conn.rollback()
+    except Exception:
+        pass  # битое соединение пул отбракует сам
+    try:
+        pool.putconn(conn)
+    except Exception as e:
+        logger.warning(f"Не удалось вернуть соединение в пул {pool.name}: {e}")
+
+
+def close_pool(key: PoolKey) -> None:
+    with _lock:
+        pool = _pools.pop(key, None)
+    invalidate_capabilities(key[:4])
+    if pool is not None:
+        logger.info(f"Закрываю пул соединений {pool.name}")
+        pool.close()
+
+
+def close_all_pools() -> None:
+    with _lock:
+        keys = list(_pools)
+    for key in keys:
+        close_pool(key)
+
+
+def pool_stats() -> dict:
+    """Снимок состояния всех пулов (для отладки и мониторинга)."""
+    with _lock:
+        pools = dict(_pools)
+    return {pool.name: pool.get_stats() for pool in pools.values()}
@@ -0,0 +1,298 @@
+# executor.py
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.db_pool import release
+from app.observability import analyzer_span
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры исполнения анализаторов ---
+ANALYZER_WORKERS = 16  # потоков под синхронные анализаторы (psycopg)
+DEFAULT_CONCURRENCY = 4  # одновременных запусков одного анализатора
+DEFAULT_STATEMENT_TIMEOUT_MS = 30_000
+DISCONNECT_POLL_INTERVAL = 0.5  # сек: как часто проверяем, жив ли клиент
+
+# имя анализатора -> (лимит параллельных запусков, statement_timeout в мс)
+ANALYZER_LIMITS = {
+    "run_explain": (2, 60_000),  # EXPLAIN ANALYZE реально выполняет запрос
+    "analyze_stats": (4, 15_000),
+    "get_postgres_recommendations": (4, 15_000),
+    "analyze_n_plus_one": (2, 30_000),
+    "sample_n_plus_one": (1, 5_000),  # держит поток всё окно; таймаут — на один опрос
+    "sample_locks": (2, 5_000),  # так же: поток на всё окно, таймаут на один опрос
+    "analyze_indexes": (4, 15_000),
+    "whatif_indexes": (2, 60_000),  # без HypoPG индексы строятся по-настоящему
+    "analyze_batch": (2, 30_000),  # выборка всего pg_stat_statements
+    "analyze_index_health": (2, 30_000),  # обход всех индексов базы
+    "cache_token": (8, 5_000),  # проверка актуальности кэша результатов
+    # обход парка: одновременно опрашиваемых целей и таймаут на цель
+    "fleet_scan": (int(os.getenv("FLEET_CONCURRENCY", "8")), 120_000),
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=ANALYZER_WORKERS, thread_name_prefix="analyzer"
+)
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+class AnalysisCancelled(Exception):
+    """Клиент отключился — запрос к БД отменён."""
+
+
+def _limits(name: str):
+    return ANALYZER_LIMITS.get(
+        name, (DEFAULT_CONCURRENCY, DEFAULT_STATEMENT_TIMEOUT_MS)
+    )
+
+
+def _semaphore(name: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(name)
+    if sem is None:
+        sem = asyncio.Semaphore(_limits(name)[0])
+        _semaphores[name] = sem
+    return sem
+
+
+def set_statement_timeout(conn, timeout_ms: int) -> None:
+    """Серверный statement_timeout на сессию (без открытия транзакции)."""
+    conn.autocommit = True
+    try:
+        conn.execute(
+            "SELECT set_config('statement_timeout', %s, false)", (str(int(timeout_ms)),)
+        )
+    finally:
+        conn.autocommit = False
+
+
+def reset_statement_timeout(conn) -> None:
+    """
+    Возвращает statement_timeout к значению по умолчанию: соединение уходит
+    обратно в пул, и таймаут анализатора не должен достаться следующему
+    (живым метрикам, записи истории, сэмплерам).
+    """
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        conn.execute("RESET statement_timeout")
+    finally:
+        conn.autocommit = False
+
+
+def cancel_backend(conn, connect: Callable) -> None:
+    """
+    Отменяет текущий запрос на бэкенде соединения.
+    Сначала — cancel-запрос по протоколу (как pg_cancel_backend, но без прав),
+    если не вышло — pg_cancel_backend(pid) через отдельное соединение.
+    """
+    pid = conn.info.backend_pid
+    try:
+        conn.cancel()
+        logger.info(f"Запрос на бэкенде pid={pid} отменён")
+        return
+    except Exception as e:
+        logger.warning(f"cancel() для pid={pid} не удался: {e}")
+
+    other = None
+    try:
+        other = connect()
+        other.execute("SELECT pg_cancel_backend(%s)", (pid,))
+        other.rollback()
+        logger.info(f"pg_cancel_backend({pid}) выполнен")
+    except Exception as e:
+        logger.error(f"Не удалось отменить запрос на pid={pid}: {e}")
+    finally:
+        release(other)
+
+
+def _job(name: str, state: dict, connect: Callable, func: Callable, args, timeout_ms):
+    def job():
+        with analyzer_span(name):
+            # клиент мог уйти, пока задача ждала поток или соединение
+            if state["cancelled"]:
+                raise AnalysisCancelled(f"{name}: клиент отключился")
+            conn = connect()
+            with state["lock"]:
+                state["conn"] = conn
+            try:
+                set_statement_timeout(conn, timeout_ms)
+                if state["cancelled"]:
+                    raise AnalysisCancelled(f"{name}: клиент отключился")
+                return func(*args, conn)
+            finally:
+                with state["lock"]:
+                    state["conn"] = None
+                try:
+                    reset_statement_timeout(conn)
+                except Exception as e:
+                    # не сбросили — закрываем, пул отбракует соединение
+                    logger.warning(
+                        f"{name}: не удалось сбросить statement_timeout: {e}"
+                    )
+                    conn.close()
+                release(conn)
+
+    # контекст запроса (разбивка времени для Server-Timing) — в поток
+    return functools.partial(contextvars.copy_context().run, job)
+
+
+async def _submit(name: str, job: Callable) -> asyncio.Future:
+    """
+    Ждёт слот анализатора и запускает job в пуле потоков. Слот
+    освобождается, когда поток закончил работу, а не когда ушёл клиент:
+    лимит ограничивает реальную нагрузку на БД.
+    """
+    sem = _semaphore(name)
+    await sem.acquire()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(_executor, job)
+    except BaseException:
+        sem.release()
+        raise
+    future.add_done_callback(lambda _: sem.release())
+    return future
+
+
+def _abandon(future: asyncio.Future) -> None:
+    # ошибку отменённого анализатора уже некому показать
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+async def run_analyzer(
+    name: str,
+    connect: Callable,
+    func: Callable,
+    *args,
+    request=None,
+    timeout_ms: Optional[int] = None,
+    cancellable: bool = False,
+):
+    """
+    Запускает синхронный анализатор func(*args, conn) в пуле потоков:
+    - не больше N одновременных запусков на анализатор (очередь на семафоре)
+    - statement_timeout на время запроса
+    - если клиент (request) отключился — отменяем запрос на сервере
+    - cancellable: func получает cancelled() — долгие циклы опроса между
+      запросами к БД проверяют его сами (отмена бэкенда их не остановит)
+    """
+    if timeout_ms is None:
+        timeout_ms = _limits(name)[1]
+
+    # lock не даёт отменить запрос на соединении, уже вернувшемся в пул
+    state = {"conn": None, "lock": threading.Lock(), "cancelled": False}
+    if cancellable:
+        func = functools.partial(func, cancelled=lambda: state["cancelled"])
+    job = _job(name, state, connect, func, args, timeout_ms)
+
+    future = await _submit(name, job)
+    try:
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return future.result()
+            if request is not None and await request.is_disconnected():
+                logger.info(f"{name}: клиент отключился, отменяю запрос")
+                _cancel_running(state, connect)
+                _abandon(future)
+                raise AnalysisCancelled(f"{name}: клиент отключился")
+    except asyncio.CancelledError:
+        _cancel_running(state, connect)
+        _abandon(future)
+        raise
+
+
+async def stream_analyzer(
+    name: str,
+    connect: Callable,
+    func: Callable,
+    *args,
+    request=None,
+    timeout_ms: Optional[int] = None,
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Как run_analyzer, но отдаёт события по мере готовности: анализатор
+    получает progress(event, data) и зовёт его из потока, генератор
+    выдаёт пары (event, data), последней — ("result", результат).
+    Если клиент ушёл, запрос на сервере отменяется, а следующий вызов
+    progress бросает AnalysisCancelled — циклы на Python тоже встают.
+    """
+    if timeout_ms is None:
+        timeout_ms = _limits(name)[1]
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    state = {"conn": None, "lock": threading.Lock(), "cancelled": False}
+
+    def progress(event: str, data=None) -> None:
+        if state["cancelled"]:
+            raise AnalysisCancelled(f"{name}: клиент отключился")
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    job = _job(
+        name,
+        state,
+        connect,
+        functools.partial(func, progress=progress),
+        args,
+        timeout_ms,
+    )
+
+    future = await _submit(name, job)
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait(
+                {getter, future},
+                timeout=DISCONNECT_POLL_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            if future in done:
+                # события ставятся в очередь раньше, чем завершается future
+                while not events.empty():
+                    yield events.get_nowait()
+                yield "result", future.result()
+                return
+            if request is not None and await request.is_disconnected():
+                raise AnalysisCancelled(f"{name}: клиент отключился")
+    except (asyncio.CancelledError, GeneratorExit, AnalysisCancelled):
+        if getter is not None:
+            getter.cancel()
+        if not future.done():
+            logger.info(f"{name}: клиент отключился, отменяю запрос")
+            _cancel_running(state, connect)
+            _abandon(future)
+        raise
+
+
+def _cancel_running(state: dict, connect: Callable) -> None:
+    # флаг останавливает задачу, которая ещё ждёт поток или соединение,
+    # и циклы анализаторов, проверяющие progress / cancelled
+    state["cancelled"] = True
+
+    # отмена делает сетевой запрос — не блокируем event loop и не ждём
+    # свободного места в занятом пуле потоков анализаторов
+    def cancel_job():
+        # под блокировкой только берём соединение: cancel_backend может
+        # открывать новое соединение с повторами, а задача тем временем
+        # должна спокойно завершиться и вернуть своё в пул
+        with state["lock"]:
+            conn = state["conn"]
+        if conn is not None:
+            cancel_backend(conn, connect)
+
+    threading.Thread(target=cancel_job, name="analyzer-cancel", daemon=True).start()
+
+
+def shutdown_executor() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -1,4 +1,24 @@
+import re
+
 from psycopg import rows
+from psycopg.pq import TransactionStatus
+
+from app.plan_analysis import analyze_plan, flatten_plan, print_plan_analysis
+from app.sql_lexer import PARAM, PUNCT, tokenize
+
+# --- Режимы EXPLAIN ---
+MODE_PLAN = "plan"  # только план, запрос не выполняется
+MODE_GENERIC = "generic"  # общий план для текста с $1, $2 ...
+MODE_ANALYZE = "analyze"  # реальное выполнение в транзакции с откатом
+EXPLAIN_MODES = (MODE_PLAN, MODE_GENERIC, MODE_ANALYZE)
+
+ANALYZE_TIMEOUT_MS = 30_000  # statement_timeout для EXPLAIN ANALYZE
+ANALYZE_MAX_ESTIMATED_ROWS = 1_000_000  # выше — ANALYZE не запускаем
+GENERIC_STATEMENT = "pg_analyzer_generic"
+
+_POSITIONAL_PARAM = re.compile(r"\$(\d+)")
+
+
 def print_plan_node(node, indent=0):
     prefix = "  " * indent
     print(f"{prefix}Node Type: {node.get('Node Type')}")
@@ -65,19 +85,171 @@ def print_plan_node(node, indent=0):
         print(f"Total Buffers: {total_buffers}")
 
 
-def run_explain(query, conn, label="EXPLAIN"):
-    print(f"\n=== {label} ===")
+def param_count(query: str) -> int:
+    """Число позиционных параметров ($1, $2, ...) — как в текстах pg_stat_statements."""
+    numbers = [
+        int(m.group(1))
+        for tok in tokenize(query)
+        if tok.kind == PARAM
+        for m in [_POSITIONAL_PARAM.fullmatch(tok.value)]
+        if m
+    ]
+    return max(numbers, default=0)
+
+
+def check_single_statement(query: str) -> None:
+    """
+    Текст без параметров psycopg отправляет простым протоколом, а он
+    выполняет все команды через ";": в "SELECT 1; COMMIT; DELETE ..."
+    DELETE прошёл бы мимо отката. Такой текст отклоняем до любого
+    EXPLAIN/PREPARE; ";" в конце запроса допустима.
+    """
+    tokens = tokenize(query)
+    for i, tok in enumerate(tokens):
+        if tok.kind == PUNCT and tok.value == ";":
+            if any(t.value != ";" for t in tokens[i + 1 :]):
+                raise ValueError(
+                    "Допускается только один SQL-оператор: после ';' идёт ещё команда"
+                )
+            return
+
+
+def _execute_single(cur, statement):
+    """
+    Текст с запросом пользователя — только расширенным протоколом: сервер
+    сам отклоняет в нём несколько команд, даже если лексер ошибся.
+    """
+    cur.execute(statement, prepare=False, binary=True)
+
+
+def _explain(cur, options, query):
+    _execute_single(cur, f"EXPLAIN ({options}, FORMAT JSON) {query}")
+    return cur.fetchone()["QUERY PLAN"][0]
+
+
+def _explain_generic(conn, cur, query, n_params):
+    """
+    Общий (generic) план без значений параметров: PREPARE + plan_cache_mode =
+    force_generic_plan + EXPLAIN EXECUTE с NULL (приводятся к выведенным
+    типам параметров). Сам запрос при этом не выполняется.
+    EXPLAIN (GENERIC_PLAN) из PG16 не подходит: в расширенном протоколе $n
+    текста стали бы параметрами Bind, и планировщик подставил бы их значения.
+    """
+    _execute_single(cur, f"PREPARE {GENERIC_STATEMENT} AS {query}")
+    try:
+        # SET LOCAL: настройка живёт до конца транзакции вызывающего
+        cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+        nulls = ", ".join(["NULL"] * n_params)
+        args = f"({nulls})" if n_params else ""
+        cur.execute(f"EXPLAIN (FORMAT JSON) EXECUTE {GENERIC_STATEMENT}{args}")
+        return cur.fetchone()["QUERY PLAN"][0]
+    finally:
+        # PREPARE не откатывается вместе с транзакцией — удаляем явно
+        if conn.info.transaction_status == TransactionStatus.INERROR:
+            conn.rollback()
+        cur.execute(f"DEALLOCATE {GENERIC_STATEMENT}")
+
+
+def explain_estimate(conn, query):
+    """
+    План без выполнения запроса: обычный EXPLAIN или generic-план для
+    текста с $n. Транзакцию не завершает — это решает вызывающий.
+    """
+    check_single_statement(query)
+    n_params = param_count(query)
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        if n_params:
+            return _explain_generic(conn, cur, query, n_params)
+        return _explain(cur, "COSTS", query)
+
+
+def _explain_analyze(conn, cur, query, notes, progress=None):
+    """
+    EXPLAIN ANALYZE внутри транзакции, которая всегда откатывается:
+    UPDATE/DELETE/INSERT реально выполняются, но ничего не меняют.
+    Сначала смотрим оценку строк — слишком тяжёлый запрос не запускаем.
+    """
+    cur.execute(
+        "SELECT set_config('statement_timeout', %s, true)", (str(ANALYZE_TIMEOUT_MS),)
+    )
+    estimate = _explain(cur, "COSTS", query)
+    max_rows = max(
+        float(node.get("Plan Rows", 0) or 0)
+        for node, _, _, _ in flatten_plan(estimate["Plan"])
+    )
+    if max_rows > ANALYZE_MAX_ESTIMATED_ROWS:
+        notes.append(
+            f"⚠️ Планировщик ожидает до {int(max_rows)} строк "
+            f"(порог {ANALYZE_MAX_ESTIMATED_ROWS}) — ANALYZE не выполнялся, показан план."
+        )
+        return MODE_PLAN, estimate
+    if progress:
+        # оценочный план готов сразу — показываем его, пока идёт ANALYZE
+        estimated = analyze_plan(estimate)
+        progress(
+            "estimate",
+            {
+                "summary": estimated["summary"],
+                "hottest_nodes": estimated["hottest_nodes"],
+            },
+        )
+        progress("progress", {"stage": "analyze"})
+    try:
+        return MODE_ANALYZE, _explain(cur, "ANALYZE, BUFFERS", query)
+    finally:
+        conn.rollback()
+
+
+def run_explain(query, conn, label="EXPLAIN", mode=MODE_ANALYZE, progress=None):
+    """
+    progress(event, data) — для потоковой выдачи: этапы, оценочный план
+    до ANALYZE и самые дорогие узлы по мере готовности.
+    """
+    print(f"\n=== {label} ({mode}) ===")
+    if mode not in EXPLAIN_MODES:
+        return f"❌ Неизвестный режим EXPLAIN: {mode}"
+    try:
+        check_single_statement(query)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return f"❌ {e}"
+
+    notes = []
+    n_params = param_count(query)
+    if n_params and mode != MODE_GENERIC:
+        # $1 без значений нельзя ни выполнить, ни спланировать обычным EXPLAIN
+        notes.append(
+            f"ℹ️ В запросе {n_params} параметр(ов) $n — построен generic-план."
+        )
+        mode = MODE_GENERIC
+
+    if progress:
+        progress("progress", {"stage": "plan", "mode": mode})
     cur = conn.cursor(row_factory=rows.dict_row)
     try:
-        # Проверяем корректность запроса через EXPLAIN
-        cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}")
+        if mode == MODE_ANALYZE:
+            mode, explain = _explain_analyze(conn, cur, query, notes, progress)
+        elif mode == MODE_GENERIC:
+            explain = _explain_generic(conn, cur, query, n_params)
+        else:
+            explain = _explain(cur, "COSTS", query)
     except Exception as e:
         print(f"❌ Ошибка в SQL запросе: {e}")
         conn.rollback()
         return f"❌ Ошибка в SQL запросе: {e}"
+    finally:
+        cur.close()
 
-    plan_raw = cur.fetchone()["QUERY PLAN"]
-    top_plan = plan_raw[0]["Plan"]
+    conn.rollback()
+    top_plan = explain["Plan"]
     print_plan_node(top_plan)
-    cur.close()
-    return top_plan
+    for note in notes:
+        print(note)
+
+    # метрики по всему дереву, а не только по корню
+    analysis = analyze_plan(explain)
+    print_plan_analysis(analysis)
+    if progress:
+        for node in analysis["hottest_nodes"]:
+            progress("node", node)
+    return {"mode": mode, "notes": notes, "plan": top_plan, "analysis": analysis}
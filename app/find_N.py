@@ -6,11 +6,16 @@ from decimal import Decimal
 
 from psycopg import rows
 
+from app.capabilities import get_capabilities
+
 
 MIN_CALLS = 100  # минимум вызовов
 MAX_CANDIDATES = 50
 MAX_ROWS_PER_CALL = 2.0
 FAST_MEAN_MS = 30.0
+PROGRESS_EVERY = 100  # строк pg_stat_statements между событиями прогресса
+# настройки, от которых зависит, что попадает в pg_stat_statements
+STATEMENTS_SETTINGS = ("pg_stat_statements.track", "pg_stat_statements.max")
 
 # --- regex для поиска "точечных" выборок ---
 CANDIDATE_PATTERNS = [
@@ -33,20 +38,10 @@ def is_n1_like(query_text: str) -> Tuple[bool, List[str]]:
 
 
 def detect_time_columns(cur) -> Tuple[str, str]:
-    cur.execute(
-        """
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_name = 'pg_stat_statements'
-          AND column_name IN ('total_exec_time','mean_exec_time','total_time','mean_time')
-        """
-    )
-    cols = {row["column_name"] for row in cur.fetchall()}
-
-    if "total_exec_time" in cols and "mean_exec_time" in cols:
-        return "total_exec_time", "mean_exec_time"
-    if "total_time" in cols and "mean_time" in cols:
-        return "total_time", "mean_time"
+    # колонки берём из профиля сервера: он строится один раз на цель
+    columns = get_capabilities(cur.connection)["stat_time_columns"]
+    if columns:
+        return columns[0], columns[1]
 
     raise RuntimeError("Не удалось определить колонки времени в pg_stat_statements")
 
@@ -100,13 +95,31 @@ def make_suggestion(query_text: str, rows_per_call: float) -> str:
     return "Высокое число вызовов — проверьте на предмет N+1 или горячей точки в коде."
 
 
-def analyze_n_plus_one(conn):
-    """Основная функция для запуска через меню (как run_explain, analyze_stats)."""
+def select_window_rows(stat_rows: List[dict]) -> List[dict]:
+    """Тот же отбор, что в fetch_stat_rows, но для строк сэмплера за окно."""
+    picked = [r for r in stat_rows if int(r.get("calls") or 0) >= MIN_CALLS]
+    picked.sort(key=lambda r: -int(r.get("calls") or 0))
+    return picked[: MAX_CANDIDATES * 5]
+
+
+def analyze_n_plus_one(conn, stat_rows=None, progress=None):
+    """
+    Основная функция для запуска через меню (как run_explain, analyze_stats).
+    stat_rows — строки за окно от stats_sampler; по умолчанию накопленные счётчики.
+    progress(event, data) — для потоковой выдачи: кандидаты по мере нахождения.
+    """
     logging.info("Finding N+1 candidates...")
 
-    rows = fetch_stat_rows(conn)
+    if progress:
+        progress("progress", {"stage": "fetch"})
+    if stat_rows is None:
+        rows = fetch_stat_rows(conn)
+    else:
+        rows = select_window_rows(stat_rows)
     results: List[dict] = []
-    for r in rows:
+    for i, r in enumerate(rows, 1):
+        if progress and i % PROGRESS_EVERY == 1:
+            progress("progress", {"stage": "scan", "done": i - 1, "total": len(rows)})
         qtext = (r.get("query") or "").strip()
         calls = int(r.get("calls") or 0)
         total_rows = _to_float(r.get("rows") or 0.0)
@@ -137,6 +150,8 @@ def analyze_n_plus_one(conn):
                     "suggestion": make_suggestion(qtext, rows_per_call),
                 }
             )
+            if progress:
+                progress("candidate", results[-1])
 
     results = sorted(results, key=lambda x: (-x["calls"], x["rows_per_call"]))
 
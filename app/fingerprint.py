@@ -0,0 +1,61 @@
+# fingerprint.py
+import hashlib
+
+from app.sql_lexer import KEYWORD, NUMBER, PARAM, PUNCT, STRING, string_value, tokenize
+
+# литералы и параметры запроса заменяются одним плейсхолдером
+_LITERAL_KINDS = (STRING, NUMBER, PARAM)
+PLACEHOLDER = "?"
+PARAM_PLACEHOLDER = "$?"  # keep_params: параметр не смешивается с литералом
+# шаблон LIKE/ILIKE с ведущим % или _: индекс по нему не работает, и анализ
+# такого запроса отличается от запроса с шаблоном 'x%'
+LEADING_WILDCARD_PLACEHOLDER = "'%?'"
+_PATTERN_KEYWORDS = frozenset(("like", "ilike"))
+_WILDCARDS = ("%", "_")
+
+
+def normalize_query(sql: str, keep_params: bool = False) -> str:
+    """
+    Нормализованный текст запроса:
+    - комментарии и лишние пробелы убраны, ключевые слова в нижнем регистре
+    - строки, числа и параметры ($1, %s, ...) заменены на "?"
+      (с keep_params параметры — на "$?": для них строится generic-план,
+      и анализ может отличаться от запроса с литералом)
+    - у шаблона LIKE/ILIKE сохраняется форма: ведущий % или _ -> "'%?'"
+    - списки литералов IN (1, 2, 3) свёрнуты в IN (?), чтобы длина списка
+      не порождала отдельный отпечаток
+    Запросы, отличающиеся только значениями, дают одинаковый текст.
+    """
+    out = []
+    prev = None
+    for tok in tokenize(sql):
+        if tok.kind in _LITERAL_KINDS:
+            if keep_params and tok.kind == PARAM:
+                placeholder = PARAM_PLACEHOLDER
+            elif (
+                tok.kind == STRING
+                and prev is not None
+                and prev.kind == KEYWORD
+                and prev.value in _PATTERN_KEYWORDS
+                and string_value(tok).startswith(_WILDCARDS)
+            ):
+                placeholder = LEADING_WILDCARD_PLACEHOLDER
+            else:
+                placeholder = PLACEHOLDER
+            # "?, ?" в списке -> один "?"
+            if len(out) >= 2 and out[-1] == "," and out[-2] == placeholder:
+                out.pop()
+                continue
+            out.append(placeholder)
+        elif tok.kind == PUNCT and tok.value == ";":
+            continue
+        else:
+            out.append(tok.value)
+        prev = tok
+    return " ".join(out)
+
+
+def fingerprint(sql: str, keep_params: bool = False) -> str:
+    """Короткий отпечаток нормализованного запроса (ключ для кэшей)."""
+    normalized = normalize_query(sql, keep_params)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,189 @@
+# fleet.py
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.DB_tuning import get_postgres_recommendations
+from app.capabilities import get_capabilities
+from app.executor import ANALYZER_LIMITS, run_analyzer
+from app.find_N import analyze_n_plus_one
+from app.index_health import analyze_index_health
+from app.stats_analysis import analyze_stats
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры обхода ---
+# целей одновременно и таймаут на цель — из лимитов executor
+FLEET_CONCURRENCY, _timeout_ms = ANALYZER_LIMITS["fleet_scan"]
+FLEET_TARGET_TIMEOUT = _timeout_ms / 1000  # сек на все анализаторы одной цели
+# соединение к недоступной цели: 2 попытки с паузой 1 с, connect_timeout 3 с
+FLEET_CONNECT_ARGS = (2, 1, 3)
+
+_slots: Optional[asyncio.Semaphore] = None  # общий для всех обходов лимит целей
+
+
+def _target_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(FLEET_CONCURRENCY)
+    return _slots
+
+
+def _index_findings(result: dict) -> int:
+    return sum(len(result[k]) for k in ("unused", "duplicates", "redundant", "bloated"))
+
+
+# имя в запросе -> (анализатор func(conn), число находок по результату)
+FLEET_ANALYZERS: Dict[str, tuple] = {
+    "stats": (analyze_stats, lambda r: len(r["recommendations"])),
+    "tuning": (get_postgres_recommendations, lambda r: len(r["recommendations"])),
+    "n_plus_one": (analyze_n_plus_one, lambda r: len(r) if isinstance(r, list) else 0),
+    "index_health": (analyze_index_health, _index_findings),
+}
+
+SORT_KEYS = ("findings", "elapsed", "target", *FLEET_ANALYZERS)
+
+
+async def _run_target(
+    name: str,
+    connect: Callable,
+    analyzers: List[str],
+    timeout_s: float,
+    details: bool,
+) -> Dict[str, dict]:
+    """
+    Анализаторы одной цели по очереди (к цели — одно соединение за раз).
+    Таймаут — на всю цель: недоделанные анализаторы помечаются timeout,
+    запрос на сервере отменяется.
+    """
+    deadline = time.monotonic() + timeout_s
+    results = {a: {"status": "timeout"} for a in analyzers}
+
+    async def run_all():
+        for analyzer in analyzers:
+            func, findings = FLEET_ANALYZERS[analyzer]
+            began = time.monotonic()
+            remaining_ms = max(int((deadline - began) * 1000), 1)
+            try:
+                result = await run_analyzer(
+                    "fleet_scan", connect, func, timeout_ms=remaining_ms
+                )
+                entry = {"status": "ok", "findings": findings(result)}
+                if details:
+                    entry["result"] = result
+            except Exception as e:
+                entry = {"status": "error", "error": str(e)}
+            entry["elapsed_s"] = round(time.monotonic() - began, 3)
+            results[analyzer] = entry
+
+    try:
+        await asyncio.wait_for(run_all(), timeout=timeout_s)
+    except asyncio.TimeoutError:
+        logger.warning(f"Обход {name}: таймаут ({timeout_s:.1f} с)")
+    return results
+
+
+async def scan_target(
+    name: str,
+    connect: Callable,
+    analyzers: List[str],
+    timeout_s: float,
+    details: bool = False,
+) -> dict:
+    """
+    Отчёт по одной цели. Таймаут отсчитывается с момента, когда цель
+    получила слот, а не с начала обхода.
+    """
+    async with _target_slots():
+        started = time.monotonic()
+        try:
+            # профиль сервера: заодно проверка доступности — недоступная цель
+            # не ждёт таймаут подключения на каждом анализаторе
+            caps = await asyncio.wait_for(
+                run_analyzer("fleet_scan", connect, get_capabilities),
+                timeout=timeout_s,
+            )
+        except Exception as e:
+            error = str(e) or "таймаут подключения"
+            return {
+                "target": name,
+                "status": "unreachable",
+                "server_version": None,
+                "elapsed_s": round(time.monotonic() - started, 3),
+                "findings": 0,
+                "analyzers": {a: {"status": "skipped"} for a in analyzers},
+                "error": error,
+            }
+        remaining = timeout_s - (time.monotonic() - started)
+        results = await _run_target(name, connect, analyzers, remaining, details)
+
+    statuses = {r["status"] for r in results.values()}
+    if statuses == {"ok"}:
+        status = "ok"
+    elif "timeout" in statuses:
+        status = "timeout"
+    elif "ok" in statuses:
+        status = "partial"
+    else:
+        status = "error"
+    return {
+        "target": name,
+        "status": status,
+        "server_version": caps["server_version"],
+        "elapsed_s": round(time.monotonic() - started, 3),
+        "findings": sum(r.get("findings", 0) for r in results.values()),
+        "analyzers": results,
+    }
+
+
+def _sort_report(report: List[dict], sort_by: str) -> List[dict]:
+    if sort_by == "target":
+        return sorted(report, key=lambda r: r["target"])
+    if sort_by == "elapsed":
+        return sorted(report, key=lambda r: -r["elapsed_s"])
+    if sort_by in FLEET_ANALYZERS:
+        return sorted(
+            report,
+            key=lambda r: -r["analyzers"].get(sort_by, {}).get("findings", -1),
+        )
+    return sorted(report, key=lambda r: -r["findings"])
+
+
+async def scan_fleet(
+    targets: Dict[str, Callable],
+    analyzers: List[str],
+    timeout_s: float = FLEET_TARGET_TIMEOUT,
+    sort_by: str = "findings",
+    details: bool = False,
+) -> dict:
+    """
+    Обходит цели параллельно (не больше FLEET_CONCURRENCY одновременно):
+    время обхода ~ время самой медленной цели, а не сумма по всем.
+    targets — имя цели -> connect() для неё.
+    """
+    unknown = [a for a in analyzers if a not in FLEET_ANALYZERS]
+    if unknown:
+        raise ValueError(
+            f"Неизвестные анализаторы: {', '.join(unknown)}; "
+            f"доступны: {', '.join(FLEET_ANALYZERS)}"
+        )
+    if sort_by not in SORT_KEYS:
+        raise ValueError(f"sort_by: одно из {', '.join(SORT_KEYS)}")
+
+    started = time.monotonic()
+    report = await asyncio.gather(
+        *(
+            scan_target(name, connect, analyzers, timeout_s, details)
+            for name, connect in targets.items()
+        )
+    )
+    return {
+        "targets": len(report),
+        "analyzers": analyzers,
+        "concurrency": FLEET_CONCURRENCY,
+        "elapsed_s": round(time.monotonic() - started, 3),
+        # сумма по целям: столько занял бы последовательный обход
+        "sequential_s": round(sum(r["elapsed_s"] for r in report), 3),
+        "report": _sort_report(report, sort_by),
+    }
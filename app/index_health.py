@@ -0,0 +1,441 @@
+# index_health.py
+import math
+from typing import Dict, List, Optional
+
+from psycopg import rows
+
+from app.index_recommend import pretty_size
+
+# --- Пороги ---
+BLOAT_MIN_RATIO = 0.3  # доля "лишнего" места, при которой советуем REINDEX
+BLOAT_MIN_BYTES = 10 * 1024 * 1024  # мелкие индексы не трогаем
+BTREE_DEFAULT_FILLFACTOR = 90
+BLOCK_OVERHEAD = 24 + 16  # заголовок страницы + special area btree
+TUPLE_OVERHEAD = 8 + 4  # IndexTupleData + line pointer
+
+_INDEXES_SQL = """
+SELECT s.schemaname, s.relname AS table_name, s.indexrelname AS index_name,
+       s.relid, s.indexrelid, s.idx_scan,
+       format('%I.%I', s.schemaname, s.indexrelname) AS qualified_name,
+       pg_relation_size(s.indexrelid) AS index_bytes,
+       i.indisunique, i.indisprimary, i.indisexclusion, i.indisvalid,
+       i.indpred IS NOT NULL AS partial,
+       i.indexprs IS NOT NULL AS has_expressions,
+       i.indkey::int2[] AS indkey, i.indnkeyatts, i.indnatts,
+       i.indclass::oid[] AS indclass, i.indcollation::oid[] AS indcollation,
+       pg_get_expr(i.indpred, i.indrelid) AS predicate,
+       pg_get_expr(i.indexprs, i.indrelid) AS expressions,
+       am.amname, ic.reltuples AS index_tuples, ic.reloptions,
+       current_setting('block_size')::int AS block_size,
+       EXISTS (
+         SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid
+       ) AS backs_constraint,
+       parent_idx.inhparent AS parent_index,
+       pc.oid::regclass::text AS parent_index_name,
+       ri.oid AS root_indexrelid,
+       CASE WHEN ri.oid IS NOT NULL
+            THEN format('%I.%I', rn.nspname, ri.relname) END AS root_index,
+       CASE WHEN ri.oid IS NOT NULL
+            THEN format('%I.%I', rn.nspname, rt.relname) END AS root_index_table,
+       root.relname AS root_table,
+       coalesce(t.n_tup_ins, 0) AS n_tup_ins,
+       coalesce(t.n_tup_upd, 0) - coalesce(t.n_tup_hot_upd, 0) AS n_tup_non_hot_upd,
+       ARRAY(
+         SELECT a.attname
+         FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+         LEFT JOIN pg_attribute a
+           ON a.attrelid = i.indrelid AND a.attnum = k.attnum AND k.attnum > 0
+         ORDER BY k.ord
+       ) AS columns
+FROM pg_stat_user_indexes s
+JOIN pg_index i ON i.indexrelid = s.indexrelid
+JOIN pg_class ic ON ic.oid = s.indexrelid
+JOIN pg_am am ON am.oid = ic.relam
+LEFT JOIN pg_stat_user_tables t ON t.relid = s.relid
+-- индекс секции, присоединённый к индексу секционированной таблицы
+LEFT JOIN pg_inherits parent_idx ON parent_idx.inhrelid = s.indexrelid
+LEFT JOIN pg_class pc ON pc.oid = parent_idx.inhparent
+-- корень дерева индексов секций: его удаляют, если индекс не нужен ни одной секции
+LEFT JOIN pg_class ri ON ri.oid = pg_partition_root(s.indexrelid)
+                      AND ri.oid <> s.indexrelid
+LEFT JOIN pg_namespace rn ON rn.oid = ri.relnamespace
+LEFT JOIN pg_index rix ON rix.indexrelid = ri.oid
+LEFT JOIN pg_class rt ON rt.oid = rix.indrelid
+-- корневая секционированная таблица (для сводки по секциям)
+LEFT JOIN pg_class root ON root.oid = pg_partition_root(s.relid)
+                        AND root.oid <> s.relid
+ORDER BY s.schemaname, s.relname, s.indexrelname
+"""
+
+_WIDTHS_SQL = """
+SELECT schemaname, tablename, attname, avg_width
+FROM pg_stats
+WHERE (schemaname, tablename) IN (SELECT schemaname, relname FROM pg_stat_user_tables)
+"""
+
+_STATS_RESET_SQL = """
+SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()
+"""
+
+
+def _is_protected(ix: dict) -> bool:
+    """Индексы, которые нельзя просто удалить: PK, UNIQUE, EXCLUDE, под ограничением."""
+    return (
+        ix["indisunique"]
+        or ix["indisprimary"]
+        or ix["indisexclusion"]
+        or ix["backs_constraint"]
+    )
+
+
+def _signature(ix: dict) -> tuple:
+    """Полное определение индекса без имени: совпадает — значит дубликат."""
+    return (
+        ix["relid"],
+        ix["amname"],
+        tuple(ix["indkey"]),
+        tuple(ix["indclass"]),
+        tuple(ix["indcollation"]),
+        ix["expressions"],
+        ix["predicate"],
+    )
+
+
+def _key_columns(ix: dict) -> list:
+    return ix["columns"][: ix["indnkeyatts"]]
+
+
+def _is_prefix_redundant(small: dict, big: dict) -> bool:
+    """
+    small покрывается big: оба btree на одной таблице, без выражений и
+    условий, ключ small — строгий префикс ключа big с теми же классами
+    операторов, а INCLUDE-колонки small есть в big.
+    """
+    if small["relid"] != big["relid"] or small["indexrelid"] == big["indexrelid"]:
+        return False
+    if small["amname"] != "btree" or big["amname"] != "btree":
+        return False
+    if small["partial"] or big["partial"]:
+        return False
+    if small["has_expressions"] or big["has_expressions"]:
+        return False
+    n = small["indnkeyatts"]
+    if n >= big["indnkeyatts"]:
+        return False
+    if small["indkey"][:n] != big["indkey"][:n]:
+        return False
+    if small["indclass"][:n] != big["indclass"][:n]:
+        return False
+    return set(small["indkey"][n:]) <= set(big["indkey"])
+
+
+def _fillfactor(ix: dict) -> int:
+    for opt in ix["reloptions"] or []:
+        if opt.startswith("fillfactor="):
+            return int(opt.split("=", 1)[1])
+    return BTREE_DEFAULT_FILLFACTOR
+
+
+def estimate_bloat(ix: dict, widths: Dict[tuple, int]) -> Optional[dict]:
+    """
+    Грубая оценка раздутия btree: идеальный размер = число записей *
+    (заголовок + выровненная ширина ключей) / полезное место страницы с
+    учётом fillfactor. Для индексов по выражениям и без pg_stats — None.
+    """
+    if ix["amname"] != "btree" or ix["has_expressions"]:
+        return None
+    tuples = float(ix["index_tuples"] or 0)
+    if tuples <= 0:
+        return None
+    width = 0
+    for col in ix["columns"]:
+        w = widths.get((ix["schemaname"], ix["table_name"], col))
+        if w is None:
+            return None
+        width += w
+    tuple_size = TUPLE_OVERHEAD + 8 * math.ceil(width / 8)
+    usable = (ix["block_size"] - BLOCK_OVERHEAD) * _fillfactor(ix) / 100
+    ideal_pages = math.ceil(tuples * tuple_size / usable) + 1  # + метастраница
+    ideal = ideal_pages * ix["block_size"]
+    actual = ix["index_bytes"]
+    extra = max(actual - ideal, 0)
+    return {
+        "ideal_bytes": ideal,
+        "bloat_bytes": extra,
+        "bloat_ratio": round(extra / actual, 3) if actual else 0.0,
+    }
+
+
+def _write_ops(ix: dict) -> int:
+    # запись в индекс — на каждый INSERT и не-HOT UPDATE таблицы
+    return int(ix["n_tup_ins"]) + int(ix["n_tup_non_hot_upd"])
+
+
+def _entry(ix: dict, reason: str, **extra) -> dict:
+    return {
+        "index": ix["qualified_name"],
+        "table": f"{ix['schemaname']}.{ix['table_name']}",
+        "columns": ix["columns"],
+        "idx_scan": ix["idx_scan"],
+        "size_bytes": ix["index_bytes"],
+        "size": pretty_size(ix["index_bytes"]),
+        "write_ops": _write_ops(ix),
+        "reason": reason,
+        **extra,
+    }
+
+
+def _partitioned_entry(parts: List[dict]) -> dict:
+    """Индекс секционированной таблицы целиком: сумма по индексам всех секций."""
+    size = sum(int(p["index_bytes"]) for p in parts)
+    first = parts[0]
+    return {
+        "index": first["root_index"],
+        "table": first["root_index_table"],
+        "columns": first["columns"],
+        "idx_scan": 0,
+        "size_bytes": size,
+        "size": pretty_size(size),
+        "write_ops": sum(_write_ops(p) for p in parts),
+        "reason": "unused",
+        "partitions": sorted({f"{p['schemaname']}.{p['table_name']}" for p in parts}),
+    }
+
+
+def collect_index_health(indexes: List[dict], widths: Dict[tuple, int]) -> dict:
+    """Классифицирует индексы: неиспользуемые, дубликаты, избыточные, раздутые."""
+    drop: Dict[int, dict] = {}  # indexrelid -> запись о кандидате на удаление
+    keepers = set()  # оставляемые вместо дубликатов и избыточных
+    bloated = []
+
+    # --- дубликаты: одинаковое определение, оставляем "главный" ---
+    by_signature: Dict[tuple, List[dict]] = {}
+    for ix in indexes:
+        by_signature.setdefault(_signature(ix), []).append(ix)
+    for group in by_signature.values():
+        if len(group) < 2:
+            continue
+        # оставляем защищённый / присоединённый к родителю / самый используемый
+        group.sort(
+            key=lambda ix: (
+                not _is_protected(ix),
+                ix["parent_index"] is None,
+                -int(ix["idx_scan"] or 0),
+                ix["indexrelid"],
+            )
+        )
+        keep = group[0]
+        keepers.add(keep["indexrelid"])
+        for ix in group[1:]:
+            if _is_protected(ix) or ix["parent_index"] is not None:
+                continue
+            drop[ix["indexrelid"]] = _entry(
+                ix, "duplicate", duplicate_of=keep["qualified_name"]
+            )
+
+    # --- избыточные: ключ — префикс другого индекса ---
+    by_table: Dict[int, List[dict]] = {}
+    for ix in indexes:
+        by_table.setdefault(ix["relid"], []).append(ix)
+    for table_indexes in by_table.values():
+        for small in table_indexes:
+            if small["indexrelid"] in drop or _is_protected(small):
+                continue
+            if small["parent_index"] is not None:
+                continue
+            for big in table_indexes:
+                if big["indexrelid"] in drop:
+                    continue
+                if _is_prefix_redundant(small, big):
+                    drop[small["indexrelid"]] = _entry(
+                        small, "redundant", covered_by=big["qualified_name"]
+                    )
+                    keepers.add(big["indexrelid"])
+                    break
+
+    # --- неиспользуемые ---
+    # оставляемый вместо дубликата/префикса не предлагаем: иначе отчёт
+    # советует удалить обе копии сразу
+    for ix in indexes:
+        if ix["indexrelid"] in drop or ix["indexrelid"] in keepers:
+            continue
+        if _is_protected(ix) or not ix["indisvalid"]:
+            continue
+        if int(ix["idx_scan"] or 0) == 0 and ix["parent_index"] is None:
+            drop[ix["indexrelid"]] = _entry(ix, "unused")
+
+    # индекс секции отдельно не удалить — только родительский целиком, и
+    # только если он не использовался ни на одной секции
+    by_root: Dict[int, List[dict]] = {}
+    for ix in indexes:
+        if ix["root_indexrelid"] is not None:
+            by_root.setdefault(ix["root_indexrelid"], []).append(ix)
+    for root, parts in by_root.items():
+        if any(
+            int(p["idx_scan"] or 0)
+            or _is_protected(p)
+            or not p["indisvalid"]
+            or p["indexrelid"] in keepers
+            for p in parts
+        ):
+            continue
+        drop[root] = _partitioned_entry(parts)
+
+    # --- раздутые (только те, что остаются) ---
+    for ix in indexes:
+        if ix["indexrelid"] in drop:
+            continue
+        bloat = estimate_bloat(ix, widths)
+        if (
+            bloat
+            and bloat["bloat_ratio"] >= BLOAT_MIN_RATIO
+            and bloat["bloat_bytes"] >= BLOAT_MIN_BYTES
+        ):
+            bloated.append(
+                _entry(
+                    ix,
+                    "bloated",
+                    bloat_bytes=bloat["bloat_bytes"],
+                    bloat=pretty_size(bloat["bloat_bytes"]),
+                    bloat_ratio=bloat["bloat_ratio"],
+                )
+            )
+
+    return {"drop": list(drop.values()), "bloated": bloated}
+
+
+def _partition_rollups(indexes: List[dict], drop: List[dict], bloated: List[dict]):
+    """Сводка по секционированным таблицам: сколько можно вернуть на всех секциях."""
+    root_of = {
+        f"{ix['schemaname']}.{ix['table_name']}": ix["root_table"]
+        for ix in indexes
+        if ix["root_table"]
+    }
+    rollups: Dict[str, dict] = {}
+    for entry in drop + bloated:
+        partitions = entry.get("partitions", [entry["table"]])
+        root = root_of.get(partitions[0])
+        if root is None:
+            continue
+        r = rollups.setdefault(
+            root,
+            {
+                "table": root,
+                "partitions": set(),
+                "droppable_indexes": 0,
+                "reclaimable_bytes": 0,
+                "write_ops_saved": 0,
+            },
+        )
+        r["partitions"].update(partitions)
+        if entry["reason"] == "bloated":
+            r["reclaimable_bytes"] += entry["bloat_bytes"]
+        else:
+            r["droppable_indexes"] += 1
+            r["reclaimable_bytes"] += entry["size_bytes"]
+            r["write_ops_saved"] += entry["write_ops"]
+    result = []
+    for r in rollups.values():
+        r["partitions"] = sorted(r["partitions"])
+        r["reclaimable"] = pretty_size(r["reclaimable_bytes"])
+        result.append(r)
+    result.sort(key=lambda r: -r["reclaimable_bytes"])
+    return result
+
+
+def _table_summary(drop: List[dict], bloated: List[dict]) -> List[dict]:
+    tables: Dict[str, dict] = {}
+    for entry in drop + bloated:
+        t = tables.setdefault(
+            entry["table"],
+            {
+                "table": entry["table"],
+                "droppable_indexes": 0,
+                "reclaimable_bytes": 0,
+                "write_ops_saved": 0,
+            },
+        )
+        if entry["reason"] == "bloated":
+            t["reclaimable_bytes"] += entry["bloat_bytes"]
+        else:
+            t["droppable_indexes"] += 1
+            t["reclaimable_bytes"] += entry["size_bytes"]
+            # каждая запись в таблицу больше не обновляет удалённый индекс
+            t["write_ops_saved"] += entry["write_ops"]
+    result = list(tables.values())
+    for t in result:
+        t["reclaimable"] = pretty_size(t["reclaimable_bytes"])
+    result.sort(key=lambda t: (-t["reclaimable_bytes"], -t["write_ops_saved"]))
+    return result
+
+
+def _statements(drop: List[dict], bloated: List[dict]) -> List[str]:
+    reasons = {
+        "unused": "не использовался (idx_scan = 0)",
+        "duplicate": "дубликат {duplicate_of}",
+        "redundant": "покрыт индексом {covered_by}",
+    }
+    statements = []
+    for entry in sorted(drop, key=lambda e: -e["size_bytes"]):
+        why = reasons[entry["reason"]].format(**entry)
+        if "partitions" in entry:
+            # CONCURRENTLY для секционированного индекса не поддерживается
+            statements.append(
+                f"DROP INDEX {entry['index']};  -- {why} ни на одной из "
+                f"{len(entry['partitions'])} секций, {entry['size']}"
+            )
+            continue
+        statements.append(
+            f"DROP INDEX CONCURRENTLY {entry['index']};  -- {why}, {entry['size']}"
+        )
+    for entry in sorted(bloated, key=lambda e: -e["bloat_bytes"]):
+        statements.append(
+            f"REINDEX INDEX CONCURRENTLY {entry['index']};  "
+            f"-- раздут на ~{entry['bloat_ratio']:.0%} ({entry['bloat']})"
+        )
+    return statements
+
+
+def analyze_index_health(conn):
+    """Неиспользуемые, дублирующиеся, избыточные и раздутые индексы."""
+    print("\nСостояние индексов:")
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        cur.execute(_INDEXES_SQL)
+        indexes = cur.fetchall()
+        cur.execute(_WIDTHS_SQL)
+        widths = {
+            (r["schemaname"], r["tablename"], r["attname"]): r["avg_width"]
+            for r in cur.fetchall()
+        }
+        cur.execute(_STATS_RESET_SQL)
+        row = cur.fetchone()
+        stats_reset = row["stats_reset"] if row else None
+
+    health = collect_index_health(indexes, widths)
+    drop, bloated = health["drop"], health["bloated"]
+    result = {
+        "stats_reset": str(stats_reset) if stats_reset else None,
+        "indexes_checked": len(indexes),
+        "unused": [e for e in drop if e["reason"] == "unused"],
+        "duplicates": [e for e in drop if e["reason"] == "duplicate"],
+        "redundant": [e for e in drop if e["reason"] == "redundant"],
+        "bloated": bloated,
+        "tables": _table_summary(drop, bloated),
+        "partitioned_tables": _partition_rollups(indexes, drop, bloated),
+        "statements": _statements(drop, bloated),
+        "notes": [
+            "idx_scan считается только на этом сервере — перед удалением "
+            "проверьте использование индекса на репликах.",
+        ],
+    }
+    if stats_reset:
+        result["notes"].append(
+            f"Статистика использования накоплена с {stats_reset} — "
+            "редкие (ежемесячные) запросы могли не попасть в окно."
+        )
+
+    for statement in result["statements"]:
+        print("-", statement)
+    if not result["statements"]:
+        print("✅ Лишних или раздутых индексов не найдено.")
+    return result
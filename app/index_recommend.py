@@ -1,65 +1,591 @@
 # index_recommend.py
 import re
+from typing import Dict, List, Optional
 
+from psycopg import rows
+
+from app.explain_analyze import explain_estimate
+from app.sql_lexer import (
+    IDENT,
+    KEYWORD,
+    OPERATOR,
+    PUNCT,
+    QUOTED_IDENT,
+    STRING,
+    split_scopes,
+    string_value,
+    tokenize,
+)
 
-def recommend_indexes(sql_query: str):
-    recommendations = []
 
-    # Приводим запрос к нижнему регистру для унификации
-    sql_query = sql_query.lower()
+# --- Структурированные кандидаты (таблица + колонка) ---
+_NAME_KINDS = (IDENT, QUOTED_IDENT)
+_EQ_OPERATORS = {"="}
+_RANGE_OPERATORS = {"<", ">", "<=", ">="}
+_EQ_KEYWORDS = {"in"}
+_RANGE_KEYWORDS = {"between"}
+# LIKE — диапазон btree только для литерала без ведущего % или _;
+# ILIKE и шаблон-параметр btree не использует никогда
+_PATTERN_KEYWORDS = {"like"}
+_WILDCARDS = ("%", "_")
+# слова, которые лексер считает идентификаторами, но это значения
+_NOT_COLUMNS = {
+    "true",
+    "false",
+    "current_date",
+    "current_time",
+    "current_timestamp",
+    "localtimestamp",
+    "current_user",
+}
+# после имени таблицы в FROM: это не алиас, а продолжение предложения
+_FROM_STOP = {"on", "using", "join", "where", "natural", "cross", "lateral"}
 
-    # ---------- WHERE ----------
-    where_conditions = re.findall(
-        r"\bwhere\b(.*?)(\bgroup\b|\border\b|\blimit\b|$)", sql_query, re.DOTALL
+
+def _name(token) -> str:
+    return (
+        token.value[1:-1].replace('""', '"')
+        if token.kind == QUOTED_IDENT
+        else token.value
     )
-    if where_conditions:
-        where_conditions = where_conditions[0][0]
 
-        # Поддержка операторов >, <, =, like, between, in
-        conditions = re.findall(
-            r"(\w+\.\w+|\w+)\s*(>=?|<=?|=|like|between|in)\s*('[^']*'|\d+|\([^)]*\))",
-            where_conditions,
+
+def _column_ref(items, i):
+    """[alias.]column начиная с items[i] -> (qualifier, column, следующий индекс)."""
+    if items[i].token.kind not in _NAME_KINDS:
+        return None
+    if (
+        i + 2 < len(items)
+        and items[i + 1].token.value == "."
+        and items[i + 2].token.kind in _NAME_KINDS
+    ):
+        return _name(items[i].token), _name(items[i + 2].token), i + 3
+    return None, _name(items[i].token), i + 1
+
+
+def _prefix_pattern(items, i) -> bool:
+    """items[i] — шаблон LIKE, который btree может обработать как диапазон."""
+    if i >= len(items) or items[i].token.kind != STRING:
+        return False
+    return not string_value(items[i].token).startswith(_WILDCARDS)
+
+
+def _scope_tables(items) -> Dict[str, str]:
+    """Алиас (или имя) -> таблица по FROM/JOIN блока."""
+    tables: Dict[str, str] = {}
+    expect_table = False
+    in_condition = False
+    i = 0
+    while i < len(items):
+        it = items[i]
+        tok = it.token
+        if not it.direct or it.clause != "from":
+            i += 1
+            continue
+        if tok.value in ("from", "join", ",") and tok.kind != QUOTED_IDENT:
+            expect_table, in_condition = True, False
+            i += 1
+            continue
+        if tok.value in ("on", "using") and tok.kind == KEYWORD:
+            in_condition = True
+        if expect_table and not in_condition and tok.kind in _NAME_KINDS:
+            ref = _column_ref(items, i)  # schema.table разбирается так же
+            schema, table, i = ref
+            full = f"{schema}.{table}" if schema else table
+            alias = table
+            if i < len(items) and items[i].token.value == "as":
+                i += 1
+            if (
+                i < len(items)
+                and items[i].token.kind in _NAME_KINDS
+                and items[i].token.value not in _FROM_STOP
+            ):
+                alias = _name(items[i].token)
+                i += 1
+            tables[alias] = full
+            tables.setdefault(table, full)
+            expect_table = False
+            continue
+        expect_table = False
+        i += 1
+    return tables
+
+
+def _or_branches(items) -> Dict[int, tuple]:
+    """
+    Ветви OR для токенов WHERE: индекс элемента -> путь ((группа, ветвь), ...)
+    по охватывающим уровням скобок, на которых есть OR. Пустой путь —
+    условие общее для всех ветвей. OR в подзапросах — в их собственных блоках.
+    """
+    stack = [[0, 0]]  # [группа скобок, номер ветви] от внешнего уровня к внутреннему
+    groups = 0
+    with_or = set()
+    raw: Dict[int, tuple] = {}
+    for i, it in enumerate(items):
+        if it.clause != "where":
+            continue
+        tok = it.token
+        if tok.kind == PUNCT and tok.value == "(":
+            groups += 1
+            stack.append([groups, 0])
+        elif tok.kind == PUNCT and tok.value == ")":
+            if len(stack) > 1:
+                stack.pop()
+        elif tok.kind == KEYWORD and tok.value == "or":
+            stack[-1][1] += 1
+            with_or.add(stack[-1][0])
+        else:
+            raw[i] = tuple(tuple(level) for level in stack)
+    return {
+        i: tuple(level for level in path if level[0] in with_or)
+        for i, path in raw.items()
+    }
+
+
+def extract_index_candidates(sql_query: str) -> List[dict]:
+    """
+    Колонки, по которым индекс может помочь, с привязкой к таблице:
+    [{"table", "column", "role", "scope", "scope_tables", "branch"}], role —
+    eq / range / join / order, а также select (колонки выборки, "*" — все).
+    branch — путь ветви OR для условий WHERE (см. _or_branches), () — общее.
+    Алиасы разворачиваются по FROM/JOIN своего блока запроса; колонка без
+    префикса относится к таблице, только если она в блоке одна (иначе
+    table = None, её можно разрешить по каталогу среди scope_tables).
+    Порядок — как в тексте запроса, без повторов.
+    """
+    candidates: List[dict] = []
+    seen = set()
+
+    for scope in split_scopes(tokenize(sql_query)):
+        items = scope.items
+        tables = _scope_tables(items)
+        scope_tables = sorted(set(tables.values()))
+        single = scope_tables[0] if len(scope_tables) == 1 else None
+        branches = _or_branches(items)
+
+        def add(qualifier: Optional[str], column: str, role: str, branch=()):
+            table = tables.get(qualifier) if qualifier else single
+            key = (scope.id, table, column, role, branch)
+            if key not in seen:
+                seen.add(key)
+                candidates.append(
+                    {
+                        "table": table,
+                        "column": column,
+                        "role": role,
+                        "scope": scope.id,
+                        # для колонок без префикса: из каких таблиц блока она может быть
+                        "scope_tables": scope_tables,
+                        "branch": branch,
+                    }
+                )
+
+        in_condition = False
+        i = 0
+        while i < len(items):
+            it = items[i]
+            tok = it.token
+            if it.clause == "from" and it.direct and tok.kind == KEYWORD:
+                if tok.value in ("on", "using"):
+                    in_condition = True
+                elif tok.value == "join":
+                    in_condition = False
+            if it.clause not in ("select", "where", "from", "order_by") or (
+                it.clause == "from" and not in_condition
+            ):
+                i += 1
+                continue
+            if it.clause == "select" and tok.kind == OPERATOR and tok.value == "*":
+                prev = items[i - 1].token.value if i else ""
+                if prev in ("select", "distinct", ",", "."):
+                    qualifier = items[i - 2].token.value if prev == "." else None
+                    add(qualifier, "*", "select")
+                i += 1
+                continue
+            ref = _column_ref(items, i)
+            if ref is None:
+                i += 1
+                continue
+            qualifier, column, j = ref
+            nxt = items[j].token if j < len(items) else None
+            if nxt is not None and nxt.value in ("(", "."):
+                i = j  # вызов функции или alias.* — не колонка
+                continue
+            if it.clause == "select":
+                # "expr AS name" — name не колонка; без AS алиас отсеет каталог
+                if not (i and items[i - 1].token.value == "as"):
+                    if not (qualifier is None and column in _NOT_COLUMNS):
+                        add(qualifier, column, "select")
+            elif it.clause == "order_by":
+                add(qualifier, column, "order")
+            elif it.clause == "from":
+                add(qualifier, column, "join")
+            elif nxt is not None:
+                op = nxt.value
+                other = _column_ref(items, j + 1) if j + 1 < len(items) else None
+                if other and (
+                    (other[2] < len(items) and items[other[2]].token.value == "(")
+                    or (other[0] is None and other[1] in _NOT_COLUMNS)
+                ):
+                    other = None  # f(...), true, current_date — не колонка
+                if nxt.kind == OPERATOR and op in _EQ_OPERATORS and other:
+                    # a.x = b.y в WHERE — соединение в старом стиле
+                    add(qualifier, column, "join")
+                    add(other[0], other[1], "join")
+                    j = other[2]
+                elif (nxt.kind == OPERATOR and op in _EQ_OPERATORS) or (
+                    nxt.kind == KEYWORD and op in _EQ_KEYWORDS
+                ):
+                    add(qualifier, column, "eq", branches.get(i, ()))
+                elif (nxt.kind == OPERATOR and op in _RANGE_OPERATORS) or (
+                    nxt.kind == KEYWORD and op in _RANGE_KEYWORDS
+                ):
+                    add(qualifier, column, "range", branches.get(i, ()))
+                elif (
+                    nxt.kind == KEYWORD
+                    and op in _PATTERN_KEYWORDS
+                    and _prefix_pattern(items, j + 1)
+                ):
+                    add(qualifier, column, "range", branches.get(i, ()))
+            i = j
+    return candidates
+
+
+# --- Каталог: существующие индексы и статистика колонок ---
+LOW_SELECTIVITY = 0.3  # доля строк на значение, при которой индекс бесполезен
+HIGH_CORRELATION = 0.9  # физическая упорядоченность колонки (BRIN)
+BRIN_MIN_ROWS = 1_000_000
+MAX_INCLUDE_COLUMNS = 3
+
+_TABLE_SQL = """
+SELECT c.oid, c.relkind, c.reltuples, n.nspname, c.relname
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.oid = to_regclass(%s)
+"""
+_COLUMNS_SQL = """
+SELECT attname FROM pg_attribute
+WHERE attrelid = %s AND attnum > 0 AND NOT attisdropped
+ORDER BY attnum
+"""
+# ключевые колонки btree-индексов; NULL вместо имени — выражение
+_INDEXES_SQL = """
+SELECT i.indrelid, ic.relname AS index_name, i.indpred IS NOT NULL AS partial,
+       ARRAY(
+         SELECT a.attname
+         FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+         LEFT JOIN pg_attribute a
+           ON a.attrelid = i.indrelid AND a.attnum = k.attnum AND k.attnum > 0
+         WHERE k.ord <= i.indnkeyatts
+         ORDER BY k.ord
+       ) AS columns
+FROM pg_index i
+JOIN pg_class ic ON ic.oid = i.indexrelid
+JOIN pg_am am ON am.oid = ic.relam
+WHERE i.indrelid = ANY(%s) AND am.amname = 'btree' AND i.indisvalid
+"""
+_PARTITIONS_SQL = """
+SELECT relid::oid AS relid, relid::regclass::text AS name
+FROM pg_partition_tree(%s)
+WHERE isleaf AND relid <> %s::regclass
+"""
+_STATS_SQL = """
+SELECT attname, null_frac, n_distinct, correlation
+FROM pg_stats
+WHERE schemaname = %s AND tablename = %s
+"""
+
+
+def load_catalog(conn, tables) -> Dict[str, dict]:
+    """
+    Для каждой таблицы запроса: колонки, btree-индексы (для секционированной
+    таблицы — индексы каждой секции) и pg_stats по колонкам.
+    Таблицы, которых нет в базе, пропускаются.
+    """
+    catalog: Dict[str, dict] = {}
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        for table in sorted(set(tables)):
+            cur.execute(_TABLE_SQL, (table,))
+            rel = cur.fetchone()
+            if rel is None or rel["relkind"] not in ("r", "p", "m"):
+                continue
+            oid = rel["oid"]
+            cur.execute(_COLUMNS_SQL, (oid,))
+            columns = [r["attname"] for r in cur.fetchall()]
+
+            # у секционированной таблицы индекс может быть на каждой секции
+            # отдельно — тогда он "есть", только если есть на всех
+            groups = [oid]
+            partition_names = []
+            if rel["relkind"] == "p":
+                cur.execute(_PARTITIONS_SQL, (oid, oid))
+                for r in cur.fetchall():
+                    groups.append(r["relid"])
+                    partition_names.append(r["name"])
+            cur.execute(_INDEXES_SQL, (groups,))
+            indexes: Dict[int, list] = {g: [] for g in groups}
+            for r in cur.fetchall():
+                if not r["partial"]:
+                    indexes[r["indrelid"]].append((r["index_name"], r["columns"]))
+
+            cur.execute(_STATS_SQL, (rel["nspname"], rel["relname"]))
+            stats = {r["attname"]: r for r in cur.fetchall()}
+
+            catalog[table] = {
+                "name": f"{rel['nspname']}.{rel['relname']}",
+                "rows": max(float(rel["reltuples"] or 0), 0.0),
+                "columns": columns,
+                "own_indexes": indexes[oid],
+                "partitions": list(
+                    zip(partition_names, [indexes[g] for g in groups[1:]])
+                ),
+                "stats": stats,
+            }
+    return catalog
+
+
+def _selectivity(info: Optional[dict], column: str) -> Optional[float]:
+    """Доля строк на одно значение по pg_stats (None — статистики нет)."""
+    if not info or column not in info["stats"]:
+        return None
+    st = info["stats"][column]
+    n_distinct = float(st["n_distinct"] or 0)
+    if n_distinct < 0:  # отрицательное значение — доля от числа строк
+        n_distinct = -n_distinct * max(info["rows"], 1.0)
+    if n_distinct <= 0:
+        return None
+    return (1.0 - float(st["null_frac"] or 0)) / n_distinct
+
+
+def _covers(index_columns: list, columns: list, n_eq: int) -> bool:
+    """Индекс покрывает кандидата, если его префикс — те же колонки
+    (колонки равенства — в любом порядке)."""
+    prefix = index_columns[: len(columns)]
+    if len(prefix) < len(columns) or None in prefix:
+        return False
+    return set(prefix[:n_eq]) == set(columns[:n_eq]) and prefix[n_eq:] == columns[n_eq:]
+
+
+def _coverage(info: Optional[dict], columns: list, n_eq: int):
+    """
+    (имя покрывающего индекса или None, секции без такого индекса).
+    Для секционированной таблицы индекс считается существующим, только
+    если он есть на самой таблице или на каждой её секции.
+    """
+    if not info:
+        return None, []
+    for name, index_columns in info["own_indexes"]:
+        if _covers(index_columns, columns, n_eq):
+            return name, []
+    if not info["partitions"]:
+        return None, []
+    hits, missing = [], []
+    for part_name, part_indexes in info["partitions"]:
+        hit = next(
+            (n for n, cols in part_indexes if _covers(cols, columns, n_eq)), None
         )
-        for condition in conditions:
-            field = condition[0]
-            recommendations.append(
-                f"Создать индекс на поле {field} для ускорения фильтрации."
-            )
+        if hit is None:
+            missing.append(part_name)
+        else:
+            hits.append(hit)
+    if missing or not hits:
+        return None, missing
+    suffix = f" и ещё {len(hits) - 1} на секциях" if len(hits) > 1 else ""
+    return hits[0] + suffix, []
+
+
+def pretty_size(size: Optional[float]) -> Optional[str]:
+    """Размер в байтах -> "1.3 MB" (как pg_size_pretty)."""
+    if size is None:
+        return None
+    for unit in ("bytes", "kB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _quote(name: str) -> str:
+    if re.fullmatch(r"[a-z_][a-z0-9_$]*", name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
 
-    # ---------- JOIN (ON) ----------
-    join_conditions = re.findall(
-        r"\bjoin\b\s+\w+(?:\s+\w+)?\s+on\s+([\w\.]+)\s*=\s*([\w\.]+)", sql_query
+
+def index_ddl(table: str, columns: list, include: list = ()) -> str:
+    ddl = "CREATE INDEX ON {} ({})".format(
+        ".".join(_quote(p) for p in table.split(".", 1)),
+        ", ".join(_quote(c) for c in columns),
     )
-    for left_field, right_field in join_conditions:
-        recommendations.append(
-            f"Создать индекс на поле {left_field} для ускорения соединений."
-        )
-        recommendations.append(
-            f"Создать индекс на поле {right_field} для ускорения соединений."
-        )
+    if include:
+        ddl += " INCLUDE ({})".format(", ".join(_quote(c) for c in include))
+    return ddl
 
-    # ---------- JOIN (USING) ----------
-    join_using = re.findall(r"\bjoin\b\s+\w+(?:\s+\w+)?\s+using\s*\((\w+)\)", sql_query)
-    for field in join_using:
-        recommendations.append(
-            f"Создать индекс на поле {field} для ускорения соединений."
-        )
 
-    # ---------- ORDER BY ----------
-    order_by = re.search(r"\border\s+by\s+(.*)", sql_query)
-    if order_by:
-        order_fields = re.split(r",\s*", order_by.group(1))
-        for field in order_fields:
-            field = re.sub(r"\s+(asc|desc)\b", "", field).strip().rstrip(";")
-            recommendations.append(
-                f"Создать индекс на поле {field} для ускорения сортировки."
+def _resolve_tables(candidates: List[dict], catalog: Optional[dict]) -> List[dict]:
+    """Колонкам без префикса ищем таблицу блока, в которой такая колонка есть."""
+    if not catalog:
+        return [c for c in candidates if c["table"] is not None]
+    resolved = []
+    for c in candidates:
+        table = c["table"]
+        if table is None and c["column"] != "*":
+            owners = [
+                t
+                for t in c["scope_tables"]
+                if t in catalog and c["column"] in catalog[t]["columns"]
+            ]
+            table = owners[0] if len(owners) == 1 else None
+        if table is None:
+            continue
+        if table in catalog and c["column"] != "*":
+            if c["column"] not in catalog[table]["columns"]:
+                continue  # алиас выражения или опечатка — не колонка таблицы
+        resolved.append({**c, "table": table})
+    return resolved
+
+
+def synthesize_indexes(sql_query: str, catalog: Optional[dict] = None) -> List[dict]:
+    """
+    Составные индексы по каждой таблице каждого блока запроса:
+    сначала колонки равенства (самые селективные — первыми), затем одна
+    колонка диапазона, затем ORDER BY (если диапазона нет). Колонки выборки
+    добавляются в INCLUDE, если запрос не берёт "*". Колонки соединения —
+    отдельными индексами. Условия разных ветвей OR в один индекс не
+    сводятся: у каждой ветви свой (общие условия — в нём же), чтобы
+    планировщик мог собрать BitmapOr; сортировку и INCLUDE bitmap-скан не
+    использует. С каталогом кандидаты, уже покрытые префиксом
+    существующего индекса или с низкой селективностью, помечаются skip.
+    Порядок результата детерминирован: как таблицы и колонки идут в запросе.
+    """
+    candidates = _resolve_tables(extract_index_candidates(sql_query), catalog)
+    groups: Dict[tuple, Dict[str, list]] = {}
+    for c in candidates:
+        roles = groups.setdefault((c["scope"], c["table"], c["branch"]), {})
+        column_list = roles.setdefault(c["role"], [])
+        if c["column"] not in column_list:
+            column_list.append(c["column"])
+    # таблицы блока, условия которых разнесены по ветвям OR
+    branched = {(scope_id, table) for scope_id, table, branch in groups if branch}
+
+    result: List[dict] = []
+    seen = set()
+
+    def emit(table, columns, include, reason, n_eq):
+        key = (table, tuple(columns))
+        if not columns or key in seen:
+            return
+        seen.add(key)
+        info = catalog.get(table) if catalog else None
+        entry = {
+            "table": table,
+            "columns": columns,
+            "include": include,
+            "ddl": index_ddl(table, columns, include),
+            "reason": reason,
+            "skip": None,
+        }
+        covered, missing = _coverage(info, columns, n_eq)
+        lead = _selectivity(info, columns[0])
+        if missing and len(missing) < len(info["partitions"]):
+            entry[
+                "reason"
+            ] += f"; индекс есть не на всех секциях, нет на: {', '.join(missing)}"
+        if covered:
+            entry["skip"] = f"уже есть индекс {covered}"
+        elif lead is not None and lead > LOW_SELECTIVITY and n_eq == len(columns):
+            entry["skip"] = (
+                f"низкая селективность {columns[0]} " f"(~{lead:.0%} строк на значение)"
             )
+        result.append(entry)
+
+    # индекс обслуживает ORDER BY, только если все его колонки из одной таблицы
+    order_tables: Dict[int, set] = {}
+    for c in candidates:
+        if c["role"] == "order":
+            order_tables.setdefault(c["scope"], set()).add(c["table"])
+
+    for (scope_id, table, branch), roles in groups.items():
+        info = catalog.get(table) if catalog else None
+        eq = list(roles.get("eq", []))
+        ranges = list(roles.get("range", []))
+        order = roles.get("order", []) if order_tables.get(scope_id) == {table} else []
+        selected = roles.get("select", [])
+        reason = []
+        if (scope_id, table) in branched:
+            order, selected = [], ["*"]
+            if not branch:
+                # общие условия войдут префиксом в индекс каждой ветви
+                eq, ranges = [], []
+            else:
+                # условия охватывающих уровней: их путь — префикс пути ветви
+                levels = [
+                    groups.get((scope_id, table, branch[:d]), {})
+                    for d in range(len(branch))
+                ]
+                eq, ranges = [], []
+                for level in levels + [roles]:
+                    eq += [c for c in level.get("eq", []) if c not in eq]
+                    ranges += [c for c in level.get("range", []) if c not in ranges]
+                reason.append("ветвь OR")
+        # самые селективные колонки равенства — первыми; без статистики — как в запросе
+        eq.sort(key=lambda col: _selectivity(info, col) or 1.0)
+
+        columns = list(eq)
+        if eq:
+            reason.append("равенство: " + ", ".join(eq))
+        if ranges:
+            rng = ranges[0]
+            if rng not in columns:
+                columns.append(rng)
+            reason.append(f"диапазон: {rng}")
+            st = info["stats"].get(rng) if info else None
+            if (
+                st
+                and abs(float(st["correlation"] or 0)) >= HIGH_CORRELATION
+                and info["rows"] >= BRIN_MIN_ROWS
+                and not eq
+            ):
+                reason.append(f"{rng} физически упорядочена — подойдёт и BRIN")
+        elif order:
+            # ORDER BY обслуживается индексом только после равенств
+            extra = [col for col in order if col not in columns]
+            columns.extend(extra)
+            reason.append("сортировка: " + ", ".join(order))
+
+        include = []
+        if info and columns and "*" not in selected:
+            include = [col for col in selected if col not in columns]
+            if len(include) > MAX_INCLUDE_COLUMNS:
+                include = []  # слишком широкий индекс — не покрываем
+            elif include:
+                reason.append("INCLUDE для index-only scan: " + ", ".join(include))
+
+        emit(table, columns, include, "; ".join(reason), len(eq))
+        for col in roles.get("join", []):
+            emit(table, [col], [], f"соединение по {col}", 1)
+    return result
 
-    # Убираем дубли
-    recommendations = list(set(recommendations))
+
+def recommend_indexes(sql_query: str, conn=None):
+    """
+    Рекомендации по индексам текстом. С соединением (conn) учитываются
+    существующие индексы и pg_stats, без него — только разбор запроса.
+    """
+    catalog = None
+    if conn is not None:
+        candidates = extract_index_candidates(sql_query)
+        catalog = load_catalog(conn, [t for c in candidates for t in c["scope_tables"]])
+
+    recommendations = []
+    for entry in synthesize_indexes(sql_query, catalog):
+        target = f"{entry['table']}({', '.join(entry['columns'])})"
+        if entry["skip"]:
+            recommendations.append(f"Индекс {target} не нужен: {entry['skip']}.")
+        else:
+            recommendations.append(
+                f"Создать индекс {entry['ddl']} — {entry['reason']}."
+            )
     if not recommendations:
         recommendations.append("Индексы не требуются.")
-
     return recommendations
 
 
@@ -67,12 +593,11 @@ def analyze_indexes(query: str, conn=None):
     """Обёртка для вызова из меню (в стиле run_explain, analyze_stats)."""
     print("\nРекомендации по индексам:")
     try:
-        # Проверяем корректность запроса через EXPLAIN
-        with conn.cursor() as cur:
-            cur.execute(f"EXPLAIN {query}")
+        # Проверяем корректность запроса через EXPLAIN (текст с $1 — generic-план)
+        explain_estimate(conn, query)
 
-        # Если EXPLAIN прошел успешно — вызываем рекомендации
-        indexes = recommend_indexes(query)
+        # Если EXPLAIN прошел успешно — вызываем рекомендации с учётом каталога
+        indexes = recommend_indexes(query, conn)
 
         for idx in indexes:
             print("-", idx)
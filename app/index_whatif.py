@@ -0,0 +1,217 @@
+# index_whatif.py
+import logging
+from typing import List, Optional
+
+from psycopg import rows, sql
+
+from app.capabilities import get_capabilities, has_extension
+from app.explain_analyze import check_single_statement, explain_estimate
+from app.index_recommend import (
+    extract_index_candidates,
+    load_catalog,
+    pretty_size,
+    synthesize_indexes,
+)
+from app.plan_analysis import flatten_plan
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры оценки ---
+WHATIF_MAX_CANDIDATES = 10  # сколько индексов примеряем к одному запросу
+WHATIF_MIN_GAIN_PCT = 1.0  # меньший выигрыш по стоимости считаем шумом
+WHATIF_LOCK_TIMEOUT = "2s"  # CREATE INDEX берёт SHARE-блокировку на таблицу
+WHATIF_INDEX_PREFIX = "pg_analyzer_whatif"
+
+METHOD_HYPOPG = "hypopg"
+METHOD_ROLLBACK = "rollback"
+
+
+def _total_cost(explain: dict) -> float:
+    return float(explain["Plan"].get("Total Cost", 0) or 0)
+
+
+def _uses_index(explain: dict, index_name: str) -> bool:
+    return any(
+        index_name in (node.get("Index Name") or "")
+        for node, _, _, _ in flatten_plan(explain["Plan"])
+    )
+
+
+def _table_identifier(table: str) -> sql.Composable:
+    return sql.Identifier(*table.split(".", 1))
+
+
+def build_candidates(query: str, conn) -> List[dict]:
+    """
+    Кандидаты из index_recommend.synthesize_indexes (составные, с INCLUDE),
+    кроме уже покрытых существующими индексами.
+    """
+    candidates = extract_index_candidates(query)
+    catalog = load_catalog(conn, [t for c in candidates for t in c["scope_tables"]])
+    conn.rollback()
+    result = [c for c in synthesize_indexes(query, catalog) if not c["skip"]]
+    return result[:WHATIF_MAX_CANDIDATES]
+
+
+def index_ddl(candidate: dict, name: Optional[str] = None) -> sql.Composed:
+    columns = sql.SQL(", ").join(sql.Identifier(c) for c in candidate["columns"])
+    ddl = sql.SQL("CREATE INDEX {}ON {} ({})").format(
+        sql.SQL("") if name is None else sql.SQL("{} ").format(sql.Identifier(name)),
+        _table_identifier(candidate["table"]),
+        columns,
+    )
+    if candidate.get("include"):
+        ddl += sql.SQL(" INCLUDE ({})").format(
+            sql.SQL(", ").join(sql.Identifier(c) for c in candidate["include"])
+        )
+    return ddl
+
+
+def hypopg_available(conn) -> bool:
+    return has_extension(conn, "hypopg")
+
+
+def is_read_only(conn) -> bool:
+    # реплика или default_transaction_read_only — из профиля сервера
+    return get_capabilities(conn)["read_only"]
+
+
+def _try_hypopg(conn, query: str, candidate: dict) -> dict:
+    """Гипотетический индекс: существует только для планировщика этой сессии."""
+    ddl = index_ddl(candidate).as_string(conn)
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        cur.execute("SELECT indexrelid, indexname FROM hypopg_create_index(%s)", (ddl,))
+        hypo = cur.fetchone()
+        try:
+            explain = explain_estimate(conn, query)
+            cur.execute(
+                "SELECT hypopg_relation_size(%s) AS size", (hypo["indexrelid"],)
+            )
+            size = cur.fetchone()["size"]
+        finally:
+            cur.execute("SELECT hypopg_drop_index(%s)", (hypo["indexrelid"],))
+    return {
+        "cost": _total_cost(explain),
+        "used": _uses_index(explain, hypo["indexname"]),
+        "size_bytes": size,
+    }
+
+
+def _try_rollback(conn, query: str, candidate: dict, n: int) -> dict:
+    """Настоящий индекс в транзакции, которая откатывается после EXPLAIN."""
+    # "; COMMIT" в запросе зафиксировал бы построенный индекс и его блокировку
+    check_single_statement(query)
+    name = f"{WHATIF_INDEX_PREFIX}_{n}"
+    try:
+        with conn.cursor(row_factory=rows.dict_row) as cur:
+            cur.execute(
+                "SELECT set_config('lock_timeout', %s, true)", (WHATIF_LOCK_TIMEOUT,)
+            )
+            cur.execute(index_ddl(candidate, name))
+            explain = explain_estimate(conn, query)
+            cur.execute(
+                "SELECT pg_relation_size(c.oid) AS size FROM pg_class c WHERE c.relname = %s",
+                (name,),
+            )
+            size = cur.fetchone()["size"]
+    finally:
+        conn.rollback()
+    return {
+        "cost": _total_cost(explain),
+        "used": _uses_index(explain, name),
+        "size_bytes": size,
+    }
+
+
+def evaluate_indexes(query: str, conn=None, allow_build: bool = False):
+    """
+    Примеряет индексы-кандидаты к запросу и оставляет только те, которые
+    планировщик использует и которые снижают стоимость плана.
+    - HypoPG (если расширение установлено) — без построения индексов;
+    - иначе, при allow_build и не read-only цели, — CREATE INDEX в
+      транзакции с откатом. Индекс строится по-настоящему, поэтому такой
+      режим — только для scratch-копии базы.
+    """
+    print("\nОценка индексов (what-if):")
+    try:
+        check_single_statement(query)
+        baseline = explain_estimate(conn, query)
+        conn.rollback()
+        baseline_cost = _total_cost(baseline)
+
+        if hypopg_available(conn):
+            method = METHOD_HYPOPG
+        elif allow_build and not is_read_only(conn):
+            method = METHOD_ROLLBACK
+        else:
+            message = (
+                "⚠️ Расширение hypopg не установлено, а построение индексов в "
+                "откатываемой транзакции не разрешено (allow_build) или цель "
+                "только для чтения — оценка невозможна."
+            )
+            print(message)
+            return message
+        conn.rollback()
+    except Exception as e:
+        print(f"❌ Ошибка в SQL запросе: {e}")
+        conn.rollback()
+        return f"❌ Ошибка в SQL запросе: {e}"
+
+    accepted, rejected = [], []
+    try:
+        candidates = build_candidates(query, conn)
+    except Exception as e:
+        conn.rollback()
+        return f"❌ Не удалось прочитать каталог: {e}"
+
+    for n, candidate in enumerate(candidates):
+        ddl = index_ddl(candidate).as_string(conn)
+        try:
+            if method == METHOD_HYPOPG:
+                outcome = _try_hypopg(conn, query, candidate)
+            else:
+                outcome = _try_rollback(conn, query, candidate, n)
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"what-if: {ddl} не оценён: {e}")
+            rejected.append({"ddl": ddl, "reason": f"не удалось оценить: {e}"})
+            continue
+
+        delta = baseline_cost - outcome["cost"]
+        gain_pct = delta / baseline_cost * 100 if baseline_cost else 0.0
+        entry = {
+            "table": candidate["table"],
+            "columns": candidate["columns"],
+            "include": candidate["include"],
+            "reason": candidate["reason"],
+            "ddl": ddl,
+            "cost": outcome["cost"],
+            "cost_delta": round(delta, 2),
+            "gain_pct": round(gain_pct, 1),
+            "size_bytes": outcome["size_bytes"],
+            "size": pretty_size(outcome["size_bytes"]),
+        }
+        if not outcome["used"]:
+            rejected.append({"ddl": ddl, "reason": "планировщик не использует индекс"})
+        elif gain_pct < WHATIF_MIN_GAIN_PCT:
+            rejected.append({"ddl": ddl, "reason": "стоимость плана почти не меняется"})
+        else:
+            accepted.append(entry)
+
+    if method == METHOD_HYPOPG:
+        try:
+            conn.execute("SELECT hypopg_reset()")
+        finally:
+            conn.rollback()
+
+    accepted.sort(key=lambda e: -e["cost_delta"])
+    for e in accepted:
+        print(f"- {e['ddl']}: -{e['gain_pct']}% стоимости, размер ~{e['size']}")
+    for r in rejected:
+        print(f"  отброшен {r['ddl']}: {r['reason']}")
+    return {
+        "method": method,
+        "baseline_cost": baseline_cost,
+        "recommended": accepted,
+        "rejected": rejected,
+    }
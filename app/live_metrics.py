@@ -0,0 +1,242 @@
+# live_metrics.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from psycopg import rows
+
+from app.db_pool import release
+
+logger = logging.getLogger(__name__)
+
+LIVE_INTERVAL = float(os.getenv("LIVE_METRICS_INTERVAL", "1"))  # сек
+LIVE_HISTORY = 300  # точек в буфере: новый клиент сразу видит последние 5 минут
+LIVE_QUEUE_SIZE = 30  # точек в очереди клиента; медленный клиент теряет старые
+
+_COUNTERS = (
+    "xact_commit",
+    "xact_rollback",
+    "blks_hit",
+    "blks_read",
+    "tup_returned",
+    "tup_fetched",
+    "tup_inserted",
+    "tup_updated",
+    "tup_deleted",
+    "temp_bytes",
+    "deadlocks",
+)
+
+# один запрос на тик: счётчики базы и состояния сессий
+_SNAPSHOT_SQL = """
+SELECT d.stats_reset,
+       d.xact_commit, d.xact_rollback, d.blks_hit, d.blks_read,
+       d.tup_returned, d.tup_fetched, d.tup_inserted, d.tup_updated,
+       d.tup_deleted, d.temp_bytes, d.deadlocks,
+       a.active, a.idle, a.idle_in_transaction, a.total
+FROM pg_stat_database d
+CROSS JOIN LATERAL (
+  SELECT count(*) FILTER (WHERE state = 'active') AS active,
+         count(*) FILTER (WHERE state = 'idle') AS idle,
+         count(*) FILTER (WHERE state LIKE 'idle in transaction%') AS idle_in_transaction,
+         count(*) AS total
+  FROM pg_stat_activity
+  WHERE datname = d.datname
+    AND backend_type = 'client backend'
+    AND pid <> pg_backend_pid()
+) a
+WHERE d.datname = current_database()
+"""
+
+
+def compute_point(prev: dict, cur: dict) -> dict:
+    """
+    Скорости между двумя снимками pg_stat_database (в секунду) и
+    текущие сессии. После сброса статистики (изменился stats_reset или
+    счётчик уменьшился) скорости за интервал не считаются.
+    """
+    seconds = cur["ts"] - prev["ts"]
+    delta = {name: cur[name] - prev[name] for name in _COUNTERS}
+    reset = cur["stats_reset"] != prev["stats_reset"] or any(
+        v < 0 for v in delta.values()
+    )
+    point = {
+        "ts": cur["ts"],
+        "interval_s": round(seconds, 3),
+        "reset": reset,
+        "sessions": {
+            "active": cur["active"],
+            "idle": cur["idle"],
+            "idle_in_transaction": cur["idle_in_transaction"],
+            "total": cur["total"],
+        },
+    }
+    if reset or seconds <= 0:
+        return point
+
+    def rate(value) -> float:
+        return round(value / seconds, 2)
+
+    blocks = delta["blks_hit"] + delta["blks_read"]
+    point.update(
+        {
+            "tps": rate(delta["xact_commit"] + delta["xact_rollback"]),
+            "commits_per_s": rate(delta["xact_commit"]),
+            "rollbacks_per_s": rate(delta["xact_rollback"]),
+            # за интервал, а не накопленный: просадка видна сразу
+            "cache_hit_ratio": (
+                round(delta["blks_hit"] / blocks, 4) if blocks else None
+            ),
+            "tuples_returned_per_s": rate(delta["tup_returned"]),
+            "tuples_fetched_per_s": rate(delta["tup_fetched"]),
+            "tuples_inserted_per_s": rate(delta["tup_inserted"]),
+            "tuples_updated_per_s": rate(delta["tup_updated"]),
+            "tuples_deleted_per_s": rate(delta["tup_deleted"]),
+            "temp_bytes_per_s": rate(delta["temp_bytes"]),
+            "deadlocks": delta["deadlocks"],
+        }
+    )
+    return point
+
+
+def _offer(queue: asyncio.Queue, point: dict) -> None:
+    # выполняется в event loop клиента
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(point)
+
+
+class MetricsFeed:
+    """
+    Живые метрики одной цели подключения.
+
+    Пока есть хотя бы один подписчик, фоновый поток раз в interval
+    секунд снимает pg_stat_database и pg_stat_activity, считает скорости
+    и раздаёт одну и ту же точку всем подписчикам — сколько бы вкладок
+    ни было открыто, к базе идёт один запрос в секунду. Без подписчиков
+    поток останавливается.
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        interval: float = LIVE_INTERVAL,
+        capacity: int = LIVE_HISTORY,
+        name: str = "",
+    ):
+        self.connect = connect
+        self.interval = interval
+        self.name = name
+        self._history = deque(maxlen=capacity)
+        self._subscribers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+        self._lock = threading.Lock()
+        self._stop: Optional[threading.Event] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # --- подписчики ---
+    def subscribe(self) -> asyncio.Queue:
+        """Очередь новых точек; вызывать из event loop клиента."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), queue))
+            if self._stop is None:
+                # у каждого запуска своё событие: старый поток доработает тик и выйдет
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._stop,),
+                    name=f"live-metrics {self.name}",
+                    daemon=True,
+                )
+                self._thread.start()
+                logger.info(f"Живые метрики запущены ({self.name})")
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self._lock:
+            self._subscribers = {s for s in self._subscribers if s[1] is not queue}
+            if not self._subscribers and self._stop is not None:
+                self._stop.set()
+                self._stop = None
+                logger.info(f"Живые метрики остановлены: нет подписчиков ({self.name})")
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def history(self) -> List[dict]:
+        with self._lock:
+            return list(self._history)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._subscribers.clear()
+            if self._stop is not None:
+                self._stop.set()
+                self._stop = None
+
+    def _publish(self, point: dict) -> None:
+        with self._lock:
+            if "error" not in point:
+                self._history.append(point)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, point)
+            except RuntimeError:
+                pass  # event loop клиента уже закрыт
+
+    # --- опрос ---
+    def _snapshot(self) -> dict:
+        conn = self.connect()
+        try:
+            with conn.cursor(row_factory=rows.dict_row) as cur:
+                cur.execute(_SNAPSHOT_SQL)
+                snapshot = cur.fetchone()
+        finally:
+            release(conn)
+        snapshot["ts"] = time.time()
+        return snapshot
+
+    def _run(self, stop: threading.Event) -> None:
+        prev = None
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                cur = self._snapshot()
+                if prev is not None:
+                    self._publish(compute_point(prev, cur))
+                prev = cur
+            except Exception as e:
+                logger.warning(f"Живые метрики {self.name}: снимок не получен: {e}")
+                self._publish({"ts": time.time(), "error": str(e)})
+                prev = None
+            stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+# --- Реестр лент: одна на цель подключения ---
+_feeds: Dict[tuple, MetricsFeed] = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(key: tuple, connect: Callable) -> MetricsFeed:
+    """Лента метрик цели (поток опроса стартует с первым подписчиком)."""
+    with _feeds_lock:
+        feed = _feeds.get(key)
+        if feed is None:
+            host, port, dbname, _ = key
+            feed = MetricsFeed(connect, name=f"{host}:{port}/{dbname}")
+            _feeds[key] = feed
+        return feed
+
+
+def stop_all_feeds() -> None:
+    with _feeds_lock:
+        feeds = list(_feeds.values())
+        _feeds.clear()
+    for feed in feeds:
+        feed.stop()
@@ -0,0 +1,321 @@
+"""
+Генератор нагрузки для pagila (или базы с той же схемой).
+
+Профили:
+- read  — точечные выборки в стиле N+1 (список клиентов, затем по запросу
+          на каждого) и редкий отчёт с сортировкой — материал для Find N+1
+          и советов по work_mem;
+- write — вставки в rental/payment и UPDATE rental, оставляющие мёртвые
+          строки, — материал для анализа autovacuum и индексов;
+- mixed — и то и другое.
+
+Запись идёт пачками в одном из режимов: single (execute на строку),
+executemany, pipeline (pipeline mode libpq), copy (COPY FROM STDIN; для
+UPDATE, где COPY неприменим, используется executemany).
+В конце — пропускная способность и задержки p50/p95/p99 по операциям.
+
+Запуск из корня проекта (нужен пользователь с правами на запись):
+    python -m app.load_generator --profile mixed --concurrency 8 --duration 30
+    python -m app.load_generator --profile write --batch-mode copy --batch-size 500 \\
+        --dsn "host=localhost port=5434 dbname=pagila user=postgres password=example"
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import psycopg
+
+# --- Параметры по умолчанию ---
+DEFAULT_DSN = os.getenv(
+    "LOAD_DSN", "host=localhost port=5434 dbname=pagila user=postgres password=example"
+)
+DEFAULT_CONCURRENCY = 8
+DEFAULT_DURATION = 30.0  # сек
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FANOUT = 20  # дочерних запросов на один родительский (N в N+1)
+ID_SAMPLE_SIZE = 10_000  # сколько существующих id берём для ссылок
+
+BATCH_MODES = ("single", "executemany", "pipeline", "copy")
+
+# секции payment в pagila: 2022-01 .. 2022-07
+PAYMENT_DATE_FROM = datetime(2022, 1, 2, tzinfo=timezone.utc)
+PAYMENT_DATE_DAYS = 200
+
+# --- SQL ---
+_INSERT_RENTAL = (
+    "INSERT INTO rental (rental_date, inventory_id, customer_id, staff_id) "
+    "VALUES (%s, %s, %s, %s)"
+)
+_COPY_RENTAL = (
+    "COPY rental (rental_date, inventory_id, customer_id, staff_id) FROM STDIN"
+)
+_INSERT_PAYMENT = (
+    "INSERT INTO payment (customer_id, staff_id, rental_id, amount, payment_date) "
+    "VALUES (%s, %s, %s, %s, %s)"
+)
+_COPY_PAYMENT = (
+    "COPY payment (customer_id, staff_id, rental_id, amount, payment_date) FROM STDIN"
+)
+_UPDATE_RENTAL = "UPDATE rental SET return_date = now() WHERE rental_id = %s"
+_LIST_CUSTOMERS = (
+    "SELECT customer_id FROM customer WHERE active = 1 "
+    "ORDER BY customer_id LIMIT %s OFFSET %s"
+)
+_CUSTOMER_RENTALS = (
+    "SELECT rental_id, rental_date, return_date FROM rental WHERE customer_id = %s"
+)
+_CUSTOMER_PAYMENTS = "SELECT amount, payment_date FROM payment WHERE customer_id = %s"
+_REPORT = """
+SELECT c.customer_id, c.last_name, count(r.rental_id) AS rentals, sum(p.amount) AS paid
+FROM customer c
+LEFT JOIN rental r ON r.customer_id = c.customer_id
+LEFT JOIN payment p ON p.rental_id = r.rental_id
+GROUP BY c.customer_id, c.last_name
+ORDER BY paid DESC NULLS LAST, rentals DESC
+"""
+
+
+# --- Ссылочные данные ---
+async def load_ids(conn) -> Dict[str, List[int]]:
+    """Случайная выборка существующих id для внешних ключей."""
+    ids = {}
+    for name, query in (
+        ("inventory", "SELECT inventory_id FROM inventory"),
+        ("customer", "SELECT customer_id FROM customer"),
+        ("staff", "SELECT staff_id FROM staff"),
+        ("rental", "SELECT rental_id FROM rental"),
+    ):
+        cur = await conn.execute(
+            f"{query} ORDER BY random() LIMIT %s", (ID_SAMPLE_SIZE,)
+        )
+        ids[name] = [r[0] for r in await cur.fetchall()]
+    await conn.rollback()
+    empty = [name for name in ("inventory", "customer", "staff") if not ids[name]]
+    if empty:
+        raise SystemExit(
+            f"❌ В базе нет данных pagila ({', '.join(empty)}) — нагружать нечего."
+        )
+    return ids
+
+
+# --- Пакетная запись ---
+async def write_batch(conn, sql: str, copy_sql: str, batch: List[tuple], mode: str):
+    async with conn.cursor() as cur:
+        if mode == "copy" and copy_sql:
+            async with cur.copy(copy_sql) as copy:
+                for row in batch:
+                    await copy.write_row(row)
+        elif mode == "pipeline":
+            async with conn.pipeline():
+                for row in batch:
+                    await cur.execute(sql, row)
+        elif mode == "single":
+            for row in batch:
+                await cur.execute(sql, row)
+        else:  # executemany, а также copy для UPDATE
+            await cur.executemany(sql, batch)
+    await conn.commit()
+
+
+# --- Операции: возвращают число обработанных строк ---
+async def op_insert_rentals(conn, ids, rnd: random.Random, args) -> int:
+    now = datetime.now(timezone.utc)
+    batch = [
+        (
+            now - timedelta(seconds=rnd.random() * 86400 * 30),
+            rnd.choice(ids["inventory"]),
+            rnd.choice(ids["customer"]),
+            rnd.choice(ids["staff"]),
+        )
+        for _ in range(args.batch_size)
+    ]
+    await write_batch(conn, _INSERT_RENTAL, _COPY_RENTAL, batch, args.batch_mode)
+    return len(batch)
+
+
+async def op_insert_payments(conn, ids, rnd: random.Random, args) -> int:
+    if not ids["rental"]:  # пустая rental: сначала наполняем её
+        return await op_insert_rentals(conn, ids, rnd, args)
+    batch = [
+        (
+            rnd.choice(ids["customer"]),
+            rnd.choice(ids["staff"]),
+            rnd.choice(ids["rental"]),
+            round(rnd.uniform(0.99, 11.99), 2),
+            PAYMENT_DATE_FROM
+            + timedelta(seconds=rnd.random() * 86400 * PAYMENT_DATE_DAYS),
+        )
+        for _ in range(args.batch_size)
+    ]
+    await write_batch(conn, _INSERT_PAYMENT, _COPY_PAYMENT, batch, args.batch_mode)
+    return len(batch)
+
+
+async def op_update_rentals(conn, ids, rnd: random.Random, args) -> int:
+    # каждая такая строка оставляет мёртвую версию для autovacuum
+    if not ids["rental"]:  # пустая rental: сначала наполняем её
+        return await op_insert_rentals(conn, ids, rnd, args)
+    # строки блокируются в порядке id — иначе параллельные пачки ловят deadlock
+    rental_ids = sorted({rnd.choice(ids["rental"]) for _ in range(args.batch_size)})
+    batch = [(rental_id,) for rental_id in rental_ids]
+    await write_batch(conn, _UPDATE_RENTAL, None, batch, args.batch_mode)
+    return len(batch)
+
+
+async def op_n_plus_one(conn, ids, rnd: random.Random, args) -> int:
+    """Родительский список и по два запроса на каждую строку — классический N+1."""
+    offset = rnd.randrange(max(len(ids["customer"]) - args.fanout, 1))
+    cur = await conn.execute(_LIST_CUSTOMERS, (args.fanout, offset))
+    customers = [r[0] for r in await cur.fetchall()]
+    n = len(customers)
+    for customer_id in customers:
+        cur = await conn.execute(_CUSTOMER_RENTALS, (customer_id,))
+        n += len(await cur.fetchall())
+        cur = await conn.execute(_CUSTOMER_PAYMENTS, (customer_id,))
+        n += len(await cur.fetchall())
+    await conn.rollback()
+    return n
+
+
+async def op_report(conn, ids, rnd: random.Random, args) -> int:
+    cur = await conn.execute(_REPORT)
+    n = len(await cur.fetchall())
+    await conn.rollback()
+    return n
+
+
+# профиль -> [(вес, имя операции, функция)]
+PROFILES = {
+    "read": [(0.95, "n_plus_one", op_n_plus_one), (0.05, "report", op_report)],
+    "write": [
+        (0.4, "insert_rental", op_insert_rentals),
+        (0.3, "insert_payment", op_insert_payments),
+        (0.3, "update_rental", op_update_rentals),
+    ],
+    "mixed": [
+        (0.55, "n_plus_one", op_n_plus_one),
+        (0.05, "report", op_report),
+        (0.15, "insert_rental", op_insert_rentals),
+        (0.1, "insert_payment", op_insert_payments),
+        (0.15, "update_rental", op_update_rentals),
+    ],
+}
+
+
+# --- Прогон ---
+def new_stats() -> dict:
+    return {"latencies_ms": [], "rows": 0, "errors": 0}
+
+
+async def worker(n: int, ids, args, stats: Dict[str, dict], deadline: float):
+    rnd = random.Random(None if args.seed is None else args.seed + n)
+    ops = PROFILES[args.profile]
+    weights = [w for w, _, _ in ops]
+    async with await psycopg.AsyncConnection.connect(args.dsn) as conn:
+        while time.monotonic() < deadline:
+            _, name, op = rnd.choices(ops, weights)[0]
+            s = stats.setdefault(name, new_stats())
+            started = time.perf_counter()
+            try:
+                # сначала await, потом +=: иначе воркеры затирают прибавки друг друга
+                n_rows = await op(conn, ids, rnd, args)
+            except psycopg.Error as e:
+                s["errors"] += 1
+                s["last_error"] = str(e).strip()
+                await conn.rollback()
+                continue
+            s["latencies_ms"].append((time.perf_counter() - started) * 1000)
+            s["rows"] += n_rows
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Перцентиль методом ближайшего ранга (значения уже отсортированы)."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+def summarize(stats: Dict[str, dict], elapsed: float) -> dict:
+    report = {}
+    for name, s in sorted(stats.items()):
+        lat = sorted(s["latencies_ms"])
+        report[name] = {
+            "ops": len(lat),
+            "rows": s["rows"],
+            "errors": s["errors"],
+            "ops_per_s": round(len(lat) / elapsed, 1),
+            "rows_per_s": round(s["rows"] / elapsed, 1),
+            "p50_ms": round(percentile(lat, 50), 2),
+            "p95_ms": round(percentile(lat, 95), 2),
+            "p99_ms": round(percentile(lat, 99), 2),
+        }
+        if "last_error" in s:
+            report[name]["last_error"] = s["last_error"]
+    return report
+
+
+def print_report(report: dict, args, elapsed: float) -> None:
+    print(
+        f"\nПрофиль {args.profile}, {args.concurrency} воркеров, {elapsed:.1f} с, "
+        f"запись: {args.batch_mode} x {args.batch_size}"
+    )
+    print(
+        f"{'операция':<16}{'ops':>8}{'ops/s':>10}{'rows/s':>12}"
+        f"{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'ошибок':>8}"
+    )
+    for name, r in report.items():
+        print(
+            f"{name:<16}{r['ops']:>8}{r['ops_per_s']:>10}{r['rows_per_s']:>12}"
+            f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}"
+        )
+        if "last_error" in r:
+            print(f"  ❌ {r['last_error']}")
+
+
+async def run(args) -> dict:
+    async with await psycopg.AsyncConnection.connect(args.dsn) as conn:
+        ids = await load_ids(conn)
+    stats: Dict[str, dict] = {}
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(
+        *(worker(n, ids, args, stats, deadline) for n in range(args.concurrency))
+    )
+    elapsed = time.monotonic() - started
+    report = summarize(stats, elapsed)
+    print_report(report, args, elapsed)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="строка подключения libpq")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="сек")
+    parser.add_argument("--batch-mode", choices=BATCH_MODES, default="executemany")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--fanout", type=int, default=DEFAULT_FANOUT)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="куда сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        # асинхронный psycopg не работает с ProactorEventLoop
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
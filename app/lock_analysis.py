@@ -0,0 +1,460 @@
+# lock_analysis.py
+import logging
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.fingerprint import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры сэмплирования ---
+LOCK_SAMPLE_SECONDS = 10.0  # окно по умолчанию
+LOCK_SAMPLE_MAX_SECONDS = 600.0
+# без stream клиент ждёт ответ целиком, а поток анализатора занят всё окно
+LOCK_SAMPLE_SYNC_MAX_SECONDS = 30.0
+LOCK_INTERVAL_MS = 100.0  # 10 опросов в секунду
+# опрос занимает не больше этой доли времени одного бэкенда: на нагруженном
+# сервере (сотни сессий) интервал растёт сам
+LOCK_MAX_OVERHEAD = 0.05
+LOCK_DETAIL_INTERVAL_S = 1.0  # pg_locks — не чаще раза в секунду и только по делу
+IDLE_TX_THRESHOLD_S = 5.0  # idle in transaction дольше — уже проблема
+PROGRESS_INTERVAL_S = 1.0
+TOP_QUERIES = 20
+TOP_TREES = 10
+MAX_TREE_NODES = 50  # узлов в показанном дереве блокировок
+
+HIDDEN_QUERY = "<insufficient privilege>"
+CPU = "CPU"  # активна и ничего не ждёт
+
+# pg_blocking_pids() дорог — только для тех, кто ждёт блокировку
+_ACTIVITY_SQL = """
+SELECT pid, backend_start, xact_start, state_change, state,
+       wait_event_type, wait_event, {query_id} AS query_id, query,
+       extract(epoch FROM now() - xact_start) AS xact_age_s,
+       extract(epoch FROM now() - state_change) AS state_age_s,
+       CASE WHEN wait_event_type = 'Lock' THEN pg_blocking_pids(pid) END AS blocked_by
+FROM pg_stat_activity
+WHERE (backend_type = 'client backend'
+       OR backend_type IS NULL)  -- чужие сессии без pg_read_all_stats: всё скрыто
+  AND pid <> pg_backend_pid()
+  AND datname = current_database()
+  AND state IS DISTINCT FROM 'idle'
+"""
+
+_LOCKS_SQL = """
+SELECT l.pid, l.locktype, l.mode,
+       CASE WHEN l.relation IS NOT NULL THEN l.relation::regclass::text END AS relation
+FROM pg_locks l
+WHERE l.pid = ANY(%s) AND l.granted
+  AND l.locktype IN ('relation', 'tuple', 'transactionid', 'advisory')
+  AND NOT (l.locktype = 'relation' AND l.mode = 'AccessShareLock'
+           AND l.relation::regclass::text LIKE 'pg\\_%%')
+"""
+
+Session = Tuple[int, object]  # (pid, backend_start)
+
+
+def _query_key(row: dict) -> str:
+    # query_id (PG14+, compute_query_id) совпадает с queryid pg_stat_statements
+    if row["query_id"] is not None:
+        return str(row["query_id"])
+    return fingerprint(row["query"] or "")
+
+
+def _wait_label(row: dict) -> Optional[str]:
+    if row["state"] != "active":
+        return None
+    if row["wait_event_type"] is None:
+        return CPU
+    return f"{row['wait_event_type']}:{row['wait_event']}"
+
+
+def _snippet(query: Optional[str]) -> str:
+    return (query or "").replace("\n", " ")[:300]
+
+
+# --- Деревья блокировок ---
+def blocking_roots(sample: Dict[int, dict]) -> Dict[int, List[int]]:
+    """
+    Корневые блокирующие сессии снимка -> все, кто ждёт их прямо или
+    через цепочку. Корень — блокирующий, который сам никого не ждёт
+    (в том числе сессия вне снимка: idle с advisory-блокировкой уровня
+    сессии). В цикле (дедлок до его обнаружения) корнем считается
+    наименьший pid цикла.
+    """
+    blockers: Dict[int, List[int]] = {}
+    for pid, row in sample.items():
+        for blocker in row["blocked_by"] or ():
+            blockers.setdefault(blocker, []).append(pid)
+
+    def waits_on(pid):
+        row = sample.get(pid)
+        return list(row["blocked_by"] or ()) if row else []
+
+    roots = {}
+    for pid in blockers:
+        path = [pid]
+        while True:
+            up = waits_on(path[-1])
+            if not up:
+                root = path[-1]
+                break
+            nxt = min(up)
+            if nxt in path:
+                root = min(path[path.index(nxt) :])
+                break
+            path.append(nxt)
+        if root in roots:
+            continue
+        tree, stack = set(), [root]
+        while stack:
+            for child in blockers.get(stack.pop(), ()):
+                if child not in tree and child != root:
+                    tree.add(child)
+                    stack.append(child)
+        roots[root] = sorted(tree)
+    return roots
+
+
+def _node(pid: int, sample: Dict[int, dict]) -> dict:
+    row = sample.get(pid)
+    node = {"pid": pid}
+    if row is not None:
+        node.update(
+            {
+                "state": row["state"],
+                "wait": _wait_label(row) or row["state"],
+                "xact_age_s": round(row["xact_age_s"] or 0, 1),
+                "query_snippet": _snippet(row["query"]),
+            }
+        )
+        if row["blocked_by"]:
+            node["blocked_by"] = sorted(row["blocked_by"])
+    return node
+
+
+def build_tree(root: int, sample: Dict[int, dict]) -> dict:
+    """
+    Дерево ожиданий от корневого блокирующего: кто кого держит.
+    Сессия, которая ждёт нескольких, показана один раз — под ближайшим
+    к корню из них (остальные — в blocked_by).
+    """
+    blockers: Dict[int, List[int]] = {}
+    for pid, row in sample.items():
+        for blocker in row["blocked_by"] or ():
+            blockers.setdefault(blocker, []).append(pid)
+    nodes = {root: _node(root, sample)}
+    queue = deque([root])
+    while queue and len(nodes) < MAX_TREE_NODES:
+        pid = queue.popleft()
+        for child in sorted(blockers.get(pid, ())):
+            if child not in nodes:
+                nodes[child] = _node(child, sample)
+                nodes[pid].setdefault("blocked", []).append(nodes[child])
+                queue.append(child)
+    return nodes[root]
+
+
+def _depth(node: dict) -> int:
+    return 1 + max((_depth(c) for c in node.get("blocked", ())), default=0)
+
+
+# --- Сэмплирование ---
+def sample_locks(
+    conn,
+    duration_s: float = LOCK_SAMPLE_SECONDS,
+    interval_ms: float = LOCK_INTERVAL_MS,
+    progress=None,
+    cancelled=None,
+) -> dict:
+    """
+    Опрашивает pg_stat_activity duration_s секунд: ожидания по запросам,
+    деревья блокировок и idle in transaction, держащие блокировки.
+    Интервал не меньше interval_ms и растёт, если опрос дороже
+    LOCK_MAX_OVERHEAD от времени одного бэкенда.
+    cancelled() -> True останавливает опрос (клиент ушёл).
+    """
+    caps = get_capabilities(conn)
+    query_id = "query_id" if caps["server_version_num"] >= 140000 else "NULL::bigint"
+    sql = _ACTIVITY_SQL.format(query_id=query_id)
+
+    waits: Dict[str, Counter] = {}
+    texts: Dict[str, str] = {}
+    episodes: Dict[Session, dict] = {}  # корневой блокирующий -> эпизод
+    idle: Dict[Session, dict] = {}
+    samples = hidden = 0
+    sample_time = 0.0
+    interval = interval_ms / 1000
+    details_at = 0.0
+
+    # в транзакции pg_stat_activity — снимок на момент первого обращения
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    started = time.monotonic()
+    deadline = started + duration_s
+    reported = started
+    try:
+        with conn.cursor(row_factory=rows.dict_row) as cur:
+            while time.monotonic() < deadline:
+                if cancelled is not None and cancelled():
+                    break
+                tick = time.monotonic()
+                cur.execute(sql)
+                sample = {}
+                for row in cur.fetchall():
+                    if row["query"] == HIDDEN_QUERY:
+                        hidden += 1
+                    sample[row["pid"]] = row
+                samples += 1
+
+                for row in sample.values():
+                    label = _wait_label(row)
+                    if label is None or row["query"] == HIDDEN_QUERY:
+                        continue
+                    key = _query_key(row)
+                    waits.setdefault(key, Counter())[label] += 1
+                    texts.setdefault(key, row["query"])
+
+                roots = blocking_roots(sample)
+                for root, blocked in roots.items():
+                    row = sample.get(root)
+                    session = (root, row["backend_start"] if row else None)
+                    episode = episodes.get(session)
+                    if episode is None:
+                        episode = episodes[session] = {
+                            "root_pid": root,
+                            "first_seen_s": round(tick - started, 2),
+                            "samples": 0,
+                            "max_blocked": 0,
+                            "blocked_queries": Counter(),
+                            "_texts": {},
+                        }
+                        if progress:
+                            progress(
+                                "blocking",
+                                {
+                                    "root_pid": root,
+                                    "blocked": len(blocked),
+                                    "root_query": _snippet(row and row["query"]),
+                                },
+                            )
+                    episode["samples"] += 1
+                    episode["last_seen_s"] = round(tick - started, 2)
+                    for pid in blocked:
+                        key = _query_key(sample[pid])
+                        episode["blocked_queries"][key] += 1
+                        episode["_texts"][key] = sample[pid]["query"]
+                    if len(blocked) >= episode["max_blocked"]:
+                        # самый тяжёлый момент эпизода показываем деревом
+                        episode["max_blocked"] = len(blocked)
+                        episode["tree"] = build_tree(root, sample)
+                        episode["root_state"] = row["state"] if row else None
+
+                blockers = set(roots) | {
+                    b for row in sample.values() for b in (row["blocked_by"] or ())
+                }
+                for pid, row in sample.items():
+                    if row["state"] not in (
+                        "idle in transaction",
+                        "idle in transaction (aborted)",
+                    ):
+                        continue
+                    idle_s = row["state_age_s"] or 0
+                    if idle_s < IDLE_TX_THRESHOLD_S and pid not in blockers:
+                        continue
+                    entry = idle.setdefault(
+                        (pid, row["backend_start"]),
+                        {"pid": pid, "locks": [], "blocks_sessions": 0},
+                    )
+                    entry.update(
+                        {
+                            "state": row["state"],
+                            "idle_s": round(idle_s, 1),
+                            "xact_age_s": round(row["xact_age_s"] or 0, 1),
+                            "last_query": _snippet(row["query"]),
+                        }
+                    )
+                    if pid in roots:
+                        entry["blocks_sessions"] = max(
+                            entry["blocks_sessions"], len(roots[pid])
+                        )
+
+                # какие блокировки держат корни и idle in transaction — реже
+                holders = set(roots) | {s[0] for s in idle}
+                if holders and tick - details_at >= LOCK_DETAIL_INTERVAL_S:
+                    details_at = tick
+                    cur.execute(_LOCKS_SQL, (sorted(holders),))
+                    held: Dict[int, List[str]] = {}
+                    for lock in cur.fetchall():
+                        target = lock["relation"] or lock["locktype"]
+                        held.setdefault(lock["pid"], []).append(
+                            f"{lock['mode']} {target}"
+                        )
+                    for session, entry in idle.items():
+                        if session[0] in held:
+                            entry["locks"] = sorted(set(held[session[0]]))
+                    for session, episode in episodes.items():
+                        if session[0] in held:
+                            episode["root_locks"] = sorted(set(held[session[0]]))
+
+                elapsed = time.monotonic() - tick
+                sample_time += elapsed
+                interval = max(interval_ms / 1000, elapsed / LOCK_MAX_OVERHEAD)
+                if progress and tick - reported >= PROGRESS_INTERVAL_S:
+                    reported = tick
+                    progress(
+                        "progress",
+                        {
+                            "stage": "sampling",
+                            "elapsed_s": round(tick - started, 1),
+                            "duration_s": duration_s,
+                            "samples": samples,
+                            "blocking_episodes": len(episodes),
+                            "interval_ms": round(interval * 1000, 1),
+                        },
+                    )
+                time.sleep(max(0.0, interval - (time.monotonic() - tick)))
+    finally:
+        conn.autocommit = autocommit
+
+    elapsed = time.monotonic() - started
+    return {
+        "duration_s": round(elapsed, 2),
+        "samples": samples,
+        "interval_ms": round(elapsed * 1000 / samples, 2) if samples else None,
+        "overhead": round(sample_time / elapsed, 4) if elapsed else None,
+        "hidden_rows": hidden,
+        "_seconds_per_sample": elapsed / samples if samples else 0.0,
+        "waits": waits,
+        "texts": texts,
+        "episodes": list(episodes.values()),
+        "idle_in_transaction": list(idle.values()),
+    }
+
+
+def summarize_waits(
+    waits: Dict[str, Counter], texts: Dict[str, str], seconds_per_sample: float
+) -> List[dict]:
+    """
+    Гистограмма ожиданий по запросам: в скольких снимках запрос был
+    активен и чего ждал. Число снимков × интервал ≈ суммарное время
+    всех его выполнений в этом состоянии.
+    """
+    result = []
+    for key, counts in waits.items():
+        total = sum(counts.values())
+        waited = total - counts.get(CPU, 0)
+        result.append(
+            {
+                "key": key,
+                "query_snippet": _snippet(texts.get(key)),
+                "samples": total,
+                "wait_samples": waited,
+                "est_active_s": round(total * seconds_per_sample, 2),
+                "est_wait_s": round(waited * seconds_per_sample, 2),
+                "waits": dict(counts.most_common()),
+            }
+        )
+    result.sort(key=lambda r: (-r["wait_samples"], -r["samples"]))
+    return result[:TOP_QUERIES]
+
+
+def summarize_episodes(episodes: List[dict], seconds_per_sample: float) -> List[dict]:
+    result = []
+    for e in episodes:
+        blocked = [
+            {"key": key, "query_snippet": _snippet(e["_texts"][key]), "samples": n}
+            for key, n in e["blocked_queries"].most_common(5)
+        ]
+        result.append(
+            {
+                "root_pid": e["root_pid"],
+                "root_state": e.get("root_state"),
+                "root_locks": e.get("root_locks", []),
+                "first_seen_s": e["first_seen_s"],
+                "last_seen_s": e["last_seen_s"],
+                "est_duration_s": round(e["samples"] * seconds_per_sample, 2),
+                "max_blocked": e["max_blocked"],
+                "max_depth": _depth(e["tree"]),
+                "blocked_queries": blocked,
+                "tree": e["tree"],
+            }
+        )
+    result.sort(key=lambda r: (-r["max_blocked"], -r["est_duration_s"]))
+    return result[:TOP_TREES]
+
+
+def analyze_locks(
+    conn,
+    duration_s: float = LOCK_SAMPLE_SECONDS,
+    interval_ms: float = LOCK_INTERVAL_MS,
+    progress=None,
+    cancelled=None,
+) -> dict:
+    """
+    Ожидания и блокировки по реальным выполнениям за окно:
+    - гистограмма wait_event по отпечаткам запросов
+    - деревья блокировок до корневого блокирующего
+    - idle in transaction, которые держат блокировки или висят дольше порога
+    progress(event, data) — для потоковой выдачи: ход опроса и новые эпизоды.
+    cancelled() — для обычного ответа: клиент ушёл, опрос пора прервать.
+    """
+    duration_s = min(max(duration_s, 0.1), LOCK_SAMPLE_MAX_SECONDS)
+    print(f"\nСэмплирование ожиданий и блокировок: {duration_s} с")
+    sampled = sample_locks(conn, duration_s, interval_ms, progress, cancelled)
+    per_sample = sampled.pop("_seconds_per_sample")
+    waits = summarize_waits(sampled.pop("waits"), sampled.pop("texts"), per_sample)
+    trees = summarize_episodes(sampled.pop("episodes"), per_sample)
+    idle = sorted(
+        sampled.pop("idle_in_transaction"),
+        key=lambda s: (-s["blocks_sessions"], -s["idle_s"]),
+    )
+    for entry in idle:
+        entry["suggestion"] = (
+            "Сессия открыла транзакцию и ничего не делает — блокировки держатся до "
+            "COMMIT/ROLLBACK. Проверьте обработку ошибок и долгие операции внутри "
+            "транзакции в приложении; страховка — idle_in_transaction_session_timeout."
+        )
+
+    notes = [
+        "Оценки времени — число снимков × интервал: короткие ожидания видны, "
+        "только если опрос попал на них.",
+    ]
+    if sampled["hidden_rows"]:
+        notes.append(
+            "⚠️ Часть сессий скрыта (<insufficient privilege>): для чужих запросов "
+            "нужна роль pg_read_all_stats."
+        )
+    if sampled["interval_ms"] and sampled["interval_ms"] > interval_ms * 1.5:
+        notes.append(
+            f"ℹ️ Интервал увеличен до ~{sampled['interval_ms']} мс: опрос не занимает "
+            f"больше {LOCK_MAX_OVERHEAD:.0%} времени."
+        )
+
+    if not trees:
+        print("Блокировок между сессиями не найдено.")
+    for i, t in enumerate(trees, 1):
+        print(
+            f"\n[{i}] pid {t['root_pid']} ({t['root_state']}) блокирует до "
+            f"{t['max_blocked']} сессий, глубина {t['max_depth']}, "
+            f"~{t['est_duration_s']} с"
+        )
+        if t["root_locks"]:
+            print("держит:", ", ".join(t["root_locks"][:5]))
+    for entry in idle:
+        print(
+            f"⚠️ pid {entry['pid']}: idle in transaction {entry['idle_s']} с, "
+            f"блокирует {entry['blocks_sessions']}"
+        )
+
+    return {
+        **sampled,
+        "waits_by_query": waits,
+        "blocking_trees": trees,
+        "idle_in_transaction": idle,
+        "notes": notes,
+    }
@@ -1,22 +1,87 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket
+from fastapi.responses import HTMLResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from starlette.requests import HTTPConnection
 from pydantic import BaseModel
+from typing import List, Optional
 
 import psycopg
+import functools
+import json
 import time
 import os
 import socket
 import asyncio
 import logging
+import uuid
 
 # Импортируем ваши функции анализа
-from app.explain_analyze import run_explain
-from app.stats_analysis import analyze_stats
-from app.DB_tuning import get_postgres_recommendations
-from app.find_N import analyze_n_plus_one
+from app.explain_analyze import (
+    MODE_ANALYZE,
+    MODE_GENERIC,
+    check_single_statement,
+    param_count,
+    run_explain,
+)
+from app.stats_analysis import AUTOVACUUM_SETTINGS, analyze_stats
+from app.DB_tuning import SETTINGS as TUNING_SETTINGS, get_postgres_recommendations
+from app.find_N import STATEMENTS_SETTINGS, analyze_n_plus_one
+from app.activity_sampler import sample_n_plus_one
+from app.lock_analysis import LOCK_SAMPLE_SYNC_MAX_SECONDS, analyze_locks
 from app.index_recommend import analyze_indexes
+from app.index_whatif import evaluate_indexes
+from app.index_health import analyze_index_health
+from app.fingerprint import fingerprint
+from app.capabilities import get_capabilities
+from app.analysis_cache import MISS, invalidation_token, result_cache, static_cache
+from app.observability import (
+    CONNECT_RETRIES,
+    MetricsMiddleware,
+    TimedCursor,
+    record_connect,
+)
+from app.plan_history import plan_history
+from app.batch_analysis import (
+    fetch_statements,
+    iter_batch_results,
+    prepare_workload,
+    shutdown_process_pool,
+)
+from app.executor import (
+    AnalysisCancelled,
+    run_analyzer,
+    shutdown_executor,
+    stream_analyzer,
+)
+from app.stats_sampler import get_sampler, stop_all_samplers
+from app.live_metrics import get_feed, stop_all_feeds
+from app.metrics_history import (
+    get_recorder,
+    get_store,
+    history_target,
+    stop_all_recorders,
+    time_range,
+)
+from app.fleet import FLEET_CONNECT_ARGS, FLEET_TARGET_TIMEOUT, scan_fleet
+from app.targets import (
+    DEFAULT_TARGET,
+    SESSION_COOKIE,
+    TARGET_HEADER,
+    TargetRegistry,
+    load_targets_file,
+)
+from app.db_pool import (
+    acquire,
+    close_all_pools,
+    close_pool,
+    create_pool,
+    get_pool,
+    pool_key,
+    release,
+    target_key,
+)
 
 # --- Наст
 # --- Настройки логгера ---
@@ -27,6 +92,8 @@ logger = logging.getLogger(__name__)
 
 # --- FastAPI setup ---
 app = FastAPI()
+# задержки по маршрутам и Server-Timing для каждого ответа (см. /metrics)
+app.add_middleware(MetricsMiddleware, router=app.router)
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -36,18 +103,93 @@ class QueryRequest(BaseModel):
     query: str
 
 
+class ExplainRequest(BaseModel):
+    query: str
+    # plan — только план, generic — для текста с $1, analyze — выполнение с откатом
+    mode: str = "analyze"
+    # отдавать этапы и узлы плана по мере готовности (Server-Sent Events)
+    stream: bool = False
+
+
+class PlanHistoryRequest(BaseModel):
+    query: str
+    # история ведётся отдельно по режимам EXPLAIN — как mode в ответе /run_explain/
+    mode: str = "analyze"
+
+
+class WhatIfRequest(BaseModel):
+    query: str
+    # без HypoPG: строить индексы в откатываемой транзакции (только scratch-база!)
+    allow_build: bool = False
+
+
+class ServerSpecRequest(BaseModel):
+    # ресурсы сервера БД, если их нельзя прочитать с самого сервера
+    ram_gb: Optional[float] = None
+    cpus: Optional[int] = None
+
+
+class ActivitySampleRequest(BaseModel):
+    # сколько секунд и как часто опрашивать pg_stat_activity
+    duration_seconds: float = 10.0
+    interval_ms: float = 10.0
+    # отдавать ход опроса и найденные всплески по мере готовности (SSE)
+    stream: bool = False
+
+
+class LockSampleRequest(BaseModel):
+    # окно опроса pg_stat_activity; интервал растёт сам, если опрос дорог
+    duration_seconds: float = 10.0
+    interval_ms: float = 100.0
+    stream: bool = False
+
+
+class StatsWindowRequest(BaseModel):
+    # None — накопленные счётчики, иначе дельты за последние N секунд
+    window_seconds: Optional[int] = None
+
+
+class NPlusOneRequest(StatsWindowRequest):
+    # отдавать кандидатов по мере нахождения (SSE)
+    stream: bool = False
+
+
+class BatchRequest(BaseModel):
+    queries: List[str] = []
+    # добавить к списку все запросы из pg_stat_statements текущей цели
+    from_pg_stat_statements: bool = False
+    # отдавать результаты по мере готовности (NDJSON, по строке на запрос)
+    stream: bool = False
+
+
 class DbParams(BaseModel):
     host: str
     port: str
     dbname: str
     user: str
     password: str
+    # имя цели в реестре; по умолчанию user@host:port/dbname
+    name: Optional[str] = None
+
+
+class SelectTargetRequest(BaseModel):
+    name: str
+
+
+class FleetScanRequest(BaseModel):
+    # имена целей из реестра; по умолчанию — все
+    targets: Optional[List[str]] = None
+    analyzers: List[str] = ["stats", "tuning", "n_plus_one", "index_health"]
+    timeout_seconds: float = FLEET_TARGET_TIMEOUT
+    # findings | elapsed | target | имя анализатора
+    sort_by: str = "findings"
+    # полные результаты анализаторов, а не только число находок
+    details: bool = False
 
 
 # --- Глобальные переменные ---
 in_docker = bool(os.getenv("DATABASE_URL"))
-user_dict = {}
-db_choice = ""
+targets = TargetRegistry()
 
 
 # --- Утилиты ---
@@ -59,35 +201,94 @@ def is_port_open(host: str, port: int, timeout: float = 1.0) -> bool:
         return False
 
 
-def get_db_connection(max_retries=10, delay=2, connect_timeout=3):
+def normalize_params(params: dict) -> dict:
+    """Параметры цели из формы/файла: порт — число, localhost из Docker — хост."""
+    host = params.get("host")
+    if in_docker and host and host.lower() == "localhost":
+        host = "host.docker.internal"
+    return {
+        "host": host,
+        "port": int(params.get("port") or 5432),
+        "dbname": params.get("dbname"),
+        "user": params.get("user"),
+        "password": params.get("password"),
+    }
+
+
+targets.add(
+    DEFAULT_TARGET,
+    {
+        "host": "postgres2" if in_docker else "127.0.0.1",
+        "port": 5432 if in_docker else 5434,
+        "dbname": "pagila",
+        "user": "readonly_user",
+        "password": "readonly_password",
+    },
+    builtin=True,
+)
+load_targets_file(targets, os.getenv("DB_TARGETS_FILE"), normalize_params)
+
+
+def session_of(conn: HTTPConnection) -> Optional[str]:
+    return conn.cookies.get(SESSION_COOKIE)
+
+
+def ensure_session(conn: HTTPConnection, response: Response) -> str:
+    """Идентификатор сессии браузера; новой сессии ставит cookie."""
+    session = session_of(conn)
+    if session is None:
+        session = uuid.uuid4().hex
+        response.set_cookie(SESSION_COOKIE, session, httponly=True, samesite="lax")
+    return session
+
+
+def current_target_params(conn: Optional[HTTPConnection] = None):
+    """
+    Цель запроса: (параметры подключения, признак кастомной базы).
+    Явное имя в заголовке X-Target, иначе выбор сессии, иначе pagila.
+    """
+    if conn is None:
+        return targets.resolve(None)
+    name = conn.headers.get(TARGET_HEADER)
+    try:
+        return targets.resolve(session_of(conn), name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Цель {name} не найдена")
+
+
+def target_connect(conn: HTTPConnection):
+    """connect() для анализаторов: соединение с целью этого запроса."""
+    return functools.partial(get_db_connection, target=current_target_params(conn))
+
+
+def get_db_connection(max_retries=10, delay=2, connect_timeout=3, target=None):
     """
     Синхронная функция. Возвращает подключение или бросает исключение.
+    - target — (params, custom) из current_target_params(); по умолчанию pagila
+    - если для цели уже открыт пул — берёт из него тёплое соединение
+    - иначе проверяет доступность (TCP + connect с повторами) и создаёт пул
     - time.sleep (синхронная задержка)
     - различает фатальные (auth) и временные ошибки
+    Возвращённое соединение нужно отдать обратно через release_db_connection.
     """
-    global user_dict, db_choice
-
-    if user_dict and db_choice == "custom":
-        host = user_dict.get("host")
-        if in_docker and host and host.lower() == "localhost":
-            host = "host.docker.internal"
-        port = int(user_dict.get("port", 5432))
-        dbname = user_dict.get("dbname")
-        user = user_dict.get("user")
-        password = user_dict.get("password")
-        max_attempts = min(max_retries, 3)  # меньше попыток для кастомных
-    else:
-        host = "postgres2" if in_docker else "127.0.0.1"
-        port = 5432 if in_docker else 5434
-        dbname = "pagila"
-        user = "readonly_user"
-        password = "readonly_password"
-        max_attempts = max_retries
+    params, custom = target or current_target_params()
+    host, port, dbname = params["host"], params["port"], params["dbname"]
+    user, password = params["user"], params["password"]
+    # меньше попыток для кастомных
+    max_attempts = min(max_retries, 3) if custom else max_retries
+
+    started = time.perf_counter()
+    pool = get_pool(pool_key(params))
+    if pool is not None:
+        conn = acquire(pool)
+        record_connect("pool", time.perf_counter() - started)
+        return conn
 
     logger.debug(f"Подключение к {host}:{port}/{dbname} (до {max_attempts} попыток)")
 
     for attempt in range(1, max_attempts + 1):
         if not is_port_open(host, port, timeout=1.0):
+            CONNECT_RETRIES.labels("port_closed").inc()
             logger.debug(
                 f"Попытка {attempt}: TCP {host}:{port} недоступен — жду {delay}s"
             )
@@ -102,8 +303,22 @@ def get_db_connection(max_retries=10, delay=2, connect_timeout=3):
                 user=user,
                 password=password,
                 connect_timeout=connect_timeout,
+                cursor_factory=TimedCursor,
             )
             logger.info(f"Успешное подключение к {host}:{port}/{dbname}")
+            # Цель доступна — поднимаем для неё постоянный пул. Само пробное
+            # соединение отдаём вызывающему: release_db_connection его закроет.
+            try:
+                create_pool(params, connect_timeout=connect_timeout)
+            except Exception:
+                conn.close()
+                raise
+            # профиль сервера строим сразу: дальше анализаторы берут его из кэша
+            try:
+                get_capabilities(conn)
+            except Exception as e:
+                logger.warning(f"Не удалось получить профиль сервера: {e}")
+            record_connect("connect", time.perf_counter() - started)
             return conn
         except Exception as e:
             msg = str(e).lower()
@@ -119,9 +334,11 @@ def get_db_connection(max_retries=10, delay=2, connect_timeout=3):
                 "fatal",
             ]
             if any(ind in msg for ind in auth_indicators):
+                CONNECT_RETRIES.labels("auth").inc()
                 logger.error("Фатальная ошибка подключения (auth). Прекращаю повторы.")
                 raise RuntimeError(f"Permanent connection failure: {e}") from e
 
+            CONNECT_RETRIES.labels("error").inc()
             if attempt < max_attempts:
                 time.sleep(delay)
                 continue
@@ -131,12 +348,104 @@ def get_db_connection(max_retries=10, delay=2, connect_timeout=3):
     raise RuntimeError(f"Не удалось подключиться к базе после {max_attempts} попыток")
 
 
+def release_db_connection(conn):
+    """Возвращает соединение в пул (или закрывает пробное соединение)."""
+    release(conn)
+
+
+def current_sampler(conn: Optional[HTTPConnection] = None):
+    """Сэмплер pg_stat_statements для цели запроса (запускается при первом вызове)."""
+    target = current_target_params(conn)
+    connect = functools.partial(get_db_connection, target=target)
+    return get_sampler(target_key(target[0]), connect)
+
+
+def start_recorder(name: str):
+    """Запись истории метрик цели (поток стартует при первом вызове)."""
+    target = targets.get(name)
+    connect = functools.partial(get_db_connection, target=target)
+    return get_recorder(target_key(target[0]), connect)
+
+
+def current_feed(conn: HTTPConnection):
+    """Лента живых метрик для цели запроса (опрос идёт, пока есть подписчики)."""
+    target = current_target_params(conn)
+    connect = functools.partial(get_db_connection, target=target)
+    return get_feed(target_key(target[0]), connect)
+
+
+def window_stats(conn: HTTPConnection, window_seconds):
+    """Строки pg_stat_statements за окно и описание окна (или None, None)."""
+    if not window_seconds:
+        return None, None
+    return current_sampler(conn).window_rows(window_seconds)
+
+
+async def cached_analysis(
+    conn: HTTPConnection, name: str, func, params=(), settings=()
+):
+    """
+    Результат анализатора из кэша результатов (см. analysis_cache.ResultCache)
+    и сведения о нём: (result, {"hit", "shared", "age_seconds"}).
+    Перед выдачей из кэша проверяется токен цели — после рестарта, сброса
+    статистики или смены settings анализатор запускается заново.
+    """
+    connect = target_connect(conn)
+    token = await run_analyzer(
+        "cache_token",
+        connect,
+        functools.partial(invalidation_token, settings=settings),
+        request=conn,
+    )
+    key = (name, target_key(current_target_params(conn)[0]), params)
+    # общее вычисление не привязано к клиенту: его ждут и другие запросы
+    return await result_cache.get_or_compute(
+        key, token, lambda: run_analyzer(name, connect, func)
+    )
+
+
+def sse_event(event: str, data) -> str:
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def stream_response(name, func, *args, request, finish=None) -> StreamingResponse:
+    """
+    Потоковый вариант эндпоинта (Server-Sent Events): события анализатора
+    по мере готовности, последним — result с тем же телом, что у обычного
+    ответа (finish собирает его из результата), или error.
+    Закрытие соединения клиентом отменяет запрос на сервере.
+    """
+
+    async def events():
+        try:
+            async for event, data in stream_analyzer(
+                name, target_connect(request), func, *args, request=request
+            ):
+                if event == "result" and finish is not None:
+                    data = finish(data)
+                yield sse_event(event, data)
+        except AnalysisCancelled:
+            return
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # прокси не должен копить события до конца ответа
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --- Эндпоинты ---
 @app.post("/save_db_choice/")
-async def save_db_choice(db_choice_data: dict):
-    global db_choice
+async def save_db_choice(db_choice_data: dict, request: Request, response: Response):
+    # "pagila" — встроенная цель; "custom" выбирается при сохранении параметров
     try:
         db_choice = db_choice_data.get("db_choice", "")
+        if db_choice != "custom":
+            targets.select(ensure_session(request, response), DEFAULT_TARGET)
         logger.info(f"Сохранено состояние dbChoice: {db_choice}")
         return {"success": True}
     except Exception as e:
@@ -146,110 +455,648 @@ async def save_db_choice(db_choice_data: dict):
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     try:
-        conn = await asyncio.to_thread(get_db_connection)
+        conn = await asyncio.to_thread(target_connect(request))
     except Exception as e:
         logger.error(f"Ошибка подключения к БД: {e}")
         raise HTTPException(status_code=500, detail="DB connection failed")
     else:
-        conn.close()
-        return templates.TemplateResponse("index.html", {"request": request})
+        release_db_connection(conn)
+        response = templates.TemplateResponse("index.html", {"request": request})
+        ensure_session(request, response)
+        return response
+
+
+def close_unused_pool(params: dict) -> None:
+    """Закрывает пул к этим параметрам, если он не нужен ни одной цели реестра."""
+    key = pool_key(params)
+    if all(pool_key(p) != key for p in targets.params()):
+        close_pool(key)
+
+
+def register_target(name: str, params: dict):
+    """
+    Добавляет (или заменяет) цель; пул к прежним параметрам закрывается,
+    если им не пользуются другие цели. Возвращает прежние параметры (или None).
+    """
+    previous = targets.get(name)
+    targets.add(name, params)
+    # параметры могли измениться (например, пароль) — старый пул к этой цели не нужен
+    if previous is not None:
+        close_unused_pool(previous[0])
+        return previous[0]
+    return None
 
 
 @app.post("/save_db_params/")
-async def save_db_params(db_params: DbParams):
-    global user_dict
+async def save_db_params(db_params: DbParams, request: Request, response: Response):
+    params = normalize_params(db_params.dict())
+    name = (
+        db_params.name
+        or f"{params['user']}@{params['host']}:{params['port']}/{params['dbname']}"
+    )
     try:
-        user_dict = db_params.dict()
+        previous = register_target(name, params)
         # тестовое подключение (короткое)
         try:
-            conn = await asyncio.to_thread(get_db_connection, 2, 1, 2)
+            conn = await asyncio.to_thread(
+                get_db_connection, 2, 1, 2, target=targets.get(name)
+            )
         except Exception as e:
-            user_dict = {}
+            if previous is None:
+                targets.remove(name)
+            else:
+                targets.add(name, previous)
+            close_unused_pool(params)
             raise HTTPException(status_code=400, detail=f"Не удалось подключиться: {e}")
         else:
-            conn.close()
-            logger.info("Параметры сохранены и протестированы")
-            return {"success": True, "saved_db_params": db_params.dict()}
+            release_db_connection(conn)
+            targets.select(ensure_session(request, response), name)
+            start_recorder(name)
+            logger.info(f"Цель {name} сохранена, протестирована и выбрана")
+            saved = db_params.dict(exclude={"password"})
+            return {"success": True, "target": name, "saved_db_params": saved}
     except HTTPException:
         raise
     except Exception as e:
-        user_dict = {}
         raise HTTPException(status_code=500, detail=f"Ошибка при сохранении: {str(e)}")
 
 
+@app.get("/targets/")
+async def list_targets(request: Request):
+    return {
+        "targets": targets.describe(),
+        "selected": targets.selected(session_of(request)),
+    }
+
+
+@app.post("/targets/")
+async def add_target(db_params: DbParams):
+    """Регистрирует цель без выбора и без проверки (например, для обхода парка)."""
+    if not db_params.name:
+        raise HTTPException(status_code=400, detail="Нужно имя цели (name)")
+    try:
+        register_target(db_params.name, normalize_params(db_params.dict()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "target": db_params.name}
+
+
+@app.delete("/targets/{name}")
+async def delete_target(name: str):
+    try:
+        removed = targets.remove(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if removed is None:
+        raise HTTPException(status_code=404, detail=f"Цель {name} не найдена")
+    close_unused_pool(removed)
+    key = target_key(removed)
+    result_cache.invalidate(lambda k: k[1] == key)
+    return {"success": True}
+
+
+@app.post("/select_target/")
+async def select_target(
+    selection: SelectTargetRequest, request: Request, response: Response
+):
+    try:
+        targets.select(ensure_session(request, response), selection.name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Цель {selection.name} не найдена")
+    start_recorder(selection.name)
+    return {"success": True, "selected": selection.name}
+
+
+def plan_history_key(conn: HTTPConnection, query: str, mode: str) -> tuple:
+    # оценочный, generic и ANALYZE-план одного запроса не сравниваем между собой
+    return (target_key(current_target_params(conn)[0]), fingerprint(query), mode)
+
+
+def require_single_statement(query: str) -> None:
+    """Несколько команд через ";" не анализируем: см. check_single_statement."""
+    try:
+        check_single_statement(query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def explain_response(conn: HTTPConnection, query: str, result) -> dict:
+    if isinstance(result, dict):
+        result["history"] = plan_history.record(
+            plan_history_key(conn, query, result["mode"]),
+            result["plan"],
+            result["analysis"],
+        )
+    return {"result": result}
+
+
 @app.post("/run_explain/")
-async def run_explain_api(request: QueryRequest):
+async def run_explain_api(request: ExplainRequest, http_request: Request):
+    require_single_statement(request.query)
+    func = functools.partial(run_explain, mode=request.mode)
+    if request.stream:
+        return stream_response(
+            "run_explain",
+            func,
+            request.query,
+            request=http_request,
+            finish=functools.partial(explain_response, http_request, request.query),
+        )
     try:
-        conn = await asyncio.to_thread(get_db_connection)
-        result = run_explain(request.query, conn)
-        return {"result": result}
+        result = await run_analyzer(
+            "run_explain",
+            target_connect(http_request),
+            func,
+            request.query,
+            request=http_request,
+        )
+        return explain_response(http_request, request.query, result)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
 @app.post("/analyze_stats/")
-async def analyze_stats_api():
+async def analyze_stats_api(
+    http_request: Request, params: Optional[StatsWindowRequest] = None
+):
     try:
-        conn = await asyncio.to_thread(get_db_connection)
-        result = analyze_stats(conn)
+        stats, window = window_stats(http_request, params and params.window_seconds)
+        if window is None:
+            # накопленные счётчики: кэшируем (данные окна и так в памяти)
+            result, cache = await cached_analysis(
+                http_request,
+                "analyze_stats",
+                analyze_stats,
+                settings=AUTOVACUUM_SETTINGS,
+            )
+            return {"result": result, "cache": cache}
+        result = await run_analyzer(
+            "analyze_stats",
+            target_connect(http_request),
+            functools.partial(analyze_stats, stats=stats),
+            request=http_request,
+        )
+        result["window"] = window
         return {"result": result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
 @app.post("/get_postgres_recommendations/")
-async def get_postgres_recommendations_api():
+async def get_postgres_recommendations_api(
+    http_request: Request, params: Optional[ServerSpecRequest] = None
+):
+    ram_gb, cpus = params and params.ram_gb, params and params.cpus
     try:
-        conn = await asyncio.to_thread(get_db_connection)
-        result = get_postgres_recommendations(conn)
-        return {"recommendations": result}
+        result, cache = await cached_analysis(
+            http_request,
+            "get_postgres_recommendations",
+            functools.partial(get_postgres_recommendations, ram_gb=ram_gb, cpus=cpus),
+            params=(ram_gb, cpus),
+            settings=TUNING_SETTINGS,
+        )
+        return {"recommendations": result, "cache": cache}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
 @app.post("/analyze_n_plus_one/")
-async def analyze_n_plus_one_api():
-    try:
-        conn = await asyncio.to_thread(get_db_connection)
-        result = analyze_n_plus_one(conn)
+async def analyze_n_plus_one_api(
+    http_request: Request, params: Optional[NPlusOneRequest] = None
+):
+    def response(result, cache=None):
+        if window is not None:
+            return {"n_plus_one_candidates": result, "window": window}
+        if cache is not None:
+            return {"n_plus_one_candidates": result, "cache": cache}
         return {"n_plus_one_candidates": result}
+
+    try:
+        stat_rows, window = window_stats(http_request, params and params.window_seconds)
+        func = functools.partial(analyze_n_plus_one, stat_rows=stat_rows)
+        if params and params.stream:
+            return stream_response(
+                "analyze_n_plus_one", func, request=http_request, finish=response
+            )
+        if window is None:
+            return response(
+                *await cached_analysis(
+                    http_request,
+                    "analyze_n_plus_one",
+                    analyze_n_plus_one,
+                    settings=STATEMENTS_SETTINGS,
+                )
+            )
+        result = await run_analyzer(
+            "analyze_n_plus_one",
+            target_connect(http_request),
+            func,
+            request=http_request,
+        )
+        return response(result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/sample_n_plus_one/")
+async def sample_n_plus_one_api(
+    http_request: Request, params: Optional[ActivitySampleRequest] = None
+):
+    params = params or ActivitySampleRequest()
+    func = functools.partial(
+        sample_n_plus_one,
+        duration_s=params.duration_seconds,
+        interval_ms=params.interval_ms,
+    )
+    if params.stream:
+        return stream_response(
+            "sample_n_plus_one",
+            func,
+            request=http_request,
+            finish=lambda result: {"n_plus_one_bursts": result},
+        )
+    try:
+        result = await run_analyzer(
+            "sample_n_plus_one",
+            target_connect(http_request),
+            func,
+            request=http_request,
+            cancellable=True,
+        )
+        return {"n_plus_one_bursts": result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/sample_locks/")
+async def sample_locks_api(
+    http_request: Request, params: Optional[LockSampleRequest] = None
+):
+    params = params or LockSampleRequest()
+    if params.stream:
+        func = functools.partial(
+            analyze_locks,
+            duration_s=params.duration_seconds,
+            interval_ms=params.interval_ms,
+        )
+        return stream_response(
+            "sample_locks",
+            func,
+            request=http_request,
+            finish=lambda result: {"locks": result},
+        )
+    func = functools.partial(
+        analyze_locks,
+        duration_s=min(params.duration_seconds, LOCK_SAMPLE_SYNC_MAX_SECONDS),
+        interval_ms=params.interval_ms,
+    )
+    try:
+        result = await run_analyzer(
+            "sample_locks",
+            target_connect(http_request),
+            func,
+            request=http_request,
+            cancellable=True,
+        )
+        return {"locks": result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
 @app.post("/analyze_indexes/")
-async def analyze_indexes_api(request: QueryRequest):
+async def analyze_indexes_api(request: QueryRequest, http_request: Request):
+    require_single_statement(request.query)
+    # запросы, отличающиеся только литералами, анализируем один раз на цель;
+    # текст с $1 проверяется generic-планом — у него свой ключ
+    cache_key = (
+        "analyze_indexes",
+        target_key(current_target_params(http_request)[0]),
+        fingerprint(request.query, keep_params=True),
+    )
+    cached = static_cache.get(cache_key)
+    if cached is not MISS:
+        return {"index_recommendations": cached, "cached": True}
     try:
-        conn = await asyncio.to_thread(get_db_connection)
-        result = analyze_indexes(request.query, conn)
-        return {"index_recommendations": result}
+        result = await run_analyzer(
+            "analyze_indexes",
+            target_connect(http_request),
+            analyze_indexes,
+            request.query,
+            request=http_request,
+        )
+        # ошибка валидации (строка) может быть временной — её не кэшируем
+        if isinstance(result, list):
+            static_cache.put(cache_key, result)
+        return {"index_recommendations": result, "cached": False}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
+
+
+@app.post("/whatif_indexes/")
+async def whatif_indexes_api(request: WhatIfRequest, http_request: Request):
+    require_single_statement(request.query)
+    try:
+        result = await run_analyzer(
+            "whatif_indexes",
+            target_connect(http_request),
+            functools.partial(evaluate_indexes, allow_build=request.allow_build),
+            request.query,
+            request=http_request,
+        )
+        return {"whatif": result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/analyze_index_health/")
+async def analyze_index_health_api(http_request: Request):
+    try:
+        result = await run_analyzer(
+            "analyze_index_health",
+            target_connect(http_request),
+            analyze_index_health,
+            request=http_request,
+        )
+        return {"index_health": result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/analyze_batch/")
+async def analyze_batch_api(request: BatchRequest, http_request: Request):
+    try:
+        stat_rows = []
+        if request.from_pg_stat_statements:
+            stat_rows = await run_analyzer(
+                "analyze_batch",
+                target_connect(http_request),
+                fetch_statements,
+                request=http_request,
+            )
+        workload = await prepare_workload(request.queries, stat_rows)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    summary = {
+        "statements": len(request.queries) + len(stat_rows),
+        "unique": len(workload),
+    }
+    if request.stream:
+
+        async def ndjson():
+            yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+            async for item in iter_batch_results(workload):
+                yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    try:
+        results = [item async for item in iter_batch_results(workload)]
+        return {"summary": summary, "results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/plan_history/")
+async def plan_history_api(request: PlanHistoryRequest, http_request: Request):
+    mode = request.mode
+    if mode == MODE_ANALYZE and param_count(request.query):
+        mode = MODE_GENERIC  # для текста с $n run_explain строит generic-план
+    key = plan_history_key(http_request, request.query, mode)
+    return {"history": plan_history.entries(key)}
+
+
+@app.post("/fleet_scan/")
+async def fleet_scan_api(request: FleetScanRequest):
+    names = request.targets or targets.names()
+    missing = [n for n in names if targets.get(n) is None]
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"Цели не найдены: {', '.join(missing)}"
+        )
+    connects = {
+        name: functools.partial(
+            get_db_connection, *FLEET_CONNECT_ARGS, target=targets.get(name)
+        )
+        for name in names
+    }
+    try:
+        return await scan_fleet(
+            connects,
+            request.analyzers,
+            timeout_s=request.timeout_seconds,
+            sort_by=request.sort_by,
+            details=request.details,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/capabilities/")
+async def capabilities_api(http_request: Request, refresh: bool = False):
+    try:
+        result = await run_analyzer(
+            "capabilities",
+            target_connect(http_request),
+            functools.partial(get_capabilities, refresh=refresh),
+            request=http_request,
+        )
+        return {"capabilities": result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.websocket("/ws/live_metrics")
+async def live_metrics_ws(websocket: WebSocket):
+    """
+    Живые метрики текущей цели раз в секунду: сначала {"history": [...]},
+    затем по точке на тик. Все вкладки получают одну и ту же ленту.
+    """
+    await websocket.accept()
+    feed = current_feed(websocket)
+    queue = feed.subscribe()
+
+    async def pump():
         try:
-            conn.close()
+            await websocket.send_json({"history": feed.history()})
+            while True:
+                await websocket.send_json(await queue.get())
         except Exception:
+            pass  # клиент ушёл — receive() ниже получит disconnect
+
+    sender = asyncio.create_task(pump())
+    try:
+        # от клиента ничего не ждём — только закрытия соединения
+        while (await websocket.receive())["type"] != "websocket.disconnect":
             pass
+    finally:
+        sender.cancel()
+        feed.unsubscribe(queue)
+
+
+# --- История метрик ---
+def history_store():
+    store = get_store()
+    if store is None:
+        raise HTTPException(
+            status_code=404, detail="История метрик выключена (METRICS_HISTORY_PATH)"
+        )
+    return store
+
+
+def current_history_target(conn: HTTPConnection) -> str:
+    return history_target(target_key(current_target_params(conn)[0]))
+
+
+async def history_series(conn: HTTPConnection, kind, item, hours, until, resolution):
+    start, end = time_range(hours, until)
+    return await asyncio.to_thread(
+        history_store().series,
+        current_history_target(conn),
+        kind,
+        item,
+        start,
+        end,
+        resolution,
+    )
+
+
+async def history_top(conn: HTTPConnection, kind, hours, until, order_by, limit):
+    start, end = time_range(hours, until)
+    try:
+        return await asyncio.to_thread(
+            history_store().top,
+            current_history_target(conn),
+            kind,
+            start,
+            end,
+            order_by,
+            limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/history/status")
+async def history_status_api():
+    return await asyncio.to_thread(history_store().status)
+
+
+@app.get("/history/database")
+async def history_database_api(
+    request: Request,
+    hours: float = 24,
+    until: Optional[float] = None,
+    resolution: Optional[int] = None,
+):
+    """TPS, попадание в кэш, размер базы и пр. текущей цели по времени."""
+    return await history_series(request, "database", "", hours, until, resolution)
+
+
+@app.get("/history/queries")
+async def history_queries_api(
+    request: Request,
+    hours: float = 24,
+    until: Optional[float] = None,
+    order_by: str = "total_ms",
+    limit: int = 20,
+):
+    """Самые тяжёлые запросы за диапазон (суммы по истории)."""
+    return await history_top(request, "statements", hours, until, order_by, limit)
+
+
+@app.get("/history/queries/{queryid}")
+async def history_query_api(
+    queryid: int,
+    request: Request,
+    hours: float = 24 * 7,
+    until: Optional[float] = None,
+    resolution: Optional[int] = None,
+):
+    """Вызовы и среднее время одного запроса (queryid) по времени."""
+    return await history_series(
+        request, "statements", queryid, hours, until, resolution
+    )
+
+
+@app.get("/history/tables")
+async def history_tables_api(
+    request: Request,
+    hours: float = 24,
+    until: Optional[float] = None,
+    order_by: str = "n_dead_tup",
+    limit: int = 20,
+):
+    return await history_top(request, "tables", hours, until, order_by, limit)
+
+
+@app.get("/history/tables/{name}")
+async def history_table_api(
+    name: str,
+    request: Request,
+    hours: float = 24 * 7,
+    until: Optional[float] = None,
+    resolution: Optional[int] = None,
+):
+    """Мёртвые/живые строки и изменения таблицы (schema.table) по времени."""
+    return await history_series(request, "tables", name, hours, until, resolution)
+
+
+@app.get("/metrics")
+async def metrics_api():
+    """Метрики сервиса в формате Prometheus."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache_stats/")
+async def cache_stats_api():
+    return {
+        "static_analysis": static_cache.stats(),
+        "analysis_results": result_cache.stats(),
+    }
+
+
+@app.on_event("startup")
+def start_default_sampler():
+    # окно "последние N минут" должно быть доступно сразу, а не после первого клика
+    current_sampler()
+    # история пишется по всем заранее известным целям (pagila и DB_TARGETS_FILE)
+    for name in targets.names():
+        start_recorder(name)
+
+
+@app.on_event("shutdown")
+def shutdown_pools():
+    stop_all_samplers()
+    stop_all_feeds()
+    stop_all_recorders()
+    shutdown_executor()
+    shutdown_process_pool()
+    close_all_pools()
 
 
 @app.get("/exit/")
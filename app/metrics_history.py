@@ -0,0 +1,649 @@
+# metrics_history.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.db_pool import release
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры хранения ---
+HISTORY_PATH = os.getenv(
+    "METRICS_HISTORY_PATH", "data/metrics_history.sqlite3"
+)  # "" — история выключена
+HISTORY_INTERVAL = float(os.getenv("METRICS_HISTORY_INTERVAL", "15"))  # сек
+HISTORY_MAX_MB = float(os.getenv("METRICS_HISTORY_MAX_MB", "300"))
+HISTORY_TOP_QUERIES = 200  # запросов на снимок; остальные — одной строкой (item 0)
+HISTORY_MAX_POINTS = 2000  # точек в ответе: длинный диапазон — грубее разрешение
+MAINTENANCE_INTERVAL = 60.0  # сек между прореживанием и чисткой
+
+# разрешение, сек (0 — сырые снимки) -> сколько хранить, сек.
+# 200 запросов, активных в каждом интервале: 6 ч × 240 + 7 дн × 1440 +
+# 400 дн × 24 ≈ 21 тыс. строк на запрос, ~4 млн строк ≈ 250 МБ — потолок;
+# обычно меньше: пишутся только запросы и таблицы, у которых что-то изменилось.
+RETENTION = {
+    0: int(float(os.getenv("METRICS_HISTORY_RAW_HOURS", "6")) * 3600),
+    60: int(float(os.getenv("METRICS_HISTORY_MINUTE_DAYS", "7")) * 86400),
+    3600: int(float(os.getenv("METRICS_HISTORY_HOUR_DAYS", "400")) * 86400),
+}
+ROLLUPS = ((0, 60), (60, 3600))  # (из какого разрешения, в какое)
+
+# вид -> (счётчики: дельты, при прореживании суммируются;
+#         уровни: значение на момент снимка, при прореживании — максимум)
+KINDS = {
+    "statements": (("calls", "rows", "total_ms"), ()),
+    "tables": (
+        (
+            "seq_scan",
+            "idx_scan",
+            "n_tup_ins",
+            "n_tup_upd",
+            "n_tup_del",
+            "vacuum_count",
+            "autovacuum_count",
+            "analyze_count",
+            "autoanalyze_count",
+        ),
+        ("n_live_tup", "n_dead_tup"),
+    ),
+    "database": (
+        (
+            "xact_commit",
+            "xact_rollback",
+            "blks_hit",
+            "blks_read",
+            "tup_returned",
+            "tup_fetched",
+            "tup_inserted",
+            "tup_updated",
+            "tup_deleted",
+            "temp_bytes",
+            "deadlocks",
+        ),
+        ("numbackends", "size_bytes"),
+    ),
+}
+
+# --- Снимки ---
+_STATEMENTS_SQL = """
+SELECT queryid AS item, sum(calls) AS calls, sum(rows) AS rows,
+       sum({total_col}) AS total_ms
+FROM pg_stat_statements(false)
+WHERE queryid IS NOT NULL
+  AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+GROUP BY queryid
+"""
+
+_TABLES_SQL = """
+SELECT format('%I.%I', schemaname, relname) AS item,
+       seq_scan, coalesce(idx_scan, 0) AS idx_scan,
+       n_tup_ins, n_tup_upd, n_tup_del,
+       vacuum_count, autovacuum_count, analyze_count, autoanalyze_count,
+       n_live_tup, n_dead_tup
+FROM pg_stat_user_tables
+"""
+
+_DATABASE_SQL = """
+SELECT '' AS item, stats_reset,
+       xact_commit, xact_rollback, blks_hit, blks_read,
+       tup_returned, tup_fetched, tup_inserted, tup_updated, tup_deleted,
+       temp_bytes, deadlocks,
+       numbackends, pg_database_size(datname) AS size_bytes
+FROM pg_stat_database
+WHERE datname = current_database()
+"""
+
+
+def _values(kind: str, row: dict) -> tuple:
+    counters, gauges = KINDS[kind]
+    return tuple(float(row[c] or 0) for c in counters + gauges)
+
+
+def take_snapshot(conn) -> dict:
+    """Счётчики pg_stat_statements, pg_stat_user_tables и pg_stat_database."""
+    caps = get_capabilities(conn)
+    snapshot = {"ts": time.time(), "resets": {}}
+    with conn.cursor(row_factory=rows.dict_row) as cur:
+        cur.execute(_DATABASE_SQL)
+        database = cur.fetchone()
+        snapshot["database"] = {"": _values("database", database)}
+        snapshot["resets"]["database"] = database["stats_reset"]
+        snapshot["resets"]["tables"] = database["stats_reset"]
+
+        cur.execute(_TABLES_SQL)
+        snapshot["tables"] = {r["item"]: _values("tables", r) for r in cur.fetchall()}
+
+        columns = caps["stat_time_columns"]
+        if columns:
+            cur.execute(_STATEMENTS_SQL.format(total_col=columns[0]))
+            snapshot["statements"] = {
+                r["item"]: _values("statements", r) for r in cur.fetchall()
+            }
+            if caps["has_stat_statements_info"]:  # PG14+
+                cur.execute("SELECT stats_reset FROM pg_stat_statements_info")
+                row = cur.fetchone()
+                snapshot["resets"]["statements"] = row["stats_reset"] if row else None
+    return snapshot
+
+
+def compute_deltas(kind: str, prev: dict, cur: dict) -> Dict[object, tuple]:
+    """
+    Дельты счётчиков и текущие уровни между двумя снимками одного вида.
+    Как в stats_sampler.compute_interval: после сброса статистики или если
+    счётчик уменьшился, за интервал берётся текущее значение.
+    Записи без изменений пропускаются (кроме базы — её строка пишется всегда).
+    """
+    counters, gauges = KINDS[kind]
+    n = len(counters)
+    reset = prev["resets"].get(kind) != cur["resets"].get(kind)
+    before_all = {} if reset else prev.get(kind, {})
+    deltas = {}
+    for item, values in cur.get(kind, {}).items():
+        before = before_all.get(item)
+        if before is None or any(v < b for v, b in zip(values[:n], before[:n])):
+            delta = values[:n]
+        else:
+            delta = tuple(v - b for v, b in zip(values[:n], before[:n]))
+        changed = any(delta) or (
+            gauges and (before is None or values[n:] != before[n:])
+        )
+        if changed or kind == "database":
+            deltas[item] = delta + values[n:]
+    return deltas
+
+
+def top_statements(deltas: Dict[object, tuple], top: int = HISTORY_TOP_QUERIES):
+    """Самые дорогие запросы интервала; остальные суммируются в item 0."""
+    ranked = sorted(deltas.items(), key=lambda kv: -kv[1][2])
+    kept = dict(ranked[:top])
+    rest = [v for _, v in ranked[top:]]
+    if rest:
+        kept[0] = tuple(sum(col) for col in zip(*rest))
+    return kept
+
+
+# --- Хранилище ---
+class HistoryStore:
+    """
+    История метрик в SQLite: по таблице на вид, строки (цель, разрешение,
+    объект, время). Сырые снимки прореживаются в минутные и часовые
+    интервалы, у каждого разрешения свой срок хранения, общий размер
+    ограничен HISTORY_MAX_MB.
+
+    Запись — одна транзакция на снимок (WAL, synchronous=NORMAL),
+    таблицы WITHOUT ROWID без вторичных индексов: каждая строка пишется
+    один раз в кластерный ключ.
+    """
+
+    def __init__(self, path: str, max_bytes: float = HISTORY_MAX_MB * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._targets: Dict[str, int] = {}
+        self._maintained = 0.0
+        with self._lock:
+            self._init_schema()
+
+    def _init_schema(self) -> None:
+        db = self._db
+        # до создания таблиц: освобождённые страницы возвращаются incremental_vacuum
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute("PRAGMA journal_size_limit = 16777216")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS targets "
+            "(id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS queries (target_id INTEGER, queryid INTEGER, "
+            "query TEXT, PRIMARY KEY (target_id, queryid)) WITHOUT ROWID"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS rollups (target_id INTEGER, res INTEGER, "
+            "done_until INTEGER, PRIMARY KEY (target_id, res)) WITHOUT ROWID"
+        )
+        for kind, (counters, gauges) in KINDS.items():
+            columns = ", ".join(f"{c} REAL" for c in counters + gauges)
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {kind}_history ("
+                f"target_id INTEGER, res INTEGER, item, ts INTEGER, seconds REAL, "
+                f"{columns}, PRIMARY KEY (target_id, res, item, ts)) WITHOUT ROWID"
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _target_id(self, target: str) -> int:
+        target_id = self._targets.get(target)
+        if target_id is None:
+            self._db.execute(
+                "INSERT OR IGNORE INTO targets (key) VALUES (?)", (target,)
+            )
+            (target_id,) = self._db.execute(
+                "SELECT id FROM targets WHERE key = ?", (target,)
+            ).fetchone()
+            self._targets[target] = target_id
+        return target_id
+
+    # --- запись ---
+    def known_queries(self, target: str) -> set:
+        with self._lock:
+            target_id = self._target_id(target)
+            return {
+                r[0]
+                for r in self._db.execute(
+                    "SELECT queryid FROM queries WHERE target_id = ?", (target_id,)
+                )
+            }
+
+    def write(
+        self,
+        target: str,
+        ts: float,
+        seconds: float,
+        data: Dict[str, Dict[object, tuple]],
+        texts: Optional[Dict[int, str]] = None,
+    ) -> None:
+        """Один интервал (дельты по видам) — одной транзакцией."""
+        with self._lock:
+            target_id = self._target_id(target)
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                for kind, items in data.items():
+                    counters, gauges = KINDS[kind]
+                    names = ", ".join(counters + gauges)
+                    marks = ", ".join("?" * len(counters + gauges))
+                    db.executemany(
+                        f"INSERT OR REPLACE INTO {kind}_history "
+                        f"(target_id, res, item, ts, seconds, {names}) "
+                        f"VALUES (?, 0, ?, ?, ?, {marks})",
+                        [
+                            (target_id, item, int(ts), seconds, *values)
+                            for item, values in items.items()
+                        ],
+                    )
+                if texts:
+                    db.executemany(
+                        "INSERT OR IGNORE INTO queries VALUES (?, ?, ?)",
+                        [(target_id, q, text) for q, text in texts.items()],
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    # --- прореживание и чистка ---
+    def maintain(self, now: Optional[float] = None, force: bool = False) -> None:
+        """Раз в MAINTENANCE_INTERVAL: прореживание, сроки хранения, потолок размера."""
+        now = now or time.time()
+        with self._lock:
+            if not force and now - self._maintained < MAINTENANCE_INTERVAL:
+                return
+            self._maintained = now
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                for (target_id,) in db.execute("SELECT id FROM targets").fetchall():
+                    for src, dst in ROLLUPS:
+                        self._rollup(target_id, src, dst, now)
+                for kind in KINDS:
+                    for res, keep in RETENTION.items():
+                        db.execute(
+                            f"DELETE FROM {kind}_history WHERE res = ? AND ts < ?",
+                            (res, int(now - keep)),
+                        )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            self._enforce_size()
+            db.execute("PRAGMA incremental_vacuum")
+
+    def _rollup(self, target_id: int, src: int, dst: int, now: float) -> None:
+        # только завершённые интервалы dst; каждый прореживается один раз
+        until = int(now) - int(now) % dst
+        row = self._db.execute(
+            "SELECT done_until FROM rollups WHERE target_id = ? AND res = ?",
+            (target_id, dst),
+        ).fetchone()
+        since = row[0] if row else 0
+        if until <= since:
+            return
+        # seconds интервала — сколько времени он покрыт записью (строка базы
+        # пишется в каждом снимке), а не сумма по строкам объекта: запрос или
+        # таблица без изменений в снимке не пишутся, и скорость по их строкам
+        # считалась бы только по активным снимкам
+        for kind, (counters, gauges) in KINDS.items():
+            names = ", ".join(counters + gauges)
+            aggregates = ", ".join(
+                [f"sum(h.{c})" for c in counters] + [f"max(h.{g})" for g in gauges]
+            )
+            self._db.execute(
+                f"WITH coverage AS ("
+                f"SELECT ts - ts % ? AS bucket, sum(seconds) AS seconds "
+                f"FROM database_history "
+                f"WHERE target_id = ? AND res = ? AND ts >= ? AND ts < ? "
+                f"GROUP BY bucket) "
+                f"INSERT OR REPLACE INTO {kind}_history "
+                f"(target_id, res, item, ts, seconds, {names}) "
+                f"SELECT h.target_id, ?, h.item, h.ts - h.ts % ?, "
+                f"coalesce(max(c.seconds), sum(h.seconds)), {aggregates} "
+                f"FROM {kind}_history h "
+                f"LEFT JOIN coverage c ON c.bucket = h.ts - h.ts % ? "
+                f"WHERE h.target_id = ? AND h.res = ? AND h.ts >= ? AND h.ts < ? "
+                f"GROUP BY h.item, h.ts - h.ts % ?",
+                (dst, target_id, src, since, until, dst, dst, dst)
+                + (target_id, src, since, until, dst),
+            )
+        self._db.execute(
+            "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?)", (target_id, dst, until)
+        )
+
+    def size_bytes(self) -> int:
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+        free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def _enforce_size(self) -> None:
+        # сверх потолка: срезаем по десятой части срока хранения с самого
+        # подробного разрешения — часовой тренд живёт дольше всего
+        for res in RETENTION:
+            while self.size_bytes() > self.max_bytes:
+                oldest = min(
+                    (
+                        self._db.execute(
+                            f"SELECT min(ts) FROM {kind}_history WHERE res = ?", (res,)
+                        ).fetchone()[0]
+                        for kind in KINDS
+                    ),
+                    key=lambda ts: float("inf") if ts is None else ts,
+                )
+                if oldest is None:
+                    break
+                cutoff = oldest + max(RETENTION[res] // 10, 1)
+                for kind in KINDS:
+                    self._db.execute(
+                        f"DELETE FROM {kind}_history WHERE res = ? AND ts < ?",
+                        (res, cutoff),
+                    )
+                logger.warning(
+                    f"История метрик больше {self.max_bytes // 1048576} МБ: "
+                    f"удалены данные разрешения {res} с до {cutoff}"
+                )
+            else:
+                return
+
+    # --- чтение ---
+    def pick_resolution(self, start: float, end: float, now: Optional[float] = None):
+        """Самое подробное разрешение, которое покрывает диапазон и не даёт
+        больше HISTORY_MAX_POINTS точек."""
+        now = now or time.time()
+        for res, keep in RETENTION.items():
+            step = res or HISTORY_INTERVAL
+            if start >= now - keep and (end - start) / step <= HISTORY_MAX_POINTS:
+                return res
+        return max(RETENTION)
+
+    def series(
+        self,
+        target: str,
+        kind: str,
+        item,
+        start: float,
+        end: float,
+        resolution: Optional[int] = None,
+    ) -> dict:
+        """Точки одного объекта (запроса, таблицы, базы) за [start, end]."""
+        if resolution is None:
+            resolution = self.pick_resolution(start, end)
+        counters, gauges = KINDS[kind]
+        names = ("ts", "seconds") + counters + gauges
+        with self._lock:
+            target_id = self._target_id(target)
+            points = [
+                derive(kind, dict(zip(names, r)))
+                for r in self._db.execute(
+                    f"SELECT {', '.join(names)} FROM {kind}_history "
+                    f"WHERE target_id = ? AND res = ? AND item = ? "
+                    f"AND ts BETWEEN ? AND ? ORDER BY ts",
+                    (target_id, resolution, item, int(start), int(end)),
+                )
+            ]
+        return {"kind": kind, "item": item, "resolution": resolution, "points": points}
+
+    def top(
+        self,
+        target: str,
+        kind: str,
+        start: float,
+        end: float,
+        order_by: str,
+        limit: int = 20,
+        resolution: Optional[int] = None,
+    ) -> dict:
+        """Объекты вида с суммами счётчиков (и последним уровнем) за диапазон."""
+        counters, gauges = KINDS[kind]
+        if order_by not in counters + gauges:
+            raise ValueError(f"order_by: одно из {', '.join(counters + gauges)}")
+        if resolution is None:
+            resolution = self.pick_resolution(start, end)
+        names = ("item", "seconds") + counters + gauges
+        aggregates = ", ".join(
+            ["item", "sum(seconds)"]
+            + [f"sum({c})" for c in counters]
+            + [f"max({g})" for g in gauges]
+        )
+        with self._lock:
+            target_id = self._target_id(target)
+            # скорости — за всё покрытое записью время диапазона, а не только
+            # за снимки, в которых объект менялся
+            (covered,) = self._db.execute(
+                "SELECT sum(seconds) FROM database_history "
+                "WHERE target_id = ? AND res = ? AND ts BETWEEN ? AND ?",
+                (target_id, resolution, int(start), int(end)),
+            ).fetchone()
+            items = [
+                derive(kind, {**dict(zip(names, r)), "seconds": covered or r[1]})
+                for r in self._db.execute(
+                    f"SELECT {aggregates} FROM {kind}_history "
+                    f"WHERE target_id = ? AND res = ? AND ts BETWEEN ? AND ? "
+                    f"GROUP BY item ORDER BY {names.index(order_by) + 1} DESC LIMIT ?",
+                    (target_id, resolution, int(start), int(end), limit),
+                )
+            ]
+            if kind == "statements":
+                texts = dict(
+                    self._db.execute(
+                        "SELECT queryid, query FROM queries WHERE target_id = ?",
+                        (target_id,),
+                    ).fetchall()
+                )
+                for entry in items:
+                    entry["query"] = texts.get(entry["item"], "<прочие запросы>")
+        return {"kind": kind, "resolution": resolution, "items": items}
+
+    def status(self) -> dict:
+        with self._lock:
+            counts = {
+                kind: dict(
+                    self._db.execute(
+                        f"SELECT res, count(*) FROM {kind}_history GROUP BY res"
+                    ).fetchall()
+                )
+                for kind in KINDS
+            }
+            return {
+                "path": self.path,
+                "size_bytes": self.size_bytes(),
+                "max_bytes": int(self.max_bytes),
+                "interval_seconds": HISTORY_INTERVAL,
+                "retention_seconds": RETENTION,
+                "targets": list(self._targets),
+                "rows": counts,
+            }
+
+
+def derive(kind: str, point: dict) -> dict:
+    """Производные величины: средние и скорости за интервал."""
+    seconds = point.get("seconds") or 0
+    if kind == "statements":
+        calls = point["calls"]
+        point["mean_ms"] = round(point["total_ms"] / calls, 3) if calls else None
+        point["calls_per_s"] = round(calls / seconds, 3) if seconds else None
+    elif kind == "database":
+        xacts = point["xact_commit"] + point["xact_rollback"]
+        blocks = point["blks_hit"] + point["blks_read"]
+        point["tps"] = round(xacts / seconds, 2) if seconds else None
+        point["cache_hit_ratio"] = (
+            round(point["blks_hit"] / blocks, 4) if blocks else None
+        )
+    elif kind == "tables":
+        live, dead = point["n_live_tup"], point["n_dead_tup"]
+        point["dead_ratio"] = round(dead / (live + dead), 4) if live + dead else None
+    return point
+
+
+# --- Запись по цели ---
+class HistoryRecorder:
+    """
+    Фоновый поток одной цели: раз в interval секунд снимок, дельты к
+    предыдущему снимку — в хранилище. Первый снимок после запуска только
+    запоминается: интервал до него неизвестен.
+    """
+
+    def __init__(
+        self,
+        store: HistoryStore,
+        target: str,
+        connect: Callable,
+        interval: float = HISTORY_INTERVAL,
+    ):
+        self.store = store
+        self.target = target
+        self.connect = connect
+        self.interval = interval
+        self._prev: Optional[dict] = None
+        self._known = store.known_queries(target)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"history {self.target}", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"История метрик: запись {self.target} каждые {self.interval} с")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.record_once()
+                self.store.maintain()
+            except Exception as e:
+                logger.warning(f"История метрик {self.target}: снимок не записан: {e}")
+                self._prev = None
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def record_once(self) -> None:
+        conn = self.connect()
+        try:
+            cur = take_snapshot(conn)
+            prev, self._prev = self._prev, cur
+            if prev is None:
+                return
+            data = {kind: compute_deltas(kind, prev, cur) for kind in KINDS}
+            data["statements"] = top_statements(data["statements"])
+            texts = self._fetch_texts(conn, [q for q in data["statements"] if q])
+        finally:
+            release(conn)
+        self.store.write(self.target, cur["ts"], cur["ts"] - prev["ts"], data, texts)
+
+    def _fetch_texts(self, conn, queryids: List[int]) -> Dict[int, str]:
+        # тексты — один раз на запрос, а не на каждый снимок
+        missing = [q for q in queryids if q not in self._known]
+        if not missing:
+            return {}
+        with conn.cursor(row_factory=rows.dict_row) as cur:
+            cur.execute(
+                "SELECT DISTINCT ON (queryid) queryid, query "
+                "FROM pg_stat_statements(true) WHERE queryid = ANY(%s)",
+                (missing,),
+            )
+            texts = {r["queryid"]: r["query"] for r in cur.fetchall()}
+        self._known.update(texts)
+        return texts
+
+
+# --- Реестр: одно хранилище, по рекордеру на цель ---
+_store: Optional[HistoryStore] = None
+_recorders: Dict[tuple, HistoryRecorder] = {}
+_lock = threading.Lock()
+
+
+def history_target(key: tuple) -> str:
+    """Имя цели в истории по db_pool.target_key: user@host:port/dbname."""
+    host, port, dbname, user = key
+    return f"{user}@{host}:{port}/{dbname}"
+
+
+def get_store() -> Optional[HistoryStore]:
+    """Хранилище истории (None, если METRICS_HISTORY_PATH пуст)."""
+    global _store
+    with _lock:
+        if _store is None and HISTORY_PATH:
+            _store = HistoryStore(HISTORY_PATH)
+        return _store
+
+
+def get_recorder(key: tuple, connect: Callable) -> Optional[HistoryRecorder]:
+    """Запущенный рекордер цели, создаётся при первом обращении."""
+    store = get_store()
+    if store is None:
+        return None
+    with _lock:
+        recorder = _recorders.get(key)
+        if recorder is None:
+            recorder = HistoryRecorder(store, history_target(key), connect)
+            _recorders[key] = recorder
+    recorder.start()
+    return recorder
+
+
+def stop_all_recorders() -> None:
+    global _store
+    with _lock:
+        recorders = list(_recorders.values())
+        _recorders.clear()
+        store, _store = _store, None
+    for recorder in recorders:
+        recorder.stop()
+    if store is not None:
+        store.close()
+
+
+def time_range(hours: float, until: Optional[float] = None) -> Tuple[float, float]:
+    end = until or time.time()
+    return end - hours * 3600, end
@@ -0,0 +1,266 @@
+# observability.py
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import psycopg
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+from starlette.routing import Match
+
+PREFIX = "pg_analyzer"
+BACKGROUND = "background"  # запросы к БД вне анализаторов: сэмплеры, лента, история
+
+# --- Метрики ---
+HTTP_LATENCY = Histogram(
+    f"{PREFIX}_http_request_duration_seconds",
+    "Время обработки HTTP-запроса (до последнего байта ответа)",
+    ["method", "endpoint", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+HTTP_IN_FLIGHT = Gauge(
+    f"{PREFIX}_http_requests_in_flight",
+    "HTTP-запросы в обработке",
+    ["endpoint"],
+)
+CONNECT_LATENCY = Histogram(
+    f"{PREFIX}_db_connection_acquire_seconds",
+    "Получение соединения: из пула или новое подключение с проверками и повторами",
+    ["source"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5, 15, 30),
+)
+CONNECT_RETRIES = Counter(
+    f"{PREFIX}_db_connection_retries_total",
+    "Неудачные попытки подключения (потом повтор или отказ)",
+    ["reason"],
+)
+ANALYZER_RUNS = Counter(
+    f"{PREFIX}_analyzer_runs_total",
+    "Запуски анализаторов",
+    ["analyzer", "status"],
+)
+ANALYZER_LATENCY = Histogram(
+    f"{PREFIX}_analyzer_duration_seconds",
+    "Время анализатора в потоке (соединение + запросы + Python)",
+    ["analyzer"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+DB_QUERIES = Counter(
+    f"{PREFIX}_db_queries_total",
+    "Запросы к БД (round trips)",
+    ["analyzer"],
+)
+DB_SECONDS = Counter(
+    f"{PREFIX}_db_seconds_total",
+    "Время ожидания ответов БД",
+    ["analyzer"],
+)
+PYTHON_SECONDS = Counter(
+    f"{PREFIX}_analyzer_python_seconds_total",
+    "Время анализатора вне БД и получения соединения (разбор, расчёты)",
+    ["analyzer"],
+)
+
+
+# --- Разбивка времени одного HTTP-запроса (Server-Timing) ---
+class Timings:
+    """
+    Сколько времени и раз ушло на каждую часть запроса. Общий для
+    event loop и потоков анализаторов этого запроса (см. run_analyzer).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._entries: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, count: int = 1) -> None:
+        with self._lock:
+            entry = self._entries.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += count
+
+    def header(self) -> str:
+        """Значение Server-Timing: connect, db (с числом запросов), python, total."""
+        with self._lock:
+            entries = dict(self._entries)
+        parts = []
+        for name, (seconds, count) in entries.items():
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if name == "db":
+                part += f';desc="{count} queries"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_timings: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+_span: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "analyzer_span", default=None
+)
+
+
+def record_timing(name: str, seconds: float, count: int = 1) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds, count)
+
+
+def record_db(seconds: float) -> None:
+    span = _span.get()
+    analyzer = span["analyzer"] if span else BACKGROUND
+    DB_QUERIES.labels(analyzer).inc()
+    DB_SECONDS.labels(analyzer).inc(seconds)
+    if span is not None:
+        span["db"] += seconds
+    record_timing("db", seconds)
+
+
+def record_connect(source: str, seconds: float) -> None:
+    CONNECT_LATENCY.labels(source).observe(seconds)
+    span = _span.get()
+    if span is not None:
+        span["connect"] += seconds
+    record_timing("connect", seconds)
+
+
+@contextmanager
+def analyzer_span(analyzer: str):
+    """
+    Запуск анализатора в потоке: длительность, время в БД (TimedCursor),
+    остаток — Python. Вызывать внутри контекста запроса (copy_context).
+    """
+    span = {"analyzer": analyzer, "db": 0.0, "connect": 0.0}
+    token = _span.set(span)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield span
+        status = "ok"
+    finally:
+        _span.reset(token)
+        elapsed = time.perf_counter() - started
+        python = max(0.0, elapsed - span["db"] - span["connect"])
+        ANALYZER_RUNS.labels(analyzer, status).inc()
+        ANALYZER_LATENCY.labels(analyzer).observe(elapsed)
+        PYTHON_SECONDS.labels(analyzer).inc(python)
+        record_timing("python", python)
+
+
+class TimedCursor(psycopg.Cursor):
+    """Курсор, который считает запросы к БД и время ожидания ответа."""
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            record_db(time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            record_db(time.perf_counter() - started)
+
+
+# --- Кэши: читаются при каждом сборе метрик ---
+class _CacheCollector:
+    def __init__(self):
+        self._caches: Dict[str, Callable[[], dict]] = {}
+
+    def add(self, name: str, stats: Callable[[], dict]) -> None:
+        self._caches[name] = stats
+
+    def collect(self):
+        counters = {
+            name: CounterMetricFamily(
+                f"{PREFIX}_cache_{name}", f"Кэш анализов: {name}", labels=["cache"]
+            )
+            for name in ("hits", "misses", "evictions", "coalesced")
+        }
+        size = GaugeMetricFamily(
+            f"{PREFIX}_cache_entries", "Записей в кэше", labels=["cache"]
+        )
+        hit_rate = GaugeMetricFamily(
+            f"{PREFIX}_cache_hit_ratio",
+            "Доля попаданий с запуска",
+            labels=["cache"],
+        )
+        for cache, stats in list(self._caches.items()):
+            values = stats()
+            for name, family in counters.items():
+                if name in values:
+                    family.add_metric([cache], values[name])
+            size.add_metric([cache], values["size"])
+            hit_rate.add_metric([cache], values["hit_rate"])
+        yield from counters.values()
+        yield size
+        yield hit_rate
+
+
+_caches = _CacheCollector()
+REGISTRY.register(_caches)
+
+
+def register_cache(name: str, stats: Callable[[], dict]) -> None:
+    """Кэш с методом stats() (см. analysis_cache) — в /metrics."""
+    _caches.add(name, stats)
+
+
+# --- ASGI middleware: задержки, запросы в обработке, Server-Timing ---
+def endpoint_label(app, scope) -> str:
+    """Шаблон пути маршрута (/history/tables/{name}), а не сам путь: число серий ограничено."""
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "other")
+    return "other"
+
+
+class MetricsMiddleware:
+    """
+    Для каждого HTTP-запроса: гистограмма времени по маршруту, счётчик
+    запросов в обработке и заголовок Server-Timing с разбивкой
+    (connect, db, python, total). У потоковых ответов заголовок уходит
+    до тела — в нём то, что успело выполниться к первому байту.
+    """
+
+    def __init__(self, app, router=None):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = endpoint_label(self.router, scope) if self.router else "other"
+        timings = Timings()
+        token = _timings.set(timings)
+        status = "500"
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.header().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            in_flight.dec()
+            HTTP_LATENCY.labels(scope["method"], endpoint, status).observe(
+                time.perf_counter() - timings.started
+            )
+            _timings.reset(token)
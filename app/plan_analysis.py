@@ -0,0 +1,222 @@
+# plan_analysis.py
+from typing import List, Optional
+
+# --- Параметры отчёта ---
+TOP_NODES = 10  # сколько узлов показывать в рейтингах
+MISESTIMATE_MIN_FACTOR = 10.0  # во сколько раз должна ошибиться оценка строк
+
+SHARED_BUFFER_FIELDS = ("Shared Hit Blocks", "Shared Read Blocks")
+TEMP_BUFFER_FIELDS = ("Temp Read Blocks", "Temp Written Blocks")
+BUFFER_FIELDS = (
+    "Shared Hit Blocks",
+    "Shared Read Blocks",
+    "Shared Dirtied Blocks",
+    "Shared Written Blocks",
+    "Local Hit Blocks",
+    "Local Read Blocks",
+    "Local Dirtied Blocks",
+    "Local Written Blocks",
+    "Temp Read Blocks",
+    "Temp Written Blocks",
+)
+
+
+def node_label(node: dict) -> str:
+    """Короткое описание узла: "Index Scan using idx on film f"."""
+    label = node.get("Node Type", "?")
+    if node.get("Join Type"):
+        label += f" ({node['Join Type']})"
+    if node.get("Index Name"):
+        label += f" using {node['Index Name']}"
+    if node.get("Relation Name"):
+        label += f" on {node['Relation Name']}"
+        alias = node.get("Alias")
+        if alias and alias != node["Relation Name"]:
+            label += f" {alias}"
+    elif node.get("CTE Name"):
+        label += f" on {node['CTE Name']}"
+    return label
+
+
+def _blocks(node: dict, fields) -> int:
+    return sum(int(node.get(f, 0) or 0) for f in fields)
+
+
+def flatten_plan(plan: dict) -> List[tuple]:
+    """Обход дерева в прямом порядке: [(node, id, parent_id, depth), ...]."""
+    out = []
+    stack = [(plan, None, 0)]
+    while stack:
+        node, parent_id, depth = stack.pop()
+        node_id = len(out)
+        out.append((node, node_id, parent_id, depth))
+        children = node.get("Plans") or []
+        for child in reversed(children):
+            stack.append((child, node_id, depth + 1))
+    return out
+
+
+def _misestimate(node: dict) -> Optional[dict]:
+    loops = node.get("Actual Loops")
+    if not loops:
+        return None  # узел не выполнялся или EXPLAIN без ANALYZE
+    # оба значения — в среднем на один проход; 0 считаем за 1,
+    # чтобы "ожидали 1, получили 0" не давало бесконечный фактор
+    estimated = max(float(node.get("Plan Rows", 0) or 0), 1.0)
+    actual = max(float(node.get("Actual Rows", 0) or 0), 1.0)
+    ratio = actual / estimated
+    return {
+        "estimated_rows": node.get("Plan Rows"),
+        "actual_rows": node.get("Actual Rows"),
+        "ratio": round(ratio, 4),
+        "factor": round(max(ratio, 1 / ratio), 2),
+        "direction": "under" if ratio > 1 else "over" if ratio < 1 else "exact",
+    }
+
+
+def analyze_plan(explain: dict, top: int = TOP_NODES) -> dict:
+    """
+    Метрики по всем узлам плана. explain — элемент результата
+    EXPLAIN (FORMAT JSON): {"Plan": ..., "Planning Time": ..., ...}.
+
+    Для каждого узла:
+    - inclusive_time_ms = Actual Total Time * Actual Loops (время узла с детьми)
+    - exclusive_time_ms = inclusive минус inclusive детей (не меньше нуля:
+      у параллельных узлов время воркеров суммируется и может превышать
+      время родителя)
+    - shared/temp буферы узла без детей и их доля от всего плана
+    - ошибка оценки числа строк
+    Без ANALYZE фактических значений нет — тогда ранжируем по собственной
+    стоимости узла (Total Cost минус стоимость детей).
+    """
+    plan = explain.get("Plan", explain)
+    flat = flatten_plan(plan)
+    has_actuals = "Actual Loops" in plan
+
+    nodes = []
+    children_of = {}
+    for node, node_id, parent_id, depth in flat:
+        children_of.setdefault(parent_id, []).append(node_id)
+        loops = node.get("Actual Loops")
+        nodes.append(
+            {
+                "id": node_id,
+                "parent_id": parent_id,
+                "depth": depth,
+                "node_type": node.get("Node Type"),
+                "label": node_label(node),
+                "relation": node.get("Relation Name"),
+                "index": node.get("Index Name"),
+                "parent_relationship": node.get("Parent Relationship"),
+                "total_cost": node.get("Total Cost"),
+                "loops": loops,
+                "never_executed": has_actuals and not loops,
+                "inclusive_time_ms": (
+                    float(node.get("Actual Total Time", 0) or 0) * (loops or 0)
+                    if has_actuals
+                    else None
+                ),
+                "_cost": float(node.get("Total Cost", 0) or 0),
+                "_shared": _blocks(node, SHARED_BUFFER_FIELDS),
+                "_temp": _blocks(node, TEMP_BUFFER_FIELDS),
+                "misestimate": _misestimate(node),
+            }
+        )
+
+    # буферы в EXPLAIN уже накоплены с учётом детей — вычитаем их так же, как время
+    root = nodes[0]
+    total_shared = root["_shared"] or 0
+    total_temp = root["_temp"] or 0
+    for n in nodes:
+        kids = [nodes[k] for k in children_of.get(n["id"], [])]
+        n["exclusive_cost"] = round(
+            max(n["_cost"] - sum(k["_cost"] for k in kids), 0.0), 2
+        )
+        if has_actuals:
+            n["exclusive_time_ms"] = round(
+                max(
+                    n["inclusive_time_ms"] - sum(k["inclusive_time_ms"] for k in kids),
+                    0.0,
+                ),
+                3,
+            )
+            n["inclusive_time_ms"] = round(n["inclusive_time_ms"], 3)
+        else:
+            n["exclusive_time_ms"] = None
+        shared = max(n["_shared"] - sum(k["_shared"] for k in kids), 0)
+        temp = max(n["_temp"] - sum(k["_temp"] for k in kids), 0)
+        n["shared_blocks"] = shared
+        n["temp_blocks"] = temp
+        n["shared_share"] = round(shared / total_shared, 4) if total_shared else 0.0
+        n["temp_share"] = round(temp / total_temp, 4) if total_temp else 0.0
+
+    for n in nodes:
+        del n["_cost"], n["_shared"], n["_temp"]
+
+    total_time = root["inclusive_time_ms"] if has_actuals else None
+    for n in nodes:
+        if has_actuals and total_time:
+            n["time_share"] = round(n["exclusive_time_ms"] / total_time, 4)
+        else:
+            n["time_share"] = None
+
+    if has_actuals:
+        hottest = sorted(nodes, key=lambda n: -n["exclusive_time_ms"])
+    else:
+        hottest = sorted(nodes, key=lambda n: -n["exclusive_cost"])
+    misestimates = sorted(
+        (
+            n
+            for n in nodes
+            if n["misestimate"] and n["misestimate"]["factor"] >= MISESTIMATE_MIN_FACTOR
+        ),
+        key=lambda n: -n["misestimate"]["factor"],
+    )
+
+    summary = {
+        "node_count": len(nodes),
+        "has_actuals": has_actuals,
+        "planning_time_ms": explain.get("Planning Time"),
+        "execution_time_ms": explain.get("Execution Time"),
+        "total_cost": plan.get("Total Cost"),
+        "shared_blocks": total_shared,
+        "temp_blocks": total_temp,
+        "all_buffers": _blocks(plan, BUFFER_FIELDS),
+    }
+    return {
+        "summary": summary,
+        "hottest_nodes": hottest[:top],
+        "misestimates": misestimates[:top],
+        "nodes": nodes,
+    }
+
+
+def print_plan_analysis(analysis: dict) -> None:
+    summary = analysis["summary"]
+    print("\n=== Метрики по всему плану ===")
+    print(f"Узлов: {summary['node_count']}")
+    if summary["has_actuals"]:
+        print(f"Execution Time: {summary['execution_time_ms']} ms")
+    print(
+        f"Shared Blocks: {summary['shared_blocks']}, Temp Blocks: {summary['temp_blocks']}"
+    )
+
+    print("\n--- Самые дорогие узлы ---")
+    for n in analysis["hottest_nodes"]:
+        if summary["has_actuals"]:
+            print(
+                f"[{n['id']}] {n['label']}: {n['exclusive_time_ms']} ms "
+                f"({(n['time_share'] or 0) * 100:.1f}%), loops={n['loops']}, "
+                f"shared={n['shared_blocks']}, temp={n['temp_blocks']}"
+            )
+        else:
+            print(f"[{n['id']}] {n['label']}: cost={n['exclusive_cost']}")
+
+    if analysis["misestimates"]:
+        print("\n--- Ошибки оценки числа строк ---")
+        for n in analysis["misestimates"]:
+            m = n["misestimate"]
+            print(
+                f"[{n['id']}] {n['label']}: оценка {m['estimated_rows']}, "
+                f"факт {m['actual_rows']} (x{m['factor']}, {m['direction']})"
+            )
@@ -0,0 +1,153 @@
+# plan_history.py
+import difflib
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Hashable, List, Optional
+
+from app.plan_analysis import flatten_plan, node_label
+
+logger = logging.getLogger(__name__)
+
+# --- Параметры истории ---
+PLAN_HISTORY_PER_QUERY = 20  # планов на (цель, запрос)
+PLAN_HISTORY_MAX_QUERIES = 500  # запросов в истории (LRU)
+REGRESSION_TIME_FACTOR = 2.0  # во сколько раз выросло время
+REGRESSION_MIN_MS = 5.0  # ...и не меньше чем на столько мс (шум EXPLAIN ANALYZE)
+REGRESSION_COST_FACTOR = 2.0  # для планов без ANALYZE сравниваем стоимость
+
+
+def plan_shape(plan: dict) -> List[str]:
+    """
+    Структура плана по строке на узел: тип, вид соединения, таблица, индекс,
+    с отступом по глубине. Оценки, время и алиасы в форму не входят.
+    """
+    lines = []
+    for node, _, _, depth in flatten_plan(plan):
+        parts = [node.get("Node Type", "?")]
+        for field in (
+            "Join Type",
+            "Relation Name",
+            "Index Name",
+            "Parent Relationship",
+        ):
+            if node.get(field):
+                parts.append(f"{field}={node[field]}")
+        lines.append("  " * depth + " ".join(parts))
+    return lines
+
+
+def shape_hash(shape: List[str]) -> str:
+    return hashlib.sha1("\n".join(shape).encode("utf-8")).hexdigest()[:16]
+
+
+def _outline(plan: dict) -> List[str]:
+    """Читаемое дерево для diff: метка узла + оценка строк."""
+    return [
+        "  " * depth + f"{node_label(node)} (rows={node.get('Plan Rows')})"
+        for node, _, _, depth in flatten_plan(plan)
+    ]
+
+
+def _is_regression(prev: dict, cur: dict) -> Optional[str]:
+    before, after = prev["execution_time_ms"], cur["execution_time_ms"]
+    if before is not None and after is not None:
+        if (
+            after >= before * REGRESSION_TIME_FACTOR
+            and after - before >= REGRESSION_MIN_MS
+        ):
+            return f"время выполнения выросло с {before} до {after} мс"
+        return None
+    before, after = prev["total_cost"], cur["total_cost"]
+    if before and after and after >= before * REGRESSION_COST_FACTOR:
+        return f"стоимость плана выросла с {before} до {after}"
+    return None
+
+
+class PlanHistory:
+    """
+    История планов в памяти: ключ — (цель, fingerprint запроса, режим EXPLAIN).
+    Новый план сравнивается с последним "хорошим": смена формы или
+    заметный рост времени/стоимости помечаются, к ним прикладывается
+    поузловой diff.
+    """
+
+    def __init__(
+        self,
+        per_query: int = PLAN_HISTORY_PER_QUERY,
+        max_queries: int = PLAN_HISTORY_MAX_QUERIES,
+    ):
+        self.per_query = per_query
+        self.max_queries = max_queries
+        self._data: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, key: Hashable, plan: dict, analysis: dict) -> dict:
+        """Сохраняет план и возвращает вердикт относительно предыдущих запусков."""
+        summary = analysis["summary"]
+        shape = plan_shape(plan)
+        entry = {
+            "ts": time.time(),
+            "shape_hash": shape_hash(shape),
+            "execution_time_ms": summary.get("execution_time_ms"),
+            "total_cost": summary.get("total_cost"),
+            "shared_blocks": summary.get("shared_blocks"),
+            "temp_blocks": summary.get("temp_blocks"),
+            "outline": _outline(plan),
+            "good": True,
+        }
+
+        with self._lock:
+            history = self._data.get(key)
+            if history is None:
+                history = deque(maxlen=self.per_query)
+                self._data[key] = history
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_queries:
+                self._data.popitem(last=False)
+            baseline = next((e for e in reversed(history) if e["good"]), None)
+
+            verdict = {"status": "new", "shape_hash": entry["shape_hash"]}
+            if baseline is not None:
+                shape_changed = baseline["shape_hash"] != entry["shape_hash"]
+                reason = _is_regression(baseline, entry)
+                if reason:
+                    entry["good"] = False
+                    verdict["status"] = "regression"
+                    verdict["reason"] = reason
+                elif shape_changed:
+                    verdict["status"] = "plan_changed"
+                else:
+                    verdict["status"] = "same"
+                verdict["baseline"] = _public(baseline)
+                if shape_changed or reason:
+                    verdict["diff"] = list(
+                        difflib.unified_diff(
+                            baseline["outline"],
+                            entry["outline"],
+                            "last_good",
+                            "current",
+                            lineterm="",
+                        )
+                    )
+            history.append(entry)
+
+        if verdict["status"] in ("regression", "plan_changed"):
+            logger.warning(
+                f"План запроса {key} изменился ({verdict['status']}): "
+                f"{verdict.get('reason', 'другая форма плана')}"
+            )
+        return verdict
+
+    def entries(self, key: Hashable) -> List[dict]:
+        with self._lock:
+            return [_public(e) for e in self._data.get(key, ())]
+
+
+def _public(entry: dict) -> dict:
+    return {k: v for k, v in entry.items() if k != "outline"}
+
+
+plan_history = PlanHistory()
@@ -1,154 +1,285 @@
-import re
+from collections import Counter
+from typing import List
 
+from app.sql_lexer import (
+    KEYWORD,
+    OPERATOR,
+    STRING,
+    Scope,
+    split_scopes,
+    string_value,
+    tokenize,
+)
 
-def _remove_comments_and_literals(sql: str) -> str:
-    # Remove single-line and multi-line comments
-    sql = re.sub(r"--.*?$", " ", sql, flags=re.MULTILINE)
-    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
-    # Replace string literals with empty quotes to avoid false positives inside them
-    sql = re.sub(r"'(?:''|[^'])*'", "''", sql, flags=re.DOTALL)  # single quotes
-    sql = re.sub(r'"(?:\\"|[^"])*"', '""', sql, flags=re.DOTALL)  # double quotes
-    return sql
+# Каждое правило — функция над разобранным запросом, возвращающая список
+# рекомендаций. Текст запроса сканируется один раз (tokenize), дальше
+# правила работают только с токенами, поэтому стоимость линейна по длине
+# запроса, а условия подзапросов не смешиваются с условиями внешнего блока.
 
 
-def _extract_between(sql: str, start_kw: str, stop_kws: list):
-    # extract text starting after start_kw up to the nearest stop keyword or end
-    pattern = (
-        r"\b"
-        + re.escape(start_kw)
-        + r"\b(.*?)(?:\b(?:"
-        + "|".join(map(re.escape, stop_kws))
-        + r")\b|$)"
-    )
-    m = re.search(pattern, sql, flags=re.DOTALL)
-    return m.group(1).strip() if m else ""
+class ParsedSql:
+    def __init__(self, sql: str):
+        self.tokens = tokenize(sql)
+        self.scopes: List[Scope] = split_scopes(self.tokens)
+        self.root = self.scopes[0]
+        # позиции "(" открывающих подзапросы: IN (SELECT ...), EXISTS (SELECT ...)
+        self.subquery_opens = {s.open_pos for s in self.scopes[1:]}
+        self.keyword_counts = Counter(t.value for t in self.tokens if t.kind == KEYWORD)
 
+    def count(self, keyword: str) -> int:
+        return self.keyword_counts.get(keyword, 0)
 
-def analyze_sql(sql_query: str):
-    original = sql_query
-    sql = sql_query.lower()
-    sql_clean = _remove_comments_and_literals(sql)
-    recommendations = []
+    def statement_kind(self) -> str:
+        for kind in ("insert", "update", "delete"):
+            if self.root.has(kind):
+                return kind
+        if self.root.has("select") or self.root.has("set_op"):
+            return "select"
+        return "other"
 
-    # ---------- helper flags ----------
-    has_select = bool(re.search(r"\bselect\b", sql_clean))
-    has_limit = bool(re.search(r"\blimit\b", sql_clean))
-    has_order_by = bool(re.search(r"\border\s+by\b", sql_clean))
-    has_group_by = bool(re.search(r"\bgroup\s+by\b", sql_clean))
-    has_having = bool(re.search(r"\bhaving\b", sql_clean))
-    # count unions (word boundary)
-    union_count = len(re.findall(r"\bunion\b", sql_clean))
-
-    # ---------- 1. SELECT ----------
-    if re.search(r"\bselect\s*\*\b", sql_clean):
-        recommendations.append("❌ Используется SELECT * — выбирай только нужные поля.")
-
-    if re.search(r"\bselect\b[\s\S]*?\(\s*select\b", sql_clean):
-        recommendations.append(
-            "⚠️ Подзапрос в SELECT — лучше переписать через JOIN/CTE."
+    def followed_by_subquery(self, items, i: int) -> bool:
+        """items[i + 1] — "(" подзапроса."""
+        return (
+            i + 1 < len(items)
+            and items[i + 1].token.value == "("
+            and items[i + 1].token.pos in self.subquery_opens
         )
 
-    # ---------- 2. LIMIT ----------
-    if has_select and not has_limit:
-        recommendations.append(
-            "⚠️ Нет LIMIT — если не нужны все строки, лучше ограничить выборку."
+
+def _values(items):
+    return [it.token.value for it in items]
+
+
+# ---------- 1. SELECT ----------
+def _rule_select_star(sql: ParsedSql):
+    for scope in sql.scopes:
+        prev = None
+        for it in scope.items:
+            tok = it.token
+            if (
+                it.direct
+                and it.clause == "select"
+                and tok.kind == OPERATOR
+                and tok.value == "*"
+                and prev in ("select", "distinct", "all", ",")
+            ):
+                return ["❌ Используется SELECT * — выбирай только нужные поля."]
+            if it.direct:
+                prev = tok.value
+    return []
+
+
+def _rule_select_subquery(sql: ParsedSql):
+    if any(s.parent_clause == "select" for s in sql.scopes[1:]):
+        return ["⚠️ Подзапрос в SELECT — лучше переписать через JOIN/CTE."]
+    return []
+
+
+# ---------- 2. LIMIT ----------
+def _rule_no_limit(sql: ParsedSql):
+    if sql.statement_kind() == "select" and not sql.root.has("limit"):
+        return ["⚠️ Нет LIMIT — если не нужны все строки, лучше ограничить выборку."]
+    return []
+
+
+# ---------- 3. WHERE ----------
+def _where_items(sql: ParsedSql):
+    for scope in sql.scopes:
+        items = [it for it in scope.items if it.clause == "where"]
+        if items:
+            yield items
+
+
+def _rule_where(sql: ParsedSql):
+    found = set()
+    for items in _where_items(sql):
+        values = _values(items)
+        for i, value in enumerate(values):
+            nxt = values[i + 1] if i + 1 < len(values) else None
+            if value in ("date", "lower", "upper", "cast") and nxt == "(":
+                found.add("function")
+            elif value == "or" and items[i].token.kind == KEYWORD:
+                found.add("or")
+            elif value == "between":
+                found.add("between")
+            elif value in ("like", "ilike") and nxt is not None:
+                tok = items[i + 1].token
+                if tok.kind == STRING and string_value(tok).startswith("%"):
+                    found.add("like")
+            elif value == "in" and sql.followed_by_subquery(items, i):
+                found.add("in_subquery")
+
+    recs = []
+    if "function" in found:
+        recs.append(
+            "❌ В WHERE используется функция на поле — индекс не будет работать."
+        )
+    if "or" in found:
+        recs.append(
+            "⚠️ Используется OR в WHERE — может плохо работать с индексами; подумай о UNION/IN/EXISTS или выражениях по индексируемым полям."
+        )
+    if "between" in found:
+        recs.append(
+            "⚠️ Используется BETWEEN — иногда лучше заменить на >= и < для полуоткрытых интервалов."
         )
+    if "like" in found:
+        recs.append(
+            "⚠️ LIKE/ILIKE с ведущим % — индекс не будет использоваться; рассмотрите trigram/GIN или полнотекстовый поиск."
+        )
+    if "in_subquery" in found:
+        recs.append(
+            "⚠️ Используется IN (subquery) — лучше заменить на EXISTS для большей эффективности при больших наборах."
+        )
+    return recs
 
-    # ---------- 3. WHERE ----------
-    where_text = _extract_between(
-        sql_clean,
-        "where",
-        ["group by", "order by", "limit", "offset", "having", "union"],
-    )
-    if where_text:
-        if re.search(r"\b(date|lower|upper|cast)\s*\(", where_text):
-            recommendations.append(
-                "❌ В WHERE используется функция на поле — индекс не будет работать."
-            )
-        if re.search(r"\bor\b", where_text):
-            recommendations.append(
-                "⚠️ Используется OR в WHERE — может плохо работать с индексами; подумай о UNION/IN/EXISTS или выражениях по индексируемым полям."
-            )
-        if re.search(r"\bbetween\b", where_text):
-            recommendations.append(
-                "⚠️ Используется BETWEEN — иногда лучше заменить на >= и < для полуоткрытых интервалов."
-            )
-        if re.search(r"\b(?:like|ilike)\s*'%", where_text):
-            recommendations.append(
-                "⚠️ LIKE/ILIKE с ведущим % — индекс не будет использоваться; рассмотрите trigram/GIN или полнотекстовый поиск."
-            )
-        if re.search(r"\bin\s*\(\s*select\b", where_text):
-            recommendations.append(
-                "⚠️ Используется IN (subquery) — лучше заменить на EXISTS для большей эффективности при больших наборах."
-            )
 
-    # ---------- 4. JOIN ----------
-    join_count = len(re.findall(r"\bjoin\b", sql_clean))
-    if join_count > 0:
-        if re.search(r"\bleft\s+join\b", sql_clean):
-            recommendations.append(
+# ---------- 4. JOIN ----------
+def _rule_join(sql: ParsedSql):
+    join_count = sql.count("join")
+    if join_count == 0:
+        return []
+
+    recs = []
+    values = [t.value for t in sql.tokens]
+    for i, value in enumerate(values):
+        if value == "left" and (
+            values[i + 1 : i + 2] == ["join"]
+            or values[i + 1 : i + 3] == ["outer", "join"]
+        ):
+            recs.append(
                 "⚠️ Используется LEFT JOIN — проверь, нужен ли именно он, а не INNER JOIN."
             )
-        # Check each JOIN fragment for ON/USING
-        join_positions = [m.start() for m in re.finditer(r"\bjoin\b", sql_clean)]
-        for pos in join_positions:
-            tail_match = re.search(
-                r"\b(join|where|group by|order by|limit|offset|having|union)\b",
-                sql_clean[pos + 4 :],
-            )
-            if tail_match:
-                end_idx = pos + 4 + tail_match.start()
-            else:
-                end_idx = len(sql_clean)
-            fragment = sql_clean[pos:end_idx]
-            if " on " not in fragment and " using " not in fragment:
-                recommendations.append(
+            break
+
+    # Каждый JOIN блока должен иметь ON/USING до следующего JOIN или предложения
+    for scope in sql.scopes:
+        direct = [it for it in scope.items if it.direct]
+        for i, it in enumerate(direct):
+            if it.token.value != "join" or it.token.kind != KEYWORD:
+                continue
+            if i and direct[i - 1].token.value == "natural":
+                continue
+            # идём только до следующего JOIN — суммарно проход линейный
+            has_condition = False
+            for j in range(i + 1, len(direct)):
+                nxt = direct[j]
+                if nxt.token.value == "join" or nxt.clause != it.clause:
+                    break
+                if nxt.token.value in ("on", "using"):
+                    has_condition = True
+                    break
+            if not has_condition:
+                recs.append(
                     "❌ JOIN без условия ON/USING — может вызвать декартово произведение."
                 )
-        if join_count > 4:
-            recommendations.append(
-                f"⚠️ Очень много JOIN ({join_count}) — стоит проверить необходимость и наличие индексов на полях соединения."
-            )
 
-    # ---------- 5. IN vs EXISTS (global fallback) ----------
-    if re.search(r"\bin\s*\(\s*select\b", sql_clean) and "where" in sql_clean:
-        recommendations.append(
-            "⚠️ Используется IN (subquery) — для больших подзапросов EXISTS обычно эффективнее."
+    if join_count > 4:
+        recs.append(
+            f"⚠️ Очень много JOIN ({join_count}) — стоит проверить необходимость и наличие индексов на полях соединения."
         )
+    return recs
 
-    # ---------- 6. UNION ----------
-    if re.search(r"\bunion\b(?!\s+all)", sql_clean):
-        recommendations.append(
-            "⚠️ Используется UNION — если дубликаты не нужны, лучше UNION ALL (быстрее)."
-        )
-    if union_count > 1:
-        recommendations.append(
+
+# ---------- 5. IN vs EXISTS (global fallback) ----------
+def _rule_in_subquery(sql: ParsedSql):
+    if not sql.count("where"):
+        return []
+    for scope in sql.scopes:
+        items = scope.items
+        for i, it in enumerate(items):
+            if it.token.value == "in" and sql.followed_by_subquery(items, i):
+                return [
+                    "⚠️ Используется IN (subquery) — для больших подзапросов EXISTS обычно эффективнее."
+                ]
+    return []
+
+
+# ---------- 6. UNION ----------
+def _rule_union(sql: ParsedSql):
+    recs = []
+    values = [t.value for t in sql.tokens]
+    for i, value in enumerate(values):
+        if value == "union" and values[i + 1 : i + 2] != ["all"]:
+            recs.append(
+                "⚠️ Используется UNION — если дубликаты не нужны, лучше UNION ALL (быстрее)."
+            )
+            break
+    if sql.count("union") > 1:
+        recs.append(
             "⚠️ Много UNION подряд — возможно, стоит использовать временные таблицы или CTE."
         )
+    return recs
 
-    # ---------- 7. ORDER BY ----------
-    if has_order_by and not has_limit:
-        recommendations.append(
+
+# ---------- 7. ORDER BY ----------
+def _limited(scope: Scope) -> bool:
+    """LIMIT в самом блоке или во внешнем: FROM (SELECT ... ORDER BY x) s LIMIT 10."""
+    while scope is not None:
+        if scope.has("limit"):
+            return True
+        scope = scope.parent
+    return False
+
+
+def _rule_order_without_limit(sql: ParsedSql):
+    if any(s.has("order_by") and not _limited(s) for s in sql.scopes):
+        return [
             "⚠️ ORDER BY без LIMIT — сортировка может быть очень тяжёлой; подумай о ограничении или индексах, покрывающих ORDER BY."
-        )
+        ]
+    return []
 
-    # ---------- 8. HAVING ----------
-    if has_having and not has_group_by:
-        recommendations.append(
-            "❌ HAVING без GROUP BY — условие лучше перенести в WHERE."
-        )
 
-    # ---------- 9. COUNT(*) ----------
-    if re.search(r"\bcount\s*\(\s*\*\s*\)\b", sql_clean) and "where" not in sql_clean:
-        recommendations.append(
-            "⚠️ COUNT(*) без WHERE — может быть очень тяжёлым на больших таблицах; возможно нужен материализованный подсчёт или индекс."
-        )
+# ---------- 8. HAVING ----------
+def _rule_having_without_group(sql: ParsedSql):
+    if any(s.has("having") and not s.has("group_by") for s in sql.scopes):
+        return ["❌ HAVING без GROUP BY — условие лучше перенести в WHERE."]
+    return []
 
-    # ---------- 10. OFFSET ----------
-    if re.search(r"\boffset\b", sql_clean):
-        recommendations.append(
+
+# ---------- 9. COUNT(*) ----------
+def _rule_count_star(sql: ParsedSql):
+    # только список выборки: count(*) в HAVING или с GROUP BY — не подсчёт всей таблицы
+    for scope in sql.scopes:
+        if scope.has("where") or scope.has("group_by"):
+            continue
+        values = _values(it for it in scope.items if it.clause == "select")
+        for i in range(len(values) - 3):
+            if values[i : i + 4] == ["count", "(", "*", ")"]:
+                return [
+                    "⚠️ COUNT(*) без WHERE — может быть очень тяжёлым на больших таблицах; возможно нужен материализованный подсчёт или индекс."
+                ]
+    return []
+
+
+# ---------- 10. OFFSET ----------
+def _rule_offset(sql: ParsedSql):
+    if sql.count("offset"):
+        return [
             "⚠️ Используется OFFSET — для больших смещений лучше keyset pagination (WHERE id > ?) или seek-pagination."
-        )
+        ]
+    return []
+
+
+RULES = [
+    _rule_select_star,
+    _rule_select_subquery,
+    _rule_no_limit,
+    _rule_where,
+    _rule_join,
+    _rule_in_subquery,
+    _rule_union,
+    _rule_order_without_limit,
+    _rule_having_without_group,
+    _rule_count_star,
+    _rule_offset,
+]
+
+
+def analyze_sql(sql_query: str):
+    sql = ParsedSql(sql_query)
+    recommendations = []
+    for rule in RULES:
+        recommendations.extend(rule(sql))
 
     if not recommendations:
         return ["✅ Запрос выглядит нормально."]
@@ -161,7 +292,10 @@ def analyze_sql(sql_query: str):
             seen.add(r)
             uniq.append(r)
     return uniq
-sql_query = """ SELECT DISTINCT (SELECT COUNT(*) FROM orders o WHERE o.user_id = u.id) as cnt FROM users u LEFT JOIN departments d ON u.department_id = d.department_id JOIN logs l ON u.id = l.user_id WHERE DATE(u.created_at) = '2020-01-01' OR u.status = 'active' ORDER BY u.name OFFSET 10000; """
-results = analyze_sql(sql_query)
-for r in results:
-    print(r)
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    sql_query = """ SELECT DISTINCT (SELECT COUNT(*) FROM orders o WHERE o.user_id = u.id) as cnt FROM users u LEFT JOIN departments d ON u.department_id = d.department_id JOIN logs l ON u.id = l.user_id WHERE DATE(u.created_at) = '2020-01-01' OR u.status = 'active' ORDER BY u.name OFFSET 10000; """
+    results = analyze_sql(sql_query)
+    for r in results:
+        print(r)
@@ -0,0 +1,238 @@
+# sql_lexer.py
+import re
+from typing import List, NamedTuple, Optional
+
+# --- Виды токенов ---
+KEYWORD = "keyword"
+IDENT = "ident"
+QUOTED_IDENT = "quoted_ident"
+STRING = "string"
+NUMBER = "number"
+PARAM = "param"
+OPERATOR = "operator"
+PUNCT = "punct"
+COMMENT = "comment"
+
+KEYWORDS = frozenset(
+    """
+    all and any as asc between by case cast cross delete desc distinct else end
+    except exists fetch filter first from full group having ilike in inner insert
+    intersect into is join lateral left like limit natural not null nulls offset
+    on or order outer over partition returning right select set similar then
+    union update using values when where window with
+    """.split()
+)
+
+# Одно регулярное выражение на весь лексер. Каждая альтернатива якорная и
+# без вложенных квантификаторов, поэтому разбор идёт за один линейный проход.
+# Пробелы съедаются префиксом \s*, а не отдельными совпадениями; самые частые
+# токены (слова, запятые, скобки, числа) проверяются первыми.
+_TOKEN_RE = re.compile(
+    r"""
+    \s*
+    (?:
+      (?P<estring>[eE]'(?:[^'\\]|\\.|'')*(?:'|\Z))
+    | (?P<word>[^\W\d][\w$]*)
+    | (?P<punct>[,;\[\]]|\.(?!\d))
+    | (?P<open>\()
+    | (?P<close>\))
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<string>'(?:[^']|'')*(?:'|\Z)
+        |\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?(?:\$(?P=tag)\$|\Z))
+    | (?P<quoted>"(?:[^"]|"")*(?:"|\Z))
+    | (?P<param>\$\d+|%\(\w+\)s|%s|\?)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<operator>::|[-+*/<>=~!@#%^&|`]+)
+    | \Z
+    | (?P<other>.)
+    )
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_GROUP = _TOKEN_RE.groupindex
+_WORD, _OPEN, _CLOSE, _COMMENT = (
+    _GROUP["word"],
+    _GROUP["open"],
+    _GROUP["close"],
+    _GROUP["comment"],
+)
+# номер группы -> вид токена (для всех остальных групп)
+_KIND_BY_INDEX = {
+    _GROUP["string"]: STRING,
+    _GROUP["estring"]: STRING,
+    _GROUP["quoted"]: QUOTED_IDENT,
+    _GROUP["param"]: PARAM,
+    _GROUP["number"]: NUMBER,
+    _GROUP["punct"]: PUNCT,
+    _GROUP["operator"]: OPERATOR,
+    _GROUP["other"]: OPERATOR,
+}
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str  # ключевые слова и идентификаторы — в нижнем регистре
+    pos: int  # смещение в исходном тексте
+    depth: int  # глубина скобок (для "(" и ")" — глубина снаружи)
+
+
+def tokenize(sql: str, keep_comments: bool = False) -> List[Token]:
+    """Разбивает SQL на токены за один проход."""
+    tokens: List[Token] = []
+    append = tokens.append
+    new = tuple.__new__  # без накладных расходов NamedTuple.__new__
+    keywords = KEYWORDS
+    kinds = _KIND_BY_INDEX
+    depth = 0
+    for m in _TOKEN_RE.finditer(sql):
+        idx = m.lastindex
+        if idx is None:
+            continue  # хвостовые пробелы
+        pos, end = m.span(idx)
+        if idx == _WORD:
+            value = sql[pos:end].lower()
+            kind = KEYWORD if value in keywords else IDENT
+            append(new(Token, (kind, value, pos, depth)))
+        elif idx == _OPEN:
+            append(new(Token, (PUNCT, "(", pos, depth)))
+            depth += 1
+        elif idx == _CLOSE:
+            if depth:
+                depth -= 1
+            append(new(Token, (PUNCT, ")", pos, depth)))
+        elif idx == _COMMENT:
+            if keep_comments:
+                append(new(Token, (COMMENT, sql[pos:end], pos, depth)))
+        else:
+            append(new(Token, (kinds[idx], sql[pos:end], pos, depth)))
+    return tokens
+
+
+def string_value(token: Token) -> str:
+    """Содержимое строкового литерала без кавычек."""
+    text = token.value
+    if text.startswith("$"):
+        tag_end = text.index("$", 1) + 1
+        return text[tag_end:-tag_end] if text.endswith(text[:tag_end]) else ""
+    if text[:1] in "eE":
+        text = text[1:]
+    return text[1:-1] if len(text) >= 2 and text.endswith("'") else text[1:]
+
+
+# --- Разбор на блоки запроса (scope) и предложения (clause) ---
+
+# ключевое слово -> предложение, которое оно открывает
+_CLAUSE_STARTS = {
+    "select": "select",
+    "from": "from",
+    "where": "where",
+    "having": "having",
+    "window": "window",
+    "limit": "limit",
+    "offset": "offset",
+    "fetch": "limit",
+    "returning": "returning",
+    "values": "values",
+    "set": "set",
+    "union": "set_op",
+    "intersect": "set_op",
+    "except": "set_op",
+    "with": "with",
+    "insert": "insert",
+    "update": "update",
+    "delete": "delete",
+}
+# после "group"/"order" должно идти "by"
+_CLAUSE_BY = {"group": "group_by", "order": "order_by"}
+# что открывает подзапрос сразу после "("
+_QUERY_STARTERS = frozenset(("select", "with", "values"))
+
+
+class Item(NamedTuple):
+    token: Token
+    clause: str  # предложение блока, в котором стоит токен
+    direct: bool  # True — токен на уровне блока, а не внутри f(...) / (a OR b)
+
+
+class Scope:
+    """Один блок запроса: весь запрос верхнего уровня или подзапрос в скобках."""
+
+    def __init__(self, scope_id: int, parent: Optional["Scope"], clause: str):
+        self.id = scope_id
+        self.parent = parent
+        self.parent_clause = clause  # в каком предложении родителя стоит подзапрос
+        self.open_pos = -1  # позиция открывающей скобки подзапроса
+        self.items: List[Item] = []
+        self.clauses = set()
+
+    def has(self, clause: str) -> bool:
+        return clause in self.clauses
+
+
+def split_scopes(tokens: List[Token]) -> List[Scope]:
+    """
+    Раскладывает токены по блокам запроса. Скобка, за которой идёт
+    SELECT/WITH/VALUES, открывает новый блок; прочие скобки (вызовы функций,
+    группировка условий, OVER (...)) остаются в текущем блоке и не меняют
+    его предложение.
+    """
+    root = Scope(0, None, "")
+    scopes = [root]
+    # кадр стека: [scope, блок_запроса?, текущее_предложение, ближайший_кадр_блока]
+    root_frame = [root, True, "", None]
+    root_frame[3] = root_frame
+    stack = [root_frame]
+    new = tuple.__new__
+    frame = root_frame
+    items = root.items
+    for i, tok in enumerate(tokens):
+        kind, value = tok[0], tok[1]
+
+        if kind == PUNCT and value == "(":
+            query_frame = frame[3]
+            items.append(new(Item, (tok, query_frame[2], frame[1])))
+            nxt = _next_significant(tokens, i + 1)
+            if nxt is not None and nxt.kind == KEYWORD and nxt.value in _QUERY_STARTERS:
+                child = Scope(len(scopes), frame[0], query_frame[2])
+                child.open_pos = tok.pos
+                scopes.append(child)
+                frame = [child, True, "", None]
+                frame[3] = frame
+                items = child.items
+            else:
+                frame = [frame[0], False, "", query_frame]
+            stack.append(frame)
+            continue
+
+        if kind == PUNCT and value == ")":
+            if len(stack) > 1:
+                stack.pop()
+            frame = stack[-1]
+            items = frame[0].items
+            items.append(new(Item, (tok, frame[3][2], frame[1])))
+            continue
+
+        if kind == KEYWORD and frame[1]:
+            clause = None
+            if value in _CLAUSE_STARTS:
+                # "a IS DISTINCT FROM b" — это не начало FROM
+                if not (value == "from" and i and tokens[i - 1].value == "distinct"):
+                    clause = _CLAUSE_STARTS[value]
+            elif value in _CLAUSE_BY:
+                nxt = _next_significant(tokens, i + 1)
+                if nxt is not None and nxt.value == "by":
+                    clause = _CLAUSE_BY[value]
+            if clause is not None:
+                frame[2] = clause
+                frame[0].clauses.add(clause)
+
+        items.append(new(Item, (tok, frame[3][2], frame[1])))
+    return scopes
+
+
+def _next_significant(tokens: List[Token], start: int) -> Optional[Token]:
+    for j in range(start, len(tokens)):
+        if tokens[j].kind != COMMENT:
+            return tokens[j]
+    return None
@@ -1,18 +1,55 @@
-from psycopg import rows
 import json
+import math
+from typing import Dict, List, Optional
+
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.index_recommend import pretty_size
+from app.sql_lexer import IDENT, KEYWORD, tokenize
+
+# --- Параметры анализа autovacuum ---
+AUTOVACUUM_MIN_ROWS = 1_000  # мелкие таблицы autovacuum и так обрабатывает вовремя
+AUTOVACUUM_TARGET_DEAD_FRACTION = 0.05  # сколько мёртвых строк терпим в горячей таблице
+AUTOVACUUM_MIN_INTERVAL_MIN = 10  # чаще этого пересобирать таблицу нет смысла
+AUTOVACUUM_LARGE_TABLE_ROWS = 1_000_000  # дальше — scale_factor=0 и фиксированный порог
+AUTOVACUUM_MIN_SCALE_FACTOR = 0.01
+AUTOVACUUM_MIN_THRESHOLD = 50  # как autovacuum_vacuum_threshold по умолчанию
+AUTOVACUUM_RETUNE_FACTOR = 2.0  # текущий порог должен быть во столько раз хуже
+AUTOVACUUM_LAG_FACTOR = 2.0  # мёртвых строк во столько раз больше порога — отстаёт
+BLOAT_TOP_TABLES = 10
+
+_STATEMENT_TYPES = ("select", "insert", "update", "delete", "merge")
+_WRITE_TYPES = ("insert", "update", "delete", "merge")
 
 
 def detect_query_type(query: str) -> str:
-    q = query.strip().upper()
-    if q.startswith("SELECT"):
-        return "SELECT"
-    elif q.startswith("INSERT"):
-        return "INSERT"
-    elif q.startswith("UPDATE"):
-        return "UPDATE"
-    elif q.startswith("DELETE"):
-        return "DELETE"
-    return "OTHER"
+    """
+    Тип запроса по первому ключевому слову с наименьшей глубиной скобок:
+    комментарии, обёртка в скобки и WITH пропускаются. SELECT с изменяющим
+    CTE (WITH d AS (DELETE ...) SELECT ...) считается по этому CTE.
+    """
+    tokens = tokenize(query)
+    starts = [
+        t for t in tokens if t.kind in (KEYWORD, IDENT) and t.value in _STATEMENT_TYPES
+    ]
+    if not starts:
+        return "OTHER"
+    top = min(t.depth for t in starts)
+    main = next(t.value for t in starts if t.depth == top)
+    if main == "select" and tokens[0].value == "with":
+        # тело CTE начинается сразу после "(": так FOR UPDATE не спутать с UPDATE
+        cte_write = next(
+            (
+                t.value
+                for prev, t in zip(tokens, tokens[1:])
+                if prev.value == "(" and t.value in _WRITE_TYPES
+            ),
+            None,
+        )
+        if cte_write:
+            main = cte_write
+    return main.upper()
 
 
 def aggregate_query_stats(stats):
@@ -34,62 +71,232 @@ def aggregate_query_stats(stats):
     return agg
 
 
-def generate_autovacuum_recommendations(agg):
-    recs = []
-    total_calls = sum(v["calls"] for v in agg.values()) or 1
+# --- Таблицы: мёртвые строки и пороги autovacuum ---
+AUTOVACUUM_SETTINGS = (
+    "autovacuum",
+    "autovacuum_vacuum_scale_factor",
+    "autovacuum_vacuum_threshold",
+)
+
+_SETTINGS_SQL = """
+SELECT name, setting FROM pg_settings
+WHERE name = ANY(%s)
+"""
+
+_TABLES_SQL = """
+SELECT format('%I.%I', s.schemaname, s.relname) AS table_name,
+       s.n_live_tup, s.n_dead_tup, s.n_mod_since_analyze,
+       s.n_tup_ins, s.n_tup_upd, s.n_tup_del,
+       s.last_autovacuum, s.last_vacuum, s.last_autoanalyze,
+       s.autovacuum_count,
+       c.reltuples, c.reloptions,
+       pg_table_size(s.relid) AS table_bytes,
+       extract(epoch FROM now() - coalesce(
+         (SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()),
+         pg_postmaster_start_time()
+       )) AS stats_age_s
+FROM pg_stat_user_tables s
+JOIN pg_class c ON c.oid = s.relid
+WHERE c.relkind IN ('r', 'm', 't')  -- у секционированного родителя нет своих данных
+"""
+
+
+def _reloption(reloptions, name: str) -> Optional[str]:
+    for opt in reloptions or []:
+        key, _, value = opt.partition("=")
+        if key == name:
+            return value
+    return None
+
+
+def _round_threshold(value: float) -> int:
+    # 12345 -> 13000: порог в ALTER TABLE не должен выглядеть "вычисленным до строки"
+    step = 10 ** max(int(math.log10(max(value, 1))) - 1, 0)
+    return int(math.ceil(value / step) * step)
+
+
+def _hours(trigger: float, churn_per_hour: float) -> Optional[float]:
+    return round(trigger / churn_per_hour, 1) if churn_per_hour else None
+
+
+def analyze_table_vacuum(table: dict, settings: Dict[str, str]) -> dict:
+    """
+    Метрики одной таблицы и, если нужно, новые пороги autovacuum.
+    Скорость изменений (churn) — UPDATE+DELETE в час с момента сброса
+    статистики: каждая такая строка оставляет мёртвую версию.
+    Целевой порог — AUTOVACUUM_TARGET_DEAD_FRACTION строк таблицы, но не
+    чаще одного прохода в AUTOVACUUM_MIN_INTERVAL_MIN минут.
+    """
+    live = int(table["n_live_tup"] or 0)
+    dead = int(table["n_dead_tup"] or 0)
+    rows_ = max(float(table["reltuples"] or 0), float(live))  # reltuples=-1 до ANALYZE
+    hours = max(float(table["stats_age_s"] or 0) / 3600, 1 / 60)
+    churn_per_hour = (
+        int(table["n_tup_upd"] or 0) + int(table["n_tup_del"] or 0)
+    ) / hours
 
-    # 1. много UPDATE/DELETE → уменьшить vacuum_scale_factor
-    upd_del_calls = agg.get("UPDATE", {}).get("calls", 0) + agg.get("DELETE", {}).get(
-        "calls", 0
+    scale = float(
+        _reloption(table["reloptions"], "autovacuum_vacuum_scale_factor")
+        or settings["autovacuum_vacuum_scale_factor"]
     )
-    upd_del_ratio = upd_del_calls / total_calls
-    if upd_del_ratio > 0.2:
-        recs.append(
-            "Обнаружено много UPDATE/DELETE — рекомендуется снизить "
-            "autovacuum_vacuum_scale_factor до 0.01–0.05 для горячих таблиц."
-        )
+    threshold = float(
+        _reloption(table["reloptions"], "autovacuum_vacuum_threshold")
+        or settings["autovacuum_vacuum_threshold"]
+    )
+    trigger = threshold + scale * rows_
+    dead_fraction = dead / (live + dead) if live + dead else 0.0
+
+    result = {
+        "table": table["table_name"],
+        "rows": int(rows_),
+        "size": pretty_size(table["table_bytes"]),
+        "n_dead_tup": dead,
+        "dead_fraction": round(dead_fraction, 4),
+        "dead_bytes_estimate": int(table["table_bytes"] * dead_fraction),
+        "n_mod_since_analyze": table["n_mod_since_analyze"],
+        "churn_per_hour": round(churn_per_hour, 1),
+        "last_autovacuum": str(table["last_autovacuum"] or "") or None,
+        "last_autoanalyze": str(table["last_autoanalyze"] or "") or None,
+        "autovacuum_count": table["autovacuum_count"],
+        "vacuum_trigger": int(trigger),
+        "hours_between_vacuums": _hours(trigger, churn_per_hour),
+        # мёртвых заметно больше порога (небольшое превышение — норма до
+        # следующего autovacuum_naptime): мешают долгие транзакции или не
+        # хватает воркеров / cost_limit
+        "vacuum_lagging": dead > trigger * AUTOVACUUM_LAG_FACTOR
+        and rows_ >= AUTOVACUUM_MIN_ROWS,
+        "recommendation": None,
+    }
+    if rows_ < AUTOVACUUM_MIN_ROWS or churn_per_hour <= 0:
+        return result
+
+    target = max(
+        rows_ * AUTOVACUUM_TARGET_DEAD_FRACTION,
+        churn_per_hour * AUTOVACUUM_MIN_INTERVAL_MIN / 60,
+        AUTOVACUUM_MIN_THRESHOLD,
+    )
+    if trigger < target * AUTOVACUUM_RETUNE_FACTOR:
+        return result
+
+    if rows_ >= AUTOVACUUM_LARGE_TABLE_ROWS:
+        # на больших таблицах доля даёт миллионы мёртвых строк — только порог
+        new_scale, new_threshold = 0.0, _round_threshold(target)
+    else:
+        new_scale = max(round(target / rows_, 3), AUTOVACUUM_MIN_SCALE_FACTOR)
+        new_threshold = AUTOVACUUM_MIN_THRESHOLD
+    new_trigger = new_threshold + new_scale * rows_
+    result["recommendation"] = {
+        "autovacuum_vacuum_scale_factor": new_scale,
+        "autovacuum_vacuum_threshold": new_threshold,
+        "vacuum_trigger": int(new_trigger),
+        "hours_between_vacuums": _hours(new_trigger, churn_per_hour),
+        "statement": (
+            f"ALTER TABLE {table['table_name']} SET ("
+            f"autovacuum_vacuum_scale_factor = {new_scale:g}, "
+            f"autovacuum_vacuum_threshold = {new_threshold});"
+        ),
+    }
+    return result
+
 
-    # 2. много INSERT → уменьшить analyze_scale_factor
-    insert_ratio = agg.get("INSERT", {}).get("calls", 0) / total_calls
-    if insert_ratio > 0.2:
+def bloat_ranking(tables: List[dict], top: int = BLOAT_TOP_TABLES) -> List[dict]:
+    """Таблицы с наибольшим объёмом мёртвых строк (оценка по доле n_dead_tup)."""
+    ranked = sorted(
+        (t for t in tables if t["n_dead_tup"]),
+        key=lambda t: (-t["dead_bytes_estimate"], -t["dead_fraction"]),
+    )
+    return [
+        {
+            "table": t["table"],
+            "dead_bytes_estimate": t["dead_bytes_estimate"],
+            "dead": pretty_size(t["dead_bytes_estimate"]),
+            "dead_fraction": t["dead_fraction"],
+            "last_autovacuum": t["last_autovacuum"],
+            "vacuum_lagging": t["vacuum_lagging"],
+        }
+        for t in ranked[:top]
+    ]
+
+
+def generate_autovacuum_recommendations(tables: List[dict], settings: Dict[str, str]):
+    recs = []
+    if settings.get("autovacuum") == "off":
         recs.append(
-            "Обнаружено много INSERT — рекомендуется снизить autovacuum_analyze_scale_factor "
-            "до 0.05 для поддержания актуальной статистики."
+            "❌ autovacuum выключен — мёртвые строки не убираются, "
+            "а счётчик транзакций не замораживается. Включите autovacuum = on."
         )
 
-    # 3. SELECT медленные → возможно bloat
-    if "SELECT" in agg and agg["SELECT"]["avg_exec_time"] > 10:
+    for t in sorted(tables, key=lambda t: -t["churn_per_hour"]):
+        rec = t["recommendation"]
+        if rec is None:
+            continue
         recs.append(
-            f"Среднее время SELECT={agg['SELECT']['avg_exec_time']:.2f} мс — возможно, "
-            "таблицы раздулись (bloat). Рекомендуется чаще запускать autovacuum."
+            f"{rec['statement']}  -- {t['churn_per_hour']:g} изменённых строк/ч: "
+            f"порог {t['vacuum_trigger']} -> {rec['vacuum_trigger']} мёртвых строк, "
+            f"проход примерно раз в {rec['hours_between_vacuums']} ч "
+            f"вместо {t['hours_between_vacuums']} ч"
         )
 
+    for t in tables:
+        if t["vacuum_lagging"]:
+            recs.append(
+                f"⚠️ {t['table']}: {t['n_dead_tup']} мёртвых строк при пороге "
+                f"{t['vacuum_trigger']} — autovacuum не успевает. Проверьте долгие "
+                "транзакции (pg_stat_activity) и autovacuum_vacuum_cost_limit."
+            )
+
     if not recs:
         recs.append("Autovacuum работает нормально, критичных проблем не обнаружено.")
-
     return recs
 
 
-def analyze_stats(conn):
+def analyze_stats(conn, stats=None):
+    """
+    stats — строки за выбранное окно (см. stats_sampler.window_rows);
+    если не переданы, берём накопленные счётчики pg_stat_statements.
+    Рекомендации по autovacuum строятся по каждой таблице из
+    pg_stat_user_tables (счётчики накоплены с последнего сброса статистики).
+    """
     # Выполним запрос, чтобы получить статистику
     cur = conn.cursor(row_factory=rows.dict_row)
 
-    # Получаем статистику по данному запросу, если это SELECT, INSERT, UPDATE или DELETE
-    cur.execute(
-        """
-        SELECT query, calls, rows, mean_exec_time
-        FROM pg_stat_statements
-        ORDER BY calls DESC
-        LIMIT 100;
-        """
-    )
+    notes = []
+    if stats is None:
+        # Получаем статистику по данному запросу, если это SELECT, INSERT, UPDATE или DELETE
+        columns = get_capabilities(conn)["stat_time_columns"]
+        if columns:
+            cur.execute(
+                f"""
+                SELECT query, calls, rows, {columns[1]} AS mean_exec_time
+                FROM pg_stat_statements
+                ORDER BY calls DESC
+                LIMIT 100;
+                """
+            )
+            stats = cur.fetchall()
+        else:
+            stats = []
+            notes.append(
+                "⚠️ pg_stat_statements не установлен — сводки по запросам нет."
+            )
+    else:
+        stats = stats[:100]
 
-    stats = cur.fetchall()
+    cur.execute(_SETTINGS_SQL, (list(AUTOVACUUM_SETTINGS),))
+    settings = {r["name"]: r["setting"] for r in cur.fetchall()}
+    cur.execute(_TABLES_SQL)
+    tables = [analyze_table_vacuum(t, settings) for t in cur.fetchall()]
 
     agg = aggregate_query_stats(stats)
-    recs = generate_autovacuum_recommendations(agg)
+    recs = generate_autovacuum_recommendations(tables, settings)
 
-    result = {"query_summary": agg, "recommendations": recs}
+    result = {
+        "query_summary": agg,
+        "tables": tables,
+        "bloat_ranking": bloat_ranking(tables),
+        "recommendations": recs,
+        "notes": notes,
+    }
 
     print(json.dumps(result, indent=4, ensure_ascii=False))
     cur.close()
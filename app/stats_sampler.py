@@ -0,0 +1,260 @@
+# stats_sampler.py
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from psycopg import rows
+
+from app.capabilities import get_capabilities
+from app.db_pool import release
+from app.find_N import detect_time_columns
+
+logger = logging.getLogger(__name__)
+
+SAMPLER_INTERVAL = float(os.getenv("STATS_SAMPLER_INTERVAL", "10"))  # сек
+SAMPLER_HISTORY = int(os.getenv("STATS_SAMPLER_HISTORY", "360"))  # интервалов в буфере
+
+StatKey = Tuple[int, int, int]  # (userid, dbid, queryid)
+
+
+class StatementSampler:
+    """
+    Фоновый сэмплер pg_stat_statements.
+
+    Раз в interval секунд снимает счётчики (calls, rows, total time) и кладёт
+    в кольцевой буфер дельты между соседними снимками. Из буфера можно
+    получить "что горячо сейчас" за выбранное окно вместо накопленных с
+    последнего сброса сумм.
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        interval: float = SAMPLER_INTERVAL,
+        capacity: int = SAMPLER_HISTORY,
+        name: str = "",
+    ):
+        self.connect = connect
+        self.interval = interval
+        self.name = name
+        self._intervals = deque(maxlen=capacity)
+        self._texts: Dict[StatKey, str] = {}
+        self._last: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- жизненный цикл ---
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"stats-sampler {self.name}", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Сэмплер pg_stat_statements запущен ({self.name})")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sample_once()
+            except Exception as e:
+                logger.warning(f"Сэмплер {self.name}: снимок не получен: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    # --- снимки ---
+    def _take_snapshot(self, conn) -> dict:
+        with conn.cursor(row_factory=rows.dict_row) as cur:
+            total_col, _ = detect_time_columns(cur)
+
+            stats_reset = None
+            if get_capabilities(conn)["has_stat_statements_info"]:  # PG14+
+                cur.execute("SELECT stats_reset FROM pg_stat_statements_info")
+                row = cur.fetchone()
+                stats_reset = row["stats_reset"] if row else None
+
+            # showtext := false — не тащим тексты запросов на каждом снимке
+            cur.execute(
+                f"""
+                SELECT userid, dbid, queryid, calls, rows,
+                       {total_col} AS total_time_ms
+                FROM pg_stat_statements(false)
+                WHERE queryid IS NOT NULL
+                """
+            )
+            counters = {
+                (r["userid"], r["dbid"], r["queryid"]): (
+                    int(r["calls"]),
+                    int(r["rows"]),
+                    float(r["total_time_ms"]),
+                )
+                for r in cur.fetchall()
+            }
+
+            with self._lock:
+                missing = [k[2] for k in counters if k not in self._texts]
+            if missing:
+                cur.execute(
+                    """
+                    SELECT userid, dbid, queryid, query
+                    FROM pg_stat_statements(true)
+                    WHERE queryid = ANY(%s)
+                    """,
+                    (missing,),
+                )
+                fetched = cur.fetchall()
+                with self._lock:
+                    for r in fetched:
+                        key = (r["userid"], r["dbid"], r["queryid"])
+                        self._texts[key] = r["query"]
+
+        return {"ts": time.time(), "stats_reset": stats_reset, "counters": counters}
+
+    def sample_once(self) -> None:
+        conn = self.connect()
+        try:
+            snapshot = self._take_snapshot(conn)
+        finally:
+            release(conn)
+
+        with self._lock:
+            prev = self._last
+            self._last = snapshot
+            if prev is not None:
+                self._intervals.append(compute_interval(prev, snapshot))
+            self._forget_texts(snapshot)
+
+    def _forget_texts(self, snapshot: dict) -> None:
+        # тексты вытесненных записей больше не нужны, если их нет и в буфере
+        live = set(snapshot["counters"])
+        for interval in self._intervals:
+            live.update(interval["deltas"])
+        for key in list(self._texts):
+            if key not in live:
+                del self._texts[key]
+
+    # --- выборка по окну ---
+    def window_rows(self, window_seconds: float) -> Tuple[List[dict], dict]:
+        """
+        Суммирует дельты за последние window_seconds.
+        Возвращает строки в формате, понятном analyze_stats и
+        analyze_n_plus_one, и описание фактически покрытого окна.
+        """
+        now = time.time()
+        with self._lock:
+            intervals = [i for i in self._intervals if i["end"] >= now - window_seconds]
+            texts = dict(self._texts)
+
+        totals: Dict[StatKey, List[float]] = {}
+        covered = 0.0
+        resets = 0
+        evicted = 0
+        for interval in intervals:
+            covered += interval["end"] - interval["start"]
+            resets += 1 if interval["reset"] else 0
+            evicted += interval["evicted"]
+            for key, (calls, nrows, total_ms) in interval["deltas"].items():
+                acc = totals.setdefault(key, [0, 0, 0.0])
+                acc[0] += calls
+                acc[1] += nrows
+                acc[2] += total_ms
+
+        seconds = covered or 1.0
+        result = []
+        for (userid, dbid, queryid), (calls, nrows, total_ms) in totals.items():
+            mean_ms = total_ms / calls if calls else 0.0
+            result.append(
+                {
+                    "queryid": queryid,
+                    "dbid": dbid,
+                    "userid": userid,
+                    "query": texts.get((userid, dbid, queryid), ""),
+                    "calls": calls,
+                    "rows": nrows,
+                    "total_time_ms": total_ms,
+                    "mean_time_ms": mean_ms,
+                    "mean_exec_time": mean_ms,
+                    "calls_per_s": calls / seconds,
+                    "time_per_s": total_ms / seconds,
+                    "rows_per_s": nrows / seconds,
+                }
+            )
+        result.sort(key=lambda r: -r["calls"])
+
+        info = {
+            "requested_seconds": window_seconds,
+            "covered_seconds": round(covered, 1),
+            "intervals": len(intervals),
+            "stats_resets": resets,
+            "evicted_entries": evicted,
+        }
+        return result, info
+
+
+def compute_interval(prev: dict, cur: dict) -> dict:
+    """
+    Дельты счётчиков между двумя снимками.
+    - глобальный сброс (изменился stats_reset): за интервал берём текущие значения
+    - счётчик уменьшился (запись вытеснена и создана заново или сброшена
+      точечно): тоже берём текущее значение
+    - новая запись: текущее значение
+    - исчезнувшие записи (вытеснены) просто считаем
+    """
+    reset = (
+        prev["stats_reset"] is not None
+        and cur["stats_reset"] is not None
+        and cur["stats_reset"] != prev["stats_reset"]
+    )
+    old = prev["counters"]
+    deltas = {}
+    for key, (calls, nrows, total_ms) in cur["counters"].items():
+        before = None if reset else old.get(key)
+        if before is None or calls < before[0]:
+            d = (calls, nrows, total_ms)
+        else:
+            d = (calls - before[0], nrows - before[1], total_ms - before[2])
+        if d[0] > 0:
+            deltas[key] = d
+
+    evicted = 0 if reset else sum(1 for key in old if key not in cur["counters"])
+    return {
+        "start": prev["ts"],
+        "end": cur["ts"],
+        "reset": reset,
+        "evicted": evicted,
+        "deltas": deltas,
+    }
+
+
+# --- Реестр сэмплеров: один на цель подключения ---
+_samplers: Dict[tuple, StatementSampler] = {}
+_samplers_lock = threading.Lock()
+
+
+def get_sampler(key: tuple, connect: Callable) -> StatementSampler:
+    """Возвращает запущенный сэмплер для цели, создавая его при первом обращении."""
+    with _samplers_lock:
+        sampler = _samplers.get(key)
+        if sampler is None:
+            sampler = StatementSampler(connect, name=f"{key[0]}:{key[1]}/{key[2]}")
+            _samplers[key] = sampler
+    sampler.start()
+    return sampler
+
+
+def stop_all_samplers() -> None:
+    with _samplers_lock:
+        samplers = list(_samplers.values())
+        _samplers.clear()
+    for sampler in samplers:
+        sampler.stop()
@@ -0,0 +1,116 @@
+# targets.py
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARGET = "pagila"
+SESSION_COOKIE = "pg_analyzer_session"
+TARGET_HEADER = "X-Target"  # API-клиенты выбирают цель по имени без cookie
+MAX_SESSIONS = 10_000  # старые сессии вытесняются (LRU)
+
+Target = Tuple[dict, bool]  # (параметры подключения, кастомная ли цель)
+
+
+class TargetRegistry:
+    """
+    Именованные цели подключения и выбор цели для каждой сессии браузера.
+    Встроенные цели (тестовая pagila) нельзя удалить или перезаписать.
+    """
+
+    def __init__(self):
+        self._targets: Dict[str, dict] = {}
+        self._builtin = set()
+        self._sessions: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- цели ---
+    def add(self, name: str, params: dict, builtin: bool = False) -> None:
+        with self._lock:
+            if name in self._builtin and not builtin:
+                raise ValueError(f"Цель {name} встроенная — выберите другое имя")
+            self._targets[name] = dict(params)
+            if builtin:
+                self._builtin.add(name)
+
+    def remove(self, name: str) -> Optional[dict]:
+        with self._lock:
+            if name in self._builtin:
+                raise ValueError(f"Цель {name} встроенная — удалить нельзя")
+            for session, selected in list(self._sessions.items()):
+                if selected == name:
+                    del self._sessions[session]
+            return self._targets.pop(name, None)
+
+    def get(self, name: str) -> Optional[Target]:
+        with self._lock:
+            params = self._targets.get(name)
+            if params is None:
+                return None
+            return dict(params), name not in self._builtin
+
+    def params(self) -> List[dict]:
+        """Параметры всех целей (с паролями) — для общих ресурсов вроде пулов."""
+        with self._lock:
+            return [dict(p) for p in self._targets.values()]
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._targets)
+
+    def describe(self) -> List[dict]:
+        """Список целей без паролей."""
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "host": p["host"],
+                    "port": p["port"],
+                    "dbname": p["dbname"],
+                    "user": p["user"],
+                    "builtin": name in self._builtin,
+                }
+                for name, p in self._targets.items()
+            ]
+
+    # --- сессии ---
+    def select(self, session: str, name: str) -> None:
+        with self._lock:
+            if name not in self._targets:
+                raise KeyError(name)
+            self._sessions[session] = name
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+
+    def selected(self, session: Optional[str]) -> str:
+        with self._lock:
+            name = self._sessions.get(session) if session else None
+            return name if name in self._targets else DEFAULT_TARGET
+
+    def resolve(self, session: Optional[str], name: Optional[str] = None) -> Target:
+        """Цель по явному имени или по выбору сессии (по умолчанию — pagila)."""
+        name = name or self.selected(session)
+        target = self.get(name)
+        if target is None:
+            raise KeyError(name)
+        return target
+
+
+def load_targets_file(registry: TargetRegistry, path: Optional[str], normalize) -> int:
+    """
+    Цели из JSON-файла: [{"name": ..., "host": ..., "port": ...,
+    "dbname": ..., "user": ..., "password": ...}, ...].
+    """
+    if not path:
+        return 0
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    for item in items:
+        item = dict(item)
+        registry.add(item.pop("name"), normalize(item))
+    logger.info(f"Загружено целей из {path}: {len(items)}")
+    return len(items)
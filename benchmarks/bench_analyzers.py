@@ -0,0 +1,297 @@
+"""
+Бенчмарк горячих путей анализаторов с базовой линией.
+
+Для каждой функции на сгенерированном корпусе замеряются время (медиана
+нескольких прогонов) и пик памяти (tracemalloc). Результат сравнивается с
+сохранённой базовой линией; если время или память выросли больше порога,
+скрипт завершается с кодом 1.
+
+Корпус (детерминированный, --seed):
+- oltp     — тысяча коротких OLTP-запросов;
+- orm      — ORM-запрос на ~10k токенов (JOIN-ы и длинный IN-список);
+- nested   — глубоко вложенные подзапросы;
+- snapshot — 100k строк pg_stat_statements;
+- plan     — EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) на 1000 узлов.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_analyzers --save-baseline   # на эталонной ветке
+    python -m benchmarks.bench_analyzers                   # после изменений
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from app.find_N import analyze_n_plus_one, is_n1_like
+from app.fingerprint import fingerprint
+from app.index_recommend import recommend_indexes
+from app.plan_analysis import analyze_plan
+from app.plan_history import plan_shape
+from app.query_recommend import analyze_sql
+from app.stats_analysis import aggregate_query_stats
+from benchmarks.bench_query_recommend import make_orm_query
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_REPEAT = 5
+DEFAULT_TIME_THRESHOLD = 0.25  # +25% к медиане времени — регрессия
+DEFAULT_MEMORY_THRESHOLD = 0.25
+MIN_TIME_DELTA_S = 0.005  # шум таймера на быстрых функциях не считаем
+
+OLTP_QUERIES = 1_000
+ORM_QUERY_BYTES = 42_000  # ~10k токенов
+NESTED_DEPTH = 150
+SNAPSHOT_ROWS = 100_000
+PLAN_NODES = 1_000
+
+
+# --- Корпус ---
+_OLTP_TEMPLATES = (
+    "SELECT * FROM customer WHERE customer_id = {n}",
+    "SELECT rental_id, rental_date FROM rental WHERE customer_id = {n} "
+    "ORDER BY rental_date DESC LIMIT 10",
+    "UPDATE rental SET return_date = now() WHERE rental_id = {n}",
+    "INSERT INTO payment (customer_id, staff_id, rental_id, amount, payment_date) "
+    "VALUES ({n}, 1, {n}, 4.99, now())",
+    "DELETE FROM film_actor WHERE film_id = {n} AND actor_id = {m}",
+    "SELECT f.title, c.name FROM film f JOIN film_category fc ON fc.film_id = f.film_id "
+    "JOIN category c ON c.category_id = fc.category_id WHERE f.film_id = {n}",
+    "WITH r AS (SELECT customer_id, count(*) AS n FROM rental WHERE staff_id = {m} "
+    "GROUP BY customer_id) SELECT * FROM r WHERE n > {n}",
+)
+
+
+def make_oltp_queries(rnd: random.Random, count: int = OLTP_QUERIES):
+    return [
+        rnd.choice(_OLTP_TEMPLATES).format(
+            n=rnd.randrange(1, 100_000), m=rnd.randrange(1, 10)
+        )
+        for _ in range(count)
+    ]
+
+
+def make_nested_query(depth: int = NESTED_DEPTH) -> str:
+    sql = "SELECT id FROM t{0} WHERE t{0}.flag = true".format(depth)
+    for i in range(depth - 1, -1, -1):
+        sql = (
+            f"SELECT t{i}.id FROM t{i} WHERE t{i}.status = 'active' "
+            f"AND t{i}.parent_id IN ({sql})"
+        )
+    return sql + " ORDER BY 1"
+
+
+def make_snapshot(rnd: random.Random, rows: int = SNAPSHOT_ROWS):
+    """Строки pg_stat_statements: разные таблицы дают разные нормализованные тексты."""
+    snapshot = []
+    for queryid in range(rows):
+        template = rnd.choice(_OLTP_TEMPLATES)
+        query = template.format(n="$1", m="$2").replace(
+            " FROM ", f" FROM s{queryid % 5000}.", 1
+        )
+        calls = rnd.randrange(1, 50_000)
+        mean_ms = rnd.uniform(0.01, 50)
+        snapshot.append(
+            {
+                "queryid": queryid,
+                "query": query,
+                "calls": calls,
+                "rows": calls * rnd.randrange(0, 3),
+                "mean_exec_time": mean_ms,
+                "mean_time_ms": mean_ms,
+                "total_time_ms": mean_ms * calls,
+            }
+        )
+    return snapshot
+
+
+_NODE_TYPES = ("Hash Join", "Nested Loop", "Merge Join")
+_LEAF_TYPES = ("Seq Scan", "Index Scan", "Bitmap Heap Scan")
+
+
+def make_plan(rnd: random.Random, nodes: int = PLAN_NODES) -> dict:
+    """Сбалансированное дерево соединений с фактическими значениями и буферами."""
+
+    def node(n: int, depth: int) -> dict:
+        loops = rnd.randrange(1, 4)
+        item = {
+            "Node Type": rnd.choice(_LEAF_TYPES if n == 1 else _NODE_TYPES),
+            "Startup Cost": 0.0,
+            "Total Cost": float(n * 100),
+            "Plan Rows": rnd.randrange(1, 10_000),
+            "Actual Rows": rnd.randrange(0, 10_000),
+            "Actual Loops": loops,
+            "Actual Total Time": float(n) / loops,
+            "Shared Hit Blocks": n * 10,
+            "Shared Read Blocks": n,
+            "Temp Read Blocks": 0,
+            "Temp Written Blocks": 0,
+        }
+        if n == 1:
+            item["Relation Name"] = f"table_{depth}_{rnd.randrange(100)}"
+            item["Alias"] = "t"
+            return item
+        left = (n - 1) // 2
+        children = [node(left, depth + 1)] if left else []
+        children.append(node(n - 1 - left, depth + 1))
+        item["Join Type"] = "Inner"
+        item["Plans"] = children
+        return item
+
+    return {"Plan": node(nodes, 0), "Planning Time": 1.0, "Execution Time": nodes}
+
+
+def build_cases(seed: int):
+    rnd = random.Random(seed)
+    oltp = make_oltp_queries(rnd)
+    orm = make_orm_query(ORM_QUERY_BYTES)
+    nested = make_nested_query()
+    snapshot = make_snapshot(rnd)
+    texts = [r["query"] for r in snapshot]
+    plan = make_plan(rnd)
+
+    def quiet(func, *args, **kwargs):
+        # анализаторы печатают отчёт — в замер он не входит
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args, **kwargs)
+
+    # имя -> функция без аргументов
+    return {
+        "analyze_sql/oltp": lambda: [analyze_sql(q) for q in oltp],
+        "analyze_sql/orm": lambda: analyze_sql(orm),
+        "analyze_sql/nested": lambda: analyze_sql(nested),
+        "recommend_indexes/oltp": lambda: [recommend_indexes(q) for q in oltp],
+        "recommend_indexes/orm": lambda: recommend_indexes(orm),
+        "recommend_indexes/nested": lambda: recommend_indexes(nested),
+        "fingerprint/snapshot": lambda: [fingerprint(t) for t in texts],
+        "is_n1_like/snapshot": lambda: [is_n1_like(t) for t in texts],
+        "analyze_n_plus_one/snapshot": lambda: quiet(
+            analyze_n_plus_one, None, stat_rows=snapshot
+        ),
+        "aggregate_query_stats/snapshot": lambda: aggregate_query_stats(snapshot),
+        "analyze_plan/plan": lambda: analyze_plan(plan),
+        "plan_shape/plan": lambda: plan_shape(plan["Plan"]),
+    }
+
+
+# --- Замер ---
+def measure(func, repeat: int) -> dict:
+    func()  # прогрев: импорты, кэши регулярных выражений
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    # память — отдельным прогоном: tracemalloc заметно замедляет код
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "time_s": round(statistics.median(times), 6),
+        "min_s": round(min(times), 6),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, time_threshold, memory_threshold):
+    """Список регрессий относительно базовой линии."""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if (
+            cur["time_s"] > base["time_s"] * (1 + time_threshold)
+            and cur["time_s"] - base["time_s"] > MIN_TIME_DELTA_S
+        ):
+            regressions.append(
+                f"{name}: время {base['time_s']:.4f} -> {cur['time_s']:.4f} с"
+            )
+        if cur["peak_kb"] > base["peak_kb"] * (1 + memory_threshold):
+            regressions.append(
+                f"{name}: память {base['peak_kb']} -> {cur['peak_kb']} КБ"
+            )
+    return regressions
+
+
+def machine_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="записать результат как базу"
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--time-threshold", type=float, default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument(
+        "--memory-threshold", type=float, default=DEFAULT_MEMORY_THRESHOLD
+    )
+    parser.add_argument("--only", help="подстрока имени: запустить только эти замеры")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    cases = build_cases(args.seed)
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            stored = json.load(f)
+        baseline = stored["results"]
+        if stored.get("machine") != machine_info():
+            print(
+                "⚠️ Базовая линия снята на другой машине "
+                f"({stored.get('machine')}) — сравнение времени неточно."
+            )
+
+    results = {}
+    print(f"{'замер':<34}{'медиана с':>11}{'мин с':>10}{'пик КБ':>11}{'база с':>10}")
+    for name, func in cases.items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = r = measure(func, args.repeat)
+        base = baseline.get(name, {}).get("time_s")
+        base_txt = f"{base:10.4f}" if base is not None else f"{'-':>10}"
+        print(
+            f"{name:<34}{r['time_s']:11.4f}{r['min_s']:10.4f}{r['peak_kb']:11.1f}"
+            f"{base_txt}"
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {"machine": machine_info(), "seed": args.seed, "results": results},
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+        print(f"\nБазовая линия сохранена в {args.baseline}")
+        return
+
+    if not baseline:
+        print("\nℹ️ Базовой линии нет — запустите с --save-baseline.")
+        return
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+    if regressions:
+        print("\n❌ Регрессии:")
+        for line in regressions:
+            print("-", line)
+        sys.exit(1)
+    print("\n✅ Регрессий нет.")
+
+
+if __name__ == "__main__":
+    main()
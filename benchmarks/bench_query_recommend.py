@@ -0,0 +1,211 @@
+"""
+Бенчмарк analyze_sql на больших ORM-подобных запросах.
+
+Сравнивает однопроходный лексер (app.query_recommend) с прежней реализацией
+на наборе регулярных выражений (скопирована ниже как _legacy_analyze_sql).
+Ускорение даёт только нагрузка unions (старый код квадратичен по числу
+UNION/подзапросов); на joins обе реализации линейны и идут почти вровень.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_query_recommend [--sizes 0.25,0.5,1,2,4]
+"""
+import argparse
+import re
+import time
+
+from app.query_recommend import analyze_sql
+
+LEGACY_TIME_LIMIT = 60.0  # сек: дальше старую реализацию не гоняем
+
+
+# --- Генерация запросов ---
+def make_orm_query(target_bytes: int) -> str:
+    """
+    Запрос в стиле ORM: много LEFT JOIN, подзапросы в WHERE и огромный IN-список.
+    Примерно половина объёма — JOIN-ы, половина — IN (...).
+    """
+    parts = ["SELECT t0.id, t0.name, t0.created_at"]
+    joins = []
+    i = 1
+    size = 0
+    while size < target_bytes // 2:
+        j = (
+            f" LEFT OUTER JOIN table_{i} AS t{i} ON t{i}.parent_id = t{i - 1}.id"
+            f" AND t{i}.deleted_at IS NULL"
+        )
+        joins.append(j)
+        size += len(j)
+        i += 1
+    in_list = []
+    size = 0
+    n = 0
+    while size < target_bytes // 2:
+        item = f"{100000 + n}"
+        in_list.append(item)
+        size += len(item) + 2
+        n += 1
+    parts.append(" FROM base_table AS t0")
+    parts.extend(joins)
+    parts.append(
+        " WHERE t0.status = 'active' AND t0.id IN ("
+        + ", ".join(in_list)
+        + ") AND t0.owner_id IN (SELECT u.id FROM users u WHERE u.org_id = $1)"
+    )
+    parts.append(" ORDER BY t0.created_at DESC LIMIT 100")
+    return "".join(parts)
+
+
+def make_union_query(target_bytes: int) -> str:
+    """Пакетная выборка ORM: тысячи SELECT, склеенных через UNION ALL."""
+    parts = []
+    size = 0
+    i = 0
+    while size < target_bytes:
+        part = (
+            f"SELECT o.id, o.total, o.status FROM orders o "
+            f"WHERE o.customer_id = {i} AND o.status <> 'archived'"
+        )
+        parts.append(part)
+        size += len(part) + 11
+        i += 1
+    return " UNION ALL ".join(parts) + " ORDER BY 1 LIMIT 1000"
+
+
+WORKLOADS = {"joins": make_orm_query, "unions": make_union_query}
+
+
+# --- Прежняя реализация (регулярные выражения), только для сравнения ---
+def _legacy_remove_comments_and_literals(sql: str) -> str:
+    sql = re.sub(r"--.*?$", " ", sql, flags=re.MULTILINE)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    sql = re.sub(r"'(?:''|[^'])*'", "''", sql, flags=re.DOTALL)
+    sql = re.sub(r'"(?:\\"|[^"])*"', '""', sql, flags=re.DOTALL)
+    return sql
+
+
+def _legacy_extract_between(sql: str, start_kw: str, stop_kws: list):
+    pattern = (
+        r"\b"
+        + re.escape(start_kw)
+        + r"\b(.*?)(?:\b(?:"
+        + "|".join(map(re.escape, stop_kws))
+        + r")\b|$)"
+    )
+    m = re.search(pattern, sql, flags=re.DOTALL)
+    return m.group(1).strip() if m else ""
+
+
+def _legacy_analyze_sql(sql_query: str):
+    sql = sql_query.lower()
+    sql_clean = _legacy_remove_comments_and_literals(sql)
+    recommendations = []
+
+    has_select = bool(re.search(r"\bselect\b", sql_clean))
+    has_limit = bool(re.search(r"\blimit\b", sql_clean))
+    has_order_by = bool(re.search(r"\border\s+by\b", sql_clean))
+    has_group_by = bool(re.search(r"\bgroup\s+by\b", sql_clean))
+    has_having = bool(re.search(r"\bhaving\b", sql_clean))
+    union_count = len(re.findall(r"\bunion\b", sql_clean))
+
+    if re.search(r"\bselect\s*\*\b", sql_clean):
+        recommendations.append("select *")
+    if re.search(r"\bselect\b[\s\S]*?\(\s*select\b", sql_clean):
+        recommendations.append("subquery in select")
+    if has_select and not has_limit:
+        recommendations.append("no limit")
+
+    where_text = _legacy_extract_between(
+        sql_clean,
+        "where",
+        ["group by", "order by", "limit", "offset", "having", "union"],
+    )
+    if where_text:
+        if re.search(r"\b(date|lower|upper|cast)\s*\(", where_text):
+            recommendations.append("function in where")
+        if re.search(r"\bor\b", where_text):
+            recommendations.append("or")
+        if re.search(r"\bbetween\b", where_text):
+            recommendations.append("between")
+        if re.search(r"\b(?:like|ilike)\s*'%", where_text):
+            recommendations.append("like")
+        if re.search(r"\bin\s*\(\s*select\b", where_text):
+            recommendations.append("in subquery")
+
+    join_count = len(re.findall(r"\bjoin\b", sql_clean))
+    if join_count > 0:
+        if re.search(r"\bleft\s+join\b", sql_clean):
+            recommendations.append("left join")
+        join_positions = [m.start() for m in re.finditer(r"\bjoin\b", sql_clean)]
+        for pos in join_positions:
+            tail_match = re.search(
+                r"\b(join|where|group by|order by|limit|offset|having|union)\b",
+                sql_clean[pos + 4 :],
+            )
+            if tail_match:
+                end_idx = pos + 4 + tail_match.start()
+            else:
+                end_idx = len(sql_clean)
+            fragment = sql_clean[pos:end_idx]
+            if " on " not in fragment and " using " not in fragment:
+                recommendations.append("join without on")
+        if join_count > 4:
+            recommendations.append("many joins")
+
+    if re.search(r"\bin\s*\(\s*select\b", sql_clean) and "where" in sql_clean:
+        recommendations.append("in subquery (global)")
+    if re.search(r"\bunion\b(?!\s+all)", sql_clean):
+        recommendations.append("union")
+    if union_count > 1:
+        recommendations.append("many unions")
+    if has_order_by and not has_limit:
+        recommendations.append("order by without limit")
+    if has_having and not has_group_by:
+        recommendations.append("having without group by")
+    if re.search(r"\bcount\s*\(\s*\*\s*\)\b", sql_clean) and "where" not in sql_clean:
+        recommendations.append("count(*)")
+    if re.search(r"\boffset\b", sql_clean):
+        recommendations.append("offset")
+    return recommendations
+
+
+def _timed(func, arg):
+    started = time.perf_counter()
+    func(arg)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        default="0.5,1,2,4,8",
+        help="размеры запросов в мегабайтах через запятую",
+    )
+    parser.add_argument(
+        "--workloads",
+        default=",".join(WORKLOADS),
+        help=f"виды запросов: {', '.join(WORKLOADS)}",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'workload':>8} {'size MB':>8} {'lexer s':>9} {'legacy s':>9} {'speedup':>8}"
+    )
+    for workload in args.workloads.split(","):
+        make_query = WORKLOADS[workload]
+        legacy_enabled = True
+        for mb in (float(x) for x in args.sizes.split(",")):
+            query = make_query(int(mb * 1024 * 1024))
+            new_s = _timed(analyze_sql, query)
+            if legacy_enabled:
+                old_s = _timed(_legacy_analyze_sql, query)
+                # старая реализация растёт квадратично — не ждём её бесконечно
+                legacy_enabled = old_s < LEGACY_TIME_LIMIT / 4
+                old_txt, speedup = f"{old_s:9.3f}", f"{old_s / new_s:7.1f}x"
+            else:
+                old_txt, speedup = f"{'skip':>9}", f"{'-':>8}"
+            print(f"{workload:>8} {mb:8.2f} {new_s:9.3f} {old_txt} {speedup}")
+
+
+if __name__ == "__main__":
+    main()
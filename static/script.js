@@ -10,17 +10,29 @@ function readDbParams() {
     const dbname = el('dbname').value.trim();
     const user = el('user').value.trim();
     const password = el('password').value.trim();
+    const name = el('target-name').value.trim();
 
     if (host) db.host = host;
     if (port) db.port = port;
     if (dbname) db.dbname = dbname;
     if (user) db.user = user;
     if (password) db.password = password;
+    if (name) db.name = name;
   }
 
   return Object.keys(db).length ? db : undefined;
 }
 
+// Окно статистики в секундах (undefined — накопленные счётчики)
+function readStatsWindow() {
+  const value = el('stats-window').value;
+  return value ? Number(value) : undefined;
+}
+
+function readExplainMode() {
+  return el('explain-mode').value;
+}
+
 function toggleDbParams() {
   const dbChoice = document.querySelector('input[name="db-choice"]:checked').value;
   const customDbParams = el('custom-db-params');
@@ -53,6 +65,7 @@ async function sendDbChoiceToServer(dbChoice) {
       const result = await response.json();
       if (result.success) {
         log('Состояние dbChoice успешно сохранено.');
+        loadTargets();
       }
     } else {
       log('Ошибка при сохранении состояния dbChoice.');
@@ -64,6 +77,48 @@ async function sendDbChoiceToServer(dbChoice) {
 
 
 
+// Реестр целей: выбор хранится на сервере для сессии (cookie)
+async function loadTargets() {
+  try {
+    const res = await fetch('/targets/');
+    const data = await res.json();
+    const select = el('target-select');
+    select.innerHTML = '';
+    for (const t of data.targets) {
+      const option = document.createElement('option');
+      option.value = t.name;
+      option.textContent = `${t.name} (${t.user}@${t.host}:${t.port}/${t.dbname})`;
+      option.selected = t.name === data.selected;
+      select.appendChild(option);
+    }
+  } catch (e) {
+    log('Не удалось загрузить список целей: ' + e.message);
+  }
+}
+
+async function handleSelectTarget() {
+  const name = el('target-select').value;
+  try {
+    await postJson('/select_target/', { name });
+    log('Выбрана цель: ' + name);
+  } catch (e) {
+    log('Ошибка: ' + e.message);
+  }
+}
+
+async function handleFleetScan() {
+  log('Запрос: fleet_scan');
+  showResult('Loading...');
+  try {
+    const json = await postJson('/fleet_scan/', {});
+    showResult(json);
+    log(`fleet_scan успешно: ${json.targets} целей за ${json.elapsed_s} с`);
+  } catch (e) {
+    showResult({ error: e.message });
+    log('Ошибка: ' + e.message);
+  }
+}
+
 // Логирование сообщений
 function log(msg) {
   const box = el('log');
@@ -98,41 +153,154 @@ async function postJson(path, body) {
   return res.json();
 }
 
+// Текущий потоковый запрос: Cancel обрывает соединение, сервер отменяет работу
+let currentStream = null;
+
+// Потоковый запрос (Server-Sent Events поверх fetch: EventSource не умеет POST)
+async function postStream(path, body, onEvent, signal) {
+  const res = await fetch(path, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ...body, stream: true }),
+    signal
+  });
+
+  if (!res.ok) {
+    const text = await res.text();
+    throw new Error(`${res.status} ${res.statusText}: ${text}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    // события разделены пустой строкой: "event: ...\ndata: ...\n\n"
+    let end;
+    while ((end = buffer.indexOf('\n\n')) >= 0) {
+      const block = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : null);
+    }
+  }
+}
+
+// Запускает потоковый анализ и показывает промежуточные результаты:
+// ход работы, элементы по мере готовности (кандидаты, узлы плана), затем итог
+async function runStream(name, path, body) {
+  if (currentStream) currentStream.abort();
+  const controller = new AbortController();
+  currentStream = controller;
+  el('btn-cancel').disabled = false;
+
+  const view = { status: 'выполняется...', progress: null, items: [] };
+  log('Запрос: ' + name);
+  showResult(view);
+  try {
+    await postStream(path, body, function (event, data) {
+      if (event === 'progress') {
+        view.progress = data;
+      } else if (event === 'result') {
+        view.status = 'готово';
+        view.result = data;
+        delete view.progress;
+      } else if (event === 'error') {
+        view.status = 'ошибка';
+        view.error = data.detail;
+        log('Ошибка: ' + data.detail);
+      } else if (event === 'estimate') {
+        view.estimate = data;
+      } else {
+        view.items.push({ type: event, ...data });
+      }
+      showResult(view);
+    }, controller.signal);
+    if (view.status === 'готово') log(name + ' успешно');
+  } catch (e) {
+    if (e.name === 'AbortError') {
+      view.status = 'отменено';
+      showResult(view);
+      log(name + ' отменён');
+    } else {
+      showResult({ error: e.message });
+      log('Ошибка: ' + e.message);
+    }
+  } finally {
+    if (currentStream === controller) {
+      currentStream = null;
+      el('btn-cancel').disabled = true;
+    }
+  }
+}
+
+function handleCancel() {
+  if (currentStream) currentStream.abort();
+}
+
 // Обработчики для кнопок
 async function handleRunExplain() {
+  const query = el('query').value.trim();
+  if (!query) { alert('Нужно ввести SQL запрос.'); return; }
+  const body = { query, mode: readExplainMode(), db_params: readDbParams() };
+  await runStream('run_explain', '/run_explain/', body);
+}
+
+async function handleAnalyzeIndexes() {
   const query = el('query').value.trim();
   if (!query) { alert('Нужно ввести SQL запрос.'); return; }
   const body = { query, db_params: readDbParams() };
-  log('Запрос: run_explain');
+  log('Запрос: analyze_indexes');
   showResult('Loading...');
   try {
-    const json = await postJson('/run_explain/', body);
+    const json = await postJson('/analyze_indexes/', body);
     showResult(json);
-    log('run_explain успешно');
+    log('analyze_indexes успешно');
   } catch (e) {
     showResult({ error: e.message });
     log('Ошибка: ' + e.message);
   }
 }
 
-async function handleAnalyzeIndexes() {
+async function handleWhatIfIndexes() {
   const query = el('query').value.trim();
   if (!query) { alert('Нужно ввести SQL запрос.'); return; }
-  const body = { query, db_params: readDbParams() };
-  log('Запрос: analyze_indexes');
+  const body = { query, allow_build: el('whatif-allow-build').checked, db_params: readDbParams() };
+  log('Запрос: whatif_indexes');
   showResult('Loading...');
   try {
-    const json = await postJson('/analyze_indexes/', body);
+    const json = await postJson('/whatif_indexes/', body);
     showResult(json);
-    log('analyze_indexes успешно');
+    log('whatif_indexes успешно');
   } catch (e) {
     showResult({ error: e.message });
     log('Ошибка: ' + e.message);
   }
 }
 
-async function handleAnalyzeStats() {
+async function handleIndexHealth() {
   const body = { db_params: readDbParams() };
+  log('Запрос: analyze_index_health');
+  showResult('Loading...');
+  try {
+    const json = await postJson('/analyze_index_health/', body);
+    showResult(json);
+    log('analyze_index_health успешно');
+  } catch (e) {
+    showResult({ error: e.message });
+    log('Ошибка: ' + e.message);
+  }
+}
+
+async function handleAnalyzeStats() {
+  const body = { db_params: readDbParams(), window_seconds: readStatsWindow() };
   log('Запрос: analyze_stats');
   showResult('Loading...');
   try {
@@ -160,13 +328,140 @@ async function handleGetRecs() {
 }
 
 async function handleNPlus1() {
-  const body = { db_params: readDbParams() };
-  log('Запрос: analyze_n_plus_one');
-  showResult('Loading...');
+  const body = { db_params: readDbParams(), window_seconds: readStatsWindow() };
+  await runStream('analyze_n_plus_one', '/analyze_n_plus_one/', body);
+}
+
+async function handleSampleNPlus1() {
+  const body = { db_params: readDbParams(), duration_seconds: 10 };
+  await runStream('sample_n_plus_one (10 с)', '/sample_n_plus_one/', body);
+}
+
+async function handleSampleLocks() {
+  const body = { db_params: readDbParams(), duration_seconds: 10 };
+  await runStream('sample_locks (10 с)', '/sample_locks/', body);
+}
+
+// --- Живые метрики (WebSocket) ---
+const LIVE_POINTS = 120;  // точек на графике TPS
+let liveSocket = null;
+let livePoints = [];
+
+const LIVE_FIELDS = [
+  ['TPS', p => p.tps],
+  ['Коммитов/с', p => p.commits_per_s],
+  ['Откатов/с', p => p.rollbacks_per_s],
+  ['Попадание в кэш', p => p.cache_hit_ratio == null ? null : (p.cache_hit_ratio * 100).toFixed(2) + '%'],
+  ['Строк прочитано/с', p => p.tuples_returned_per_s == null ? null : p.tuples_returned_per_s + p.tuples_fetched_per_s],
+  ['Вставлено/с', p => p.tuples_inserted_per_s],
+  ['Обновлено/с', p => p.tuples_updated_per_s],
+  ['Удалено/с', p => p.tuples_deleted_per_s],
+  ['Temp, КБ/с', p => p.temp_bytes_per_s == null ? null : (p.temp_bytes_per_s / 1024).toFixed(1)],
+  ['Дедлоки', p => p.deadlocks],
+  ['Активных', p => p.sessions.active],
+  ['Idle', p => p.sessions.idle],
+  ['Idle in transaction', p => p.sessions.idle_in_transaction],
+  ['Сессий всего', p => p.sessions.total]
+];
+
+function renderLive() {
+  const box = el('live-metrics');
+  const last = livePoints[livePoints.length - 1];
+  if (!last) { box.textContent = 'Ожидание первой точки...'; return; }
+  box.innerHTML = '';
+  for (const [title, get] of LIVE_FIELDS) {
+    const value = get(last);
+    const div = document.createElement('div');
+    div.textContent = title;
+    const b = document.createElement('b');
+    b.textContent = value == null ? '—' : value;
+    div.prepend(b);
+    box.appendChild(div);
+  }
+
+  drawChart(el('live-chart'), livePoints.map(p => p.tps || 0), LIVE_POINTS, 'TPS');
+}
+
+// Линия по values; slots — ширина графика в точках (новые точки справа)
+function drawChart(canvas, values, slots, title) {
+  const ctx = canvas.getContext('2d');
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  const max = Math.max(1, ...values);
+  const step = canvas.width / Math.max(1, slots - 1);
+  ctx.strokeStyle = '#2563eb';
+  ctx.beginPath();
+  values.forEach((v, i) => {
+    const x = (slots - values.length + i) * step;
+    const y = canvas.height - (v / max) * (canvas.height - 4) - 2;
+    if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
+  });
+  ctx.stroke();
+  ctx.fillStyle = '#6b7280';
+  ctx.fillText(title + ', max ' + Math.round(max * 100) / 100, 4, 12);
+}
+
+function addLivePoint(point) {
+  if (point.error) { log('Живые метрики: ' + point.error); return; }
+  livePoints.push(point);
+  if (livePoints.length > LIVE_POINTS) livePoints.shift();
+}
+
+function handleLive() {
+  if (liveSocket) {
+    liveSocket.close();
+    return;
+  }
+  const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+  liveSocket = new WebSocket(`${scheme}://${location.host}/ws/live_metrics`);
+  el('btn-live').textContent = 'Stop Live';
+  livePoints = [];
+  renderLive();
+
+  liveSocket.onmessage = function (message) {
+    const data = JSON.parse(message.data);
+    if (data.history) {
+      data.history.slice(-LIVE_POINTS).forEach(addLivePoint);
+    } else {
+      addLivePoint(data);
+    }
+    renderLive();
+  };
+  liveSocket.onclose = function () {
+    liveSocket = null;
+    el('btn-live').textContent = 'Start Live';
+    log('Живые метрики остановлены');
+  };
+  log('Живые метрики: подключение');
+}
+
+// --- История метрик ---
+// вид -> [ряд одного объекта, топ за период, поле для графика, подпись]
+const HISTORY_KINDS = {
+  database: ['/history/database', null, 'tps', 'TPS'],
+  tables: ['/history/tables/', '/history/tables', 'n_dead_tup', 'Мёртвые строки'],
+  queries: ['/history/queries/', '/history/queries', 'mean_ms', 'Среднее время, мс']
+};
+
+async function handleHistory() {
+  const kind = el('history-kind').value;
+  const item = el('history-item').value.trim();
+  const hours = el('history-hours').value;
+  const [seriesPath, topPath, field, title] = HISTORY_KINDS[kind];
+  let path = seriesPath;
+  if (topPath) path = item ? seriesPath + encodeURIComponent(item) : topPath;
+  log('Запрос: история ' + kind + (item ? ' ' + item : ''));
   try {
-    const json = await postJson('/analyze_n_plus_one/', body);
+    const res = await fetch(`${path}?hours=${hours}`);
+    if (!res.ok) throw new Error(`${res.status} ${res.statusText}: ${await res.text()}`);
+    const json = await res.json();
     showResult(json);
-    log('analyze_n_plus_one успешно');
+    if (json.points) {
+      const values = json.points.map(p => p[field] || 0);
+      drawChart(el('history-chart'), values, values.length, `${title} (шаг ${json.resolution || 'сырой'})`);
+      log(`История: ${values.length} точек`);
+    } else {
+      log(`История: топ за период, ${json.items.length} объектов`);
+    }
   } catch (e) {
     showResult({ error: e.message });
     log('Ошибка: ' + e.message);
@@ -187,9 +482,18 @@ function init() {
 
   el('btn-run-explain').addEventListener('click', handleRunExplain);
   el('btn-analyze-indexes').addEventListener('click', handleAnalyzeIndexes);
+  el('btn-whatif-indexes').addEventListener('click', handleWhatIfIndexes);
+  el('btn-index-health').addEventListener('click', handleIndexHealth);
   el('btn-analyze-stats').addEventListener('click', handleAnalyzeStats);
   el('btn-get-recs').addEventListener('click', handleGetRecs);
   el('btn-nplus1').addEventListener('click', handleNPlus1);
+  el('btn-sample-nplus1').addEventListener('click', handleSampleNPlus1);
+  el('btn-sample-locks').addEventListener('click', handleSampleLocks);
+  el('btn-cancel').addEventListener('click', handleCancel);
+  el('btn-fleet-scan').addEventListener('click', handleFleetScan);
+  el('target-select').addEventListener('change', handleSelectTarget);
+  el('btn-live').addEventListener('click', handleLive);
+  el('btn-history').addEventListener('click', handleHistory);
   el('btn-clear').addEventListener('click', handleClear);
   el('btn-save-db').addEventListener('click', async function () {
     const dbParams = readDbParams();
@@ -202,7 +506,8 @@ function init() {
     try {
       const response = await postJson('/save_db_params/', dbParams);  // Отправляем как JSON
       if (response.success) {
-        log('Параметры базы данных успешно сохранены.');
+        log('Параметры базы данных успешно сохранены, цель: ' + response.target);
+        loadTargets();
         console.log('Сохраненные параметры:', response.saved_db_params);
         // Отобразить параметры в журнале
         log('Сохраненные параметры базы данных:');
@@ -0,0 +1,18 @@
+from app.batch_analysis import _fingerprint_chunk, build_workload
+
+
+def workload(queries):
+    return build_workload(queries, [], _fingerprint_chunk(queries))
+
+
+def test_leading_wildcard_like_not_merged():
+    items = workload(
+        [
+            "select * from film where title like 'a%'",
+            "select * from film where title like '%a'",
+            "select * from film where title like 'b%'",
+        ]
+    )
+    assert len(items) == 2
+    queries = {item["query"] for item in items}
+    assert "select * from film where title like '%a'" in queries
@@ -0,0 +1,18 @@
+import pytest
+
+from app.explain_analyze import check_single_statement
+
+# "$" внутри идентификатора не должен открывать dollar-строку
+DOLLAR_IDENT_PAYLOAD = (
+    "SELECT 1 AS a$b$; COMMIT; DELETE FROM rental; SELECT 1 AS x$b$"
+)
+
+
+def test_dollar_in_identifier_does_not_hide_statements():
+    with pytest.raises(ValueError):
+        check_single_statement(DOLLAR_IDENT_PAYLOAD)
+
+
+def test_single_statement_allowed():
+    check_single_statement("SELECT 1 AS a$b;")
+    check_single_statement("SELECT $tag$; DELETE$tag$ AS s")
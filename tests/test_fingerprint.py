@@ -0,0 +1,16 @@
+from app.fingerprint import fingerprint, normalize_query
+
+
+def test_like_pattern_shape_kept():
+    leading = "select * from film where title like '%x'"
+    prefix = "select * from film where title like 'x%'"
+    assert fingerprint(leading) != fingerprint(prefix)
+    assert fingerprint(leading) == fingerprint("select * from film where title like '%y'")
+    assert normalize_query("select 1 where a ilike '_b'") == "select ? where a ilike '%?'"
+
+
+def test_params_distinct_from_literals():
+    query = "select * from film where film_id = $1"
+    literal = "select * from film where film_id = 5"
+    assert fingerprint(query) == fingerprint(literal)
+    assert fingerprint(query, keep_params=True) != fingerprint(literal, keep_params=True)
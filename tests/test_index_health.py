@@ -0,0 +1,52 @@
+from app.index_health import collect_index_health
+
+
+def leaf(indexrelid, table, idx_scan, root=100):
+    return {
+        "schemaname": "public",
+        "table_name": table,
+        "index_name": f"{table}_v_idx",
+        "qualified_name": f"public.{table}_v_idx",
+        "relid": indexrelid + 1000,
+        "indexrelid": indexrelid,
+        "idx_scan": idx_scan,
+        "index_bytes": 8192,
+        "indisunique": False,
+        "indisprimary": False,
+        "indisexclusion": False,
+        "indisvalid": True,
+        "backs_constraint": False,
+        "partial": False,
+        "has_expressions": False,
+        "indkey": [2],
+        "indnkeyatts": 1,
+        "indclass": [1978],
+        "indcollation": [0],
+        "predicate": None,
+        "expressions": None,
+        "amname": "btree",
+        "index_tuples": 0,
+        "reloptions": None,
+        "block_size": 8192,
+        "parent_index": root,
+        "parent_index_name": "public.orders_v_idx",
+        "root_indexrelid": root,
+        "root_index": "public.orders_v_idx",
+        "root_index_table": "public.orders",
+        "root_table": "orders",
+        "n_tup_ins": 10,
+        "n_tup_non_hot_upd": 0,
+        "columns": ["v"],
+    }
+
+
+def test_unused_partition_index_rolls_up_to_parent():
+    health = collect_index_health([leaf(1, "orders_1", 0), leaf(2, "orders_2", 0)], {})
+    assert [(e["index"], e["partitions"]) for e in health["drop"]] == [
+        ("public.orders_v_idx", ["public.orders_1", "public.orders_2"])
+    ]
+
+
+def test_partition_index_used_anywhere_is_kept():
+    health = collect_index_health([leaf(1, "orders_1", 0), leaf(2, "orders_2", 7)], {})
+    assert health["drop"] == []
@@ -0,0 +1,54 @@
+from app.index_recommend import extract_index_candidates, synthesize_indexes
+
+
+def ddls(query):
+    return [entry["ddl"] for entry in synthesize_indexes(query)]
+
+
+def test_and_predicates_make_composite_index():
+    query = "select title from film where film_id = 5 and length > 100"
+    assert ddls(query) == ["CREATE INDEX ON film (film_id, length)"]
+
+
+def test_or_branches_get_separate_indexes():
+    # (film_id, length) не обслуживает вторую ветвь OR
+    query = "select title from film where film_id = 5 or length > 100"
+    assert ddls(query) == [
+        "CREATE INDEX ON film (film_id)",
+        "CREATE INDEX ON film (length)",
+    ]
+
+
+def test_common_conditions_prefix_each_or_branch():
+    query = (
+        "select * from film where rating = 'G' "
+        "and (film_id = 5 or length > 100) order by title"
+    )
+    assert ddls(query) == [
+        "CREATE INDEX ON film (rating, film_id)",
+        "CREATE INDEX ON film (rating, length)",
+    ]
+
+
+def test_or_inside_subquery_stays_in_its_scope():
+    query = (
+        "select * from film where a = 1 and b in (select x from t where y = 1 or z = 2)"
+    )
+    assert ddls(query) == [
+        "CREATE INDEX ON film (a, b)",
+        "CREATE INDEX ON t (y)",
+        "CREATE INDEX ON t (z)",
+    ]
+
+
+def roles(query):
+    return {(c["column"], c["role"]) for c in extract_index_candidates(query)}
+
+
+def test_like_is_range_only_for_prefix_pattern():
+    assert ("title", "range") in roles("select * from film where title like 'ab%'")
+    assert ("title", "range") not in roles("select * from film where title like '%ab'")
+    assert ("title", "range") not in roles("select * from film where title like '_b%'")
+    assert ("title", "range") not in roles("select * from film where title like $1")
+    assert ("title", "range") not in roles("select * from film where title ilike 'ab%'")
+    assert ddls("select * from film where title like '%ab'") == []
@@ -0,0 +1,39 @@
+from app.metrics_history import KINDS, HistoryStore
+
+HOUR = 3600
+INTERVAL = 15
+BASE = 1_700_000_000 - 1_700_000_000 % HOUR
+
+
+def database_row():
+    counters, gauges = KINDS["database"]
+    return (0.0,) * len(counters) + (1.0, 1.0)
+
+
+def fill_hour(store, target="t"):
+    """Час снимков по 15 с; запрос 42 выполнялся только в одном из них."""
+    for n in range(HOUR // INTERVAL):
+        data = {"database": {"": database_row()}}
+        if n == 10:
+            data["statements"] = {42: (10.0, 10.0, 5.0)}
+        store.write(target, BASE + n * INTERVAL, INTERVAL, data)
+    store.maintain(now=BASE + HOUR + 1, force=True)
+
+
+def test_rollup_rate_of_sparse_item_uses_bucket_length(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    fill_hour(store)
+    series = store.series("t", "statements", 42, BASE, BASE + HOUR, resolution=HOUR)
+    (point,) = series["points"]
+    assert point["calls"] == 10
+    assert point["seconds"] == HOUR
+    assert point["calls_per_s"] == round(10 / HOUR, 3)
+
+
+def test_top_rate_of_sparse_item_uses_covered_range(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    fill_hour(store)
+    top = store.top("t", "statements", BASE, BASE + HOUR - 1, "calls", resolution=0)
+    (entry,) = top["items"]
+    assert entry["seconds"] == HOUR
+    assert entry["calls_per_s"] == round(10 / HOUR, 3)
@@ -0,0 +1,27 @@
+from app.query_recommend import analyze_sql
+
+COUNT_STAR = "COUNT(*) без WHERE"
+ORDER_BY = "ORDER BY без LIMIT"
+
+
+def flagged(query, rule):
+    return any(rule in r for r in analyze_sql(query))
+
+
+def test_count_star_in_having_is_not_full_count():
+    query = "select a, count(*) from t group by a having count(*) > 1 limit 5"
+    assert not flagged(query, COUNT_STAR)
+
+
+def test_count_star_without_where():
+    assert flagged("select count(*) from t", COUNT_STAR)
+    assert not flagged("select count(*) from t where x = 1", COUNT_STAR)
+
+
+def test_order_by_in_subquery_limited_outside():
+    query = "select * from (select * from t order by x) s limit 10"
+    assert not flagged(query, ORDER_BY)
+
+
+def test_order_by_without_limit():
+    assert flagged("select * from t order by x", ORDER_BY)